@@ -16,6 +16,8 @@
 #include <cassert>
 #include <cstdlib>
 #include <iostream>
+#include <memory>
+#include <stdexcept>
 #include <vector>
 
 #include "canonical_encoders.h"
@@ -57,6 +59,40 @@ int CardIndex(int color,
   return color * num_ranks + rank;
 }
 
+// Non-owning output of the section encoders. Entry i of the encoding is
+// stored at data[i - begin], so that a suffix of the encoding can be written
+// straight into memory provided by the caller. The entries before <begin>
+// are not stored.
+class EncodingView {
+ public:
+  EncodingView(std::vector<float>* encoding)
+      : data_(encoding->data()), begin_(0), end_(encoding->size()) {}
+
+  EncodingView(float* data, int begin, int end)
+      : data_(data), begin_(begin), end_(end) {}
+
+  float& operator[](int i) {
+    assert(i >= begin_ && i < end_);
+    return data_[i - begin_];
+  }
+
+  float& at(int i) {
+    if (i < begin_ || i >= end_) {
+      throw std::out_of_range("EncodingView::at");
+    }
+    return data_[i - begin_];
+  }
+
+  int begin() const { return begin_; }
+
+  int size() const { return end_; }
+
+ private:
+  float* data_;
+  int begin_;
+  int end_;
+};
+
 int HandsSectionLength(const HanabiGame& game) {
   return game.NumPlayers() * game.HandSize() * BitsPerCard(game) +
          game.NumPlayers();
@@ -74,7 +110,7 @@ int EncodeHands(const HanabiGame& game,
                 const std::vector<int>& order,
                 bool shuffle_color,
                 const std::vector<int>& color_permute,
-                std::vector<float>* encoding) {
+                EncodingView* encoding) {
   int bits_per_card = BitsPerCard(game);
   int num_ranks = game.NumRanks();
   int num_players = game.NumPlayers();
@@ -105,7 +141,10 @@ int EncodeHands(const HanabiGame& game,
           // std::cout << card.Color() << ", " << card.Rank() << ", " << num_ranks << std::endl;
           auto card_idx = CardIndex(
               card.Color(), card.Rank(), num_ranks, shuffle_color, color_permute);
-          (*encoding).at(offset + card_idx) = 1;
+          // the own hand is dropped if the view starts after it
+          if (offset >= encoding->begin()) {
+            (*encoding).at(offset + card_idx) = 1;
+          }
         } else {
           assert(!card.IsValid());
           // (*encoding).at(offset + CardIndex(card.Color(), card.Rank(), num_ranks)) = 0;
@@ -163,7 +202,7 @@ int EncodeBoard(const HanabiGame& game,
                 bool shuffle_color,
                 // const std::vector<int>& color_permute,
                 const std::vector<int>& inv_color_permute,
-                std::vector<float>* encoding) {
+                EncodingView* encoding) {
   int num_colors = game.NumColors();
   int num_ranks = game.NumRanks();
   int num_players = game.NumPlayers();
@@ -254,7 +293,7 @@ int EncodeDiscards(const HanabiGame& game,
                    int start_offset,
                    bool shuffle_color,
                    const std::vector<int>& color_permute,
-                   std::vector<float>* encoding) {
+                   EncodingView* encoding) {
   int num_colors = game.NumColors();
   int num_ranks = game.NumRanks();
 
@@ -290,20 +329,20 @@ int EncodeDiscards(const HanabiGame& game,
 //  - Position played/discarded (<hand_size> bits; one-hot)
 //  - Card played/discarded (<num_colors> * <num_ranks> bits; one-hot)
 // Returns the number of entries written to the encoding.
-int EncodeLastAction_(const HanabiGame& game,
-                      const HanabiObservation& obs,
-                      int start_offset,
-                      const std::vector<int>& order,
-                      bool shuffle_color,
-                      const std::vector<int>& color_permute,
-                      std::vector<float>* encoding) {
+// <last_move> has observer relative players, nullptr if there is none.
+int EncodeLastMove(const HanabiGame& game,
+                   const HanabiHistoryItem* last_move,
+                   int start_offset,
+                   const std::vector<int>& order,
+                   bool shuffle_color,
+                   const std::vector<int>& color_permute,
+                   EncodingView* encoding) {
   int num_colors = game.NumColors();
   int num_ranks = game.NumRanks();
   int num_players = game.NumPlayers();
   int hand_size = game.HandSize();
 
   int offset = start_offset;
-  const HanabiHistoryItem* last_move = GetLastNonDealMove(obs.LastMoves());
   if (last_move == nullptr) {
     offset += LastActionSectionLength(game);
   } else {
@@ -421,6 +460,17 @@ int EncodeLastAction_(const HanabiGame& game,
   return offset - start_offset;
 }
 
+int EncodeLastAction_(const HanabiGame& game,
+                      const HanabiObservation& obs,
+                      int start_offset,
+                      const std::vector<int>& order,
+                      bool shuffle_color,
+                      const std::vector<int>& color_permute,
+                      EncodingView* encoding) {
+  return EncodeLastMove(game, GetLastNonDealMove(obs.LastMoves()), start_offset,
+                        order, shuffle_color, color_permute, encoding);
+}
+
 int CardKnowledgeSectionLength(const HanabiGame& game) {
   return game.NumPlayers() * game.HandSize() *
          (BitsPerCard(game) + game.NumColors() + game.NumRanks());
@@ -453,7 +503,7 @@ int EncodeCardKnowledge(const HanabiGame& game,
                         const std::vector<int>& order,
                         bool shuffle_color,
                         const std::vector<int>& color_permute,
-                        std::vector<float>* encoding) {
+                        EncodingView* encoding) {
   int bits_per_card = BitsPerCard(game);
   int num_colors = game.NumColors();
   int num_ranks = game.NumRanks();
@@ -524,7 +574,7 @@ int EncodeV0Belief_(const HanabiGame& game,
                     const std::vector<int>& order,
                     bool shuffle_color,
                     const std::vector<int>& color_permute,
-                    std::vector<float>* encoding,
+                    EncodingView* encoding,
                     std::vector<int>* ret_card_count,
                     bool publ) {
   // int bits_per_card = BitsPerCard(game);
@@ -547,7 +597,6 @@ int EncodeV0Belief_(const HanabiGame& game,
   const int per_card_offset = len / hand_size / num_players;
   assert(per_card_offset == num_colors * num_ranks + num_colors + num_ranks);
 
-  auto ref_encoding = *encoding;
   const std::vector<HanabiHand>& hands = obs.Hands();
   for (int player_id = 0; player_id < num_players; ++player_id) {
     int num_cards = hands[player_id].Cards().size();
@@ -560,8 +609,7 @@ int EncodeV0Belief_(const HanabiGame& game,
                       + i);
         // std::cout << offset << ", " << len << std::endl;
         assert(offset - start_offset < len);
-        (*encoding)[offset] *= card_count[i];
-        total += (*encoding)[offset];
+        total += (*encoding)[offset] * card_count[i];
       }
       if (total <= 0) {
         // const std::vector<HanabiHand>& hands = obs.Hands();
@@ -588,7 +636,7 @@ int EncodeV0Belief_(const HanabiGame& game,
                         + player_offset * player_id
                         + card_idx * per_card_offset
                         + x);
-          std::cout << ref_encoding[offset] << ", ";
+          std::cout << (*encoding)[offset] << ", ";
           if ((x+1) % 5 == 0) {
             std::cout << std::endl;
           }
@@ -604,7 +652,7 @@ int EncodeV0Belief_(const HanabiGame& game,
                       + player_offset * player_id
                       + card_idx * per_card_offset
                       + i);
-        (*encoding)[offset] /= total;
+        (*encoding)[offset] = (*encoding)[offset] * card_count[i] / total;
       }
     }
     if (!publ) {
@@ -643,9 +691,10 @@ std::vector<float> CanonicalObservationEncoder::EncodeLastAction(
     bool shuffle_color,
     const std::vector<int>& color_permute) const {
   std::vector<float> encoding(LastActionSectionLength(*parent_game_), 0);
+  EncodingView view(&encoding);
   int offset = 0;
   offset += EncodeLastAction_(
-      *parent_game_, obs, offset, order, shuffle_color, color_permute, &encoding);
+      *parent_game_, obs, offset, order, shuffle_color, color_permute, &view);
   assert(offset == encoding.size());
   return encoding;
 }
@@ -660,6 +709,7 @@ CanonicalObservationEncoder::EncodePrivateV0Belief(
   int myBeliefSize = size / parent_game_->NumPlayers();
 
   std::vector<float> encoding(size, 0);
+  EncodingView view(&encoding);
   std::vector<int> cardCount;
   int codeLen = EncodeV0Belief_(
       *parent_game_,
@@ -668,7 +718,7 @@ CanonicalObservationEncoder::EncodePrivateV0Belief(
       order,
       shuffle_color,
       color_permute,
-      &encoding,
+      &view,
       &cardCount,
       false);
   (void)codeLen;
@@ -677,42 +727,80 @@ CanonicalObservationEncoder::EncodePrivateV0Belief(
   return {privateV0, cardCount};
 }
 
-std::vector<float> CanonicalObservationEncoder::Encode(
-    const HanabiObservation& obs,
-    bool show_own_cards,
-    const std::vector<int>& order,
-    bool shuffle_color,
-    const std::vector<int>& color_permute,
-    const std::vector<int>& inv_color_permute,
-    bool hide_action) const {
-  // Make an empty bit string of the proper size.
-  std::vector<float> encoding(FlatLength(Shape()), 0);
-
+// Writes the canonical encoding into <encoding>, which must be zeroed.
+// Returns the length of the encoding.
+int EncodeCanonical(const HanabiGame& game,
+                    const HanabiObservation& obs,
+                    bool show_own_cards,
+                    const std::vector<int>& order,
+                    bool shuffle_color,
+                    const std::vector<int>& color_permute,
+                    const std::vector<int>& inv_color_permute,
+                    bool hide_action,
+                    EncodingView* encoding) {
   // This offset is an index to the start of each section of the bit vector.
   // It is incremented at the end of each section.
   int offset = 0;
 
   offset += EncodeHands(
-      *parent_game_, obs, offset, show_own_cards, order, shuffle_color, color_permute, &encoding);
+      game, obs, offset, show_own_cards, order, shuffle_color, color_permute, encoding);
   offset += EncodeBoard(
-      *parent_game_, obs, offset, shuffle_color, inv_color_permute, &encoding);
+      game, obs, offset, shuffle_color, inv_color_permute, encoding);
   offset += EncodeDiscards(
-      *parent_game_, obs, offset, shuffle_color, color_permute, &encoding);
+      game, obs, offset, shuffle_color, color_permute, encoding);
   if (hide_action) {
-    offset += LastActionSectionLength(*parent_game_);
+    offset += LastActionSectionLength(game);
   } else {
     offset += EncodeLastAction_(
-        *parent_game_, obs, offset, order, shuffle_color, color_permute, &encoding);
+        game, obs, offset, order, shuffle_color, color_permute, encoding);
   }
-  if (parent_game_->ObservationType() != HanabiGame::kMinimal) {
+  if (game.ObservationType() != HanabiGame::kMinimal) {
     offset += EncodeV0Belief_(
-        *parent_game_, obs, offset, order, shuffle_color, color_permute, &encoding, nullptr, true);
+        game, obs, offset, order, shuffle_color, color_permute, encoding, nullptr, true);
   }
+  return offset;
+}
 
+std::vector<float> CanonicalObservationEncoder::Encode(
+    const HanabiObservation& obs,
+    bool show_own_cards,
+    const std::vector<int>& order,
+    bool shuffle_color,
+    const std::vector<int>& color_permute,
+    const std::vector<int>& inv_color_permute,
+    bool hide_action) const {
+  // Make an empty bit string of the proper size.
+  std::vector<float> encoding(FlatLength(Shape()), 0);
+  EncodingView view(&encoding);
+  int offset = EncodeCanonical(
+      *parent_game_, obs, show_own_cards, order, shuffle_color, color_permute,
+      inv_color_permute, hide_action, &view);
+  (void)offset;
   assert(offset == encoding.size());
   return encoding;
 }
 
+int CanonicalObservationEncoder::PrivateLength() const {
+  return FlatLength(Shape()) - parent_game_->HandSize() * BitsPerCard(*parent_game_);
+}
+
+void CanonicalObservationEncoder::EncodePrivate(
+    const HanabiObservation& obs,
+    const std::vector<int>& order,
+    bool shuffle_color,
+    const std::vector<int>& color_permute,
+    const std::vector<int>& inv_color_permute,
+    bool hide_action,
+    float* encoding) const {
+  int length = FlatLength(Shape());
+  EncodingView view(encoding, length - PrivateLength(), length);
+  int offset = EncodeCanonical(
+      *parent_game_, obs, true, order, shuffle_color, color_permute,
+      inv_color_permute, hide_action, &view);
+  (void)offset;
+  assert(offset == length);
+}
+
 std::vector<float> CanonicalObservationEncoder::EncodeOwnHandTrinary(
     const HanabiObservation& obs) const {
   // hard code 5 cards, empty slot will be all zero
@@ -902,10 +990,11 @@ std::vector<float> CanonicalObservationEncoder::EncodeARV0Belief(
   int size = CardKnowledgeSectionLength(*parent_game_);
   int myBeliefSize = size / parent_game_->NumPlayers();
   std::vector<float> encoding(size);
+  EncodingView view(&encoding);
 
   // card knowledge
   const int len = EncodeCardKnowledge(
-      game, obs, 0, order, shuffle_color, color_permute, &encoding);
+      game, obs, 0, order, shuffle_color, color_permute, &view);
   const int player_offset = len / num_players;
   const int per_card_offset = len / hand_size / num_players;
   assert(per_card_offset == num_colors * num_ranks + num_colors + num_ranks);
@@ -942,4 +1031,256 @@ std::vector<float> CanonicalObservationEncoder::EncodeARV0Belief(
   return ret;
 }
 
+IncrementalPrivateEncoder::IncrementalPrivateEncoder(
+    const HanabiGame* parent_game, int check_freq)
+    : parent_game_(parent_game),
+      full_encoder_(parent_game),
+      check_freq_(check_freq),
+      encoding_(full_encoder_.PrivateLength(), 0) {}
+
+void IncrementalPrivateEncoder::EncodeFull(
+    const HanabiState& state,
+    int observer,
+    bool shuffle_color,
+    const std::vector<int>& color_permute,
+    const std::vector<int>& inv_color_permute,
+    bool hide_action,
+    float* encoding) const {
+  std::fill(encoding, encoding + full_encoder_.PrivateLength(), 0);
+  auto obs = HanabiObservation(state, observer, true);
+  full_encoder_.EncodePrivate(obs, std::vector<int>(), shuffle_color,
+                              color_permute, inv_color_permute, hide_action,
+                              encoding);
+}
+
+void IncrementalPrivateEncoder::Encode(
+    const HanabiState& state,
+    int observer,
+    bool shuffle_color,
+    const std::vector<int>& color_permute,
+    const std::vector<int>& inv_color_permute,
+    bool hide_action,
+    float* encoding) {
+  const HanabiGame& game = *parent_game_;
+  if (game.ObservationType() != HanabiGame::kCardKnowledge) {
+    EncodeFull(state, observer, shuffle_color, color_permute, inv_color_permute,
+               hide_action, encoding);
+    return;
+  }
+
+  int num_colors = game.NumColors();
+  int num_ranks = game.NumRanks();
+  int num_players = game.NumPlayers();
+  int hand_size = game.HandSize();
+  int bits_per_card = BitsPerCard(game);
+  int own_hand_length = hand_size * bits_per_card;
+  auto card_index = [&](int color, int rank) {
+    return CardIndex(color, rank, num_ranks, shuffle_color, color_permute);
+  };
+
+  // everything is rewritten if the options change
+  bool all = !valid_ || observer != observer_ ||
+             shuffle_color != shuffle_color_ || hide_action != hide_action_ ||
+             (shuffle_color && color_permute != color_permute_);
+  if (all) {
+    observer_ = observer;
+    shuffle_color_ = shuffle_color;
+    color_permute_ = color_permute;
+    hide_action_ = hide_action;
+    valid_ = true;
+  }
+  // positions in the private encoding, i.e. without the own hand
+  int board_start = HandsSectionLength(game) - own_hand_length;
+  int discard_start = board_start + BoardSectionLength(game);
+  int last_action_start = discard_start + DiscardSectionLength(game);
+  int knowledge_start = last_action_start + LastActionSectionLength(game);
+  EncodingView view(encoding_.data(), own_hand_length,
+                    own_hand_length + encoding_.size());
+  auto clear = [&](int begin, int end) {
+    std::fill(encoding_.begin() + begin, encoding_.begin() + end, 0);
+  };
+  const auto& hands = state.Hands();
+  auto hand = [&](int relative_player) -> const HanabiHand& {
+    return hands[(observer + relative_player) % num_players];
+  };
+
+  // hands of the others & missing card bits
+  std::vector<int> hands_key;
+  for (int player = 0; player < num_players; ++player) {
+    const auto& cards = hand(player).Cards();
+    hands_key.push_back(cards.size());
+    for (int i = 0; player > 0 && i < cards.size(); ++i) {
+      hands_key.push_back(card_index(cards[i].Color(), cards[i].Rank()));
+    }
+  }
+  if (all || hands_key != hands_key_) {
+    clear(0, board_start);
+    int key_idx = 0;
+    for (int player = 0; player < num_players; ++player) {
+      int num_cards = hands_key[key_idx++];
+      for (int i = 0; player > 0 && i < num_cards; ++i) {
+        int offset =
+            own_hand_length + ((player - 1) * hand_size + i) * bits_per_card;
+        view[offset + hands_key[key_idx++]] = 1;
+      }
+      if (num_cards < hand_size) {
+        view[num_players * own_hand_length + player] = 1;
+      }
+    }
+    hands_key_ = std::move(hands_key);
+  }
+
+  // board
+  std::vector<int> board_key = state.Fireworks();
+  board_key.push_back(state.Deck().Size());
+  board_key.push_back(state.InformationTokens());
+  board_key.push_back(state.LifeTokens());
+  if (all || board_key != board_key_) {
+    clear(board_start, discard_start);
+    // as EncodeBoard
+    int offset = board_start + own_hand_length;
+    for (int i = 0; i < state.Deck().Size(); ++i) {
+      view[offset + i] = 1;
+    }
+    offset += game.MaxDeckSize() - hand_size * num_players;
+    for (int c = 0; c < num_colors; ++c) {
+      int color = shuffle_color ? inv_color_permute[c] : c;
+      int firework = state.Fireworks()[color];
+      if (firework > 0) {
+        view[offset + firework - 1] = 1;
+      }
+      offset += num_ranks;
+    }
+    for (int i = 0; i < state.InformationTokens(); ++i) {
+      view[offset + i] = 1;
+    }
+    offset += game.MaxInformationTokens();
+    for (int i = 0; i < state.LifeTokens(); ++i) {
+      view[offset + i] = 1;
+    }
+    board_key_ = std::move(board_key);
+  }
+
+  // discards, also the public card count of the v0 belief
+  std::vector<int> discard_count(bits_per_card, 0);
+  for (const HanabiCard& card : state.DiscardPile()) {
+    ++discard_count[card_index(card.Color(), card.Rank())];
+  }
+  bool discard_changed = all || discard_count != discard_count_;
+  if (discard_changed) {
+    clear(discard_start, last_action_start);
+    int offset = discard_start + own_hand_length;
+    for (int c = 0; c < num_colors; ++c) {
+      for (int r = 0; r < num_ranks; ++r) {
+        for (int i = 0; i < discard_count[c * num_ranks + r]; ++i) {
+          view[offset + i] = 1;
+        }
+        offset += game.NumberCardInstances(c, r);
+      }
+    }
+    discard_count_ = discard_count;
+  }
+
+  // last move, always rewritten as it changes with every move
+  clear(last_action_start, knowledge_start);
+  if (!hide_action) {
+    const auto& history = state.MoveHistory();
+    auto it = std::find_if(history.rbegin(), history.rend(),
+                           [](const HanabiHistoryItem& item) {
+                             return item.move.MoveType() != HanabiMove::kDeal;
+                           });
+    std::unique_ptr<HanabiHistoryItem> last_move;
+    if (it != history.rend()) {
+      last_move.reset(new HanabiHistoryItem(*it));
+      last_move->player =
+          (last_move->player - observer + num_players) % num_players;
+    }
+    EncodeLastMove(game, last_move.get(), last_action_start + own_hand_length,
+                   std::vector<int>(), shuffle_color, color_permute, &view);
+  }
+
+  // v0 belief, a card is rewritten if its knowledge or the card count changed
+  std::vector<int> card_count(bits_per_card, 0);
+  for (int c = 0; c < num_colors; ++c) {
+    for (int r = 0; r < num_ranks; ++r) {
+      int idx = card_index(c, r);
+      card_count[idx] = game.NumberCardInstances(c, r) - discard_count[idx];
+      if (r < state.Fireworks()[c]) {
+        --card_count[card_index(c, r)];
+      }
+    }
+  }
+  bool count_changed = all || card_count != card_count_;
+  const int per_card_length = bits_per_card + num_colors + num_ranks;
+  const int key_length = 4;
+  knowledge_key_.resize(num_players * hand_size * key_length, 0);
+  for (int player = 0; player < num_players; ++player) {
+    const auto& knowledge = hand(player).Knowledge();
+    for (int i = 0; i < hand_size; ++i) {
+      int slot = player * hand_size + i;
+      int key[key_length] = {-1, -1, -1, -1};
+      if (i < knowledge.size()) {
+        key[0] = key[1] = 0;
+        for (int c = 0; c < num_colors; ++c) {
+          key[0] |= knowledge[i].ColorPlausible(c) << c;
+        }
+        for (int r = 0; r < num_ranks; ++r) {
+          key[1] |= knowledge[i].RankPlausible(r) << r;
+        }
+        key[2] = knowledge[i].Color();
+        key[3] = knowledge[i].Rank();
+      }
+      int* old_key = knowledge_key_.data() + slot * key_length;
+      if (!count_changed && std::equal(key, key + key_length, old_key)) {
+        continue;
+      }
+      std::copy(key, key + key_length, old_key);
+
+      int start = knowledge_start + slot * per_card_length;
+      clear(start, start + per_card_length);
+      if (key[0] < 0) {
+        continue;
+      }
+      int offset = start + own_hand_length;
+      for (int c = 0; c < num_colors; ++c) {
+        for (int r = 0; r < num_ranks; ++r) {
+          if ((key[0] >> c & 1) && (key[1] >> r & 1)) {
+            view[offset + card_index(c, r)] = 1;
+          }
+        }
+      }
+      float total = 0;
+      for (int k = 0; k < bits_per_card; ++k) {
+        total += view[offset + k] * card_count[k];
+      }
+      assert(total > 0);
+      for (int k = 0; k < bits_per_card; ++k) {
+        view[offset + k] = view[offset + k] * card_count[k] / total;
+      }
+      if (key[2] >= 0) {
+        int color = shuffle_color ? color_permute[key[2]] : key[2];
+        view[offset + bits_per_card + color] = 1;
+      }
+      if (key[3] >= 0) {
+        view[offset + bits_per_card + num_colors + key[3]] = 1;
+      }
+    }
+  }
+  card_count_ = std::move(card_count);
+
+  std::copy(encoding_.begin(), encoding_.end(), encoding);
+  if (check_freq_ > 0 && ++num_call_ % check_freq_ == 0) {
+    std::vector<float> expected(encoding_.size());
+    EncodeFull(state, observer, shuffle_color, color_permute, inv_color_permute,
+               hide_action, expected.data());
+    if (expected != encoding_) {
+      ++num_mismatch_;
+      std::cerr << "Warning: incremental encoding mismatch, using the full "
+                << "encoding" << std::endl;
+      std::copy(expected.begin(), expected.end(), encoding);
+      Reset();
+    }
+  }
+}
+
 }  // namespace hanabi_learning_env
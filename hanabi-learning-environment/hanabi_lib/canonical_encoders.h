@@ -43,6 +43,20 @@ class CanonicalObservationEncoder : public ObservationEncoder {
       const std::vector<int>& inv_color_permute,
       bool hide_action) const;
 
+  // Length of the encoding without the own hand section.
+  int PrivateLength() const;
+
+  // Encode() with show_own_cards but without the own hand section, written
+  // into <encoding>, which holds PrivateLength() zeroed floats.
+  void EncodePrivate(
+      const HanabiObservation& obs,
+      const std::vector<int>& order,
+      bool shuffle_color,
+      const std::vector<int>& color_permute,
+      const std::vector<int>& inv_color_permute,
+      bool hide_action,
+      float* encoding) const;
+
   std::vector<float> EncodeLastAction(
       const HanabiObservation& obs,
       const std::vector<int>& order,
@@ -83,6 +97,66 @@ class CanonicalObservationEncoder : public ObservationEncoder {
   const HanabiGame* parent_game_ = nullptr;
 };
 
+// Incremental form of CanonicalObservationEncoder::EncodePrivate() for one
+// observer, reading the state directly instead of a HanabiObservation. The
+// previous encoding is kept and a section, or a card of the card knowledge
+// section, is only rewritten when its inputs differ from the last call, so
+// that consecutive states of a game are cheap to encode. Any state can be
+// given, e.g. a fictitious one. Games with the minimal or seer observation
+// type always use the full encoder.
+class IncrementalPrivateEncoder {
+ public:
+  explicit IncrementalPrivateEncoder(const HanabiGame* parent_game,
+                                     int check_freq = 0);
+
+  // Every <check_freq>-th call (never if 0) is checked against the full
+  // encoder; on mismatch the full encoding is used and the kept one dropped.
+  void SetCheckFreq(int check_freq) { check_freq_ = check_freq; }
+
+  // Drops the kept encoding.
+  void Reset() { valid_ = false; }
+
+  // EncodePrivate() of HanabiObservation(state, observer, true) with no card
+  // order, into <encoding>, which holds PrivateLength() floats.
+  void Encode(const HanabiState& state,
+              int observer,
+              bool shuffle_color,
+              const std::vector<int>& color_permute,
+              const std::vector<int>& inv_color_permute,
+              bool hide_action,
+              float* encoding);
+
+  int NumMismatch() const { return num_mismatch_; }
+
+ private:
+  void EncodeFull(const HanabiState& state,
+                  int observer,
+                  bool shuffle_color,
+                  const std::vector<int>& color_permute,
+                  const std::vector<int>& inv_color_permute,
+                  bool hide_action,
+                  float* encoding) const;
+
+  const HanabiGame* parent_game_;
+  CanonicalObservationEncoder full_encoder_;
+  int check_freq_;
+  int num_call_ = 0;
+  int num_mismatch_ = 0;
+
+  // the kept encoding & its inputs, the card indices are color permuted
+  bool valid_ = false;
+  int observer_ = -1;
+  bool shuffle_color_ = false;
+  std::vector<int> color_permute_;
+  bool hide_action_ = false;
+  std::vector<int> hands_key_;
+  std::vector<int> board_key_;
+  std::vector<int> discard_count_;
+  std::vector<int> card_count_;
+  std::vector<int> knowledge_key_;
+  std::vector<float> encoding_;
+};
+
 int LastActionSectionLength(const HanabiGame& game);
 
 std::vector<int> ComputeCardCount(
@@ -24,6 +24,7 @@
 #include "hanabi_hand.h"
 #include "hanabi_history_item.h"
 #include "hanabi_move.h"
+#include "shared_history.h"
 
 #include <iostream>
 #include <sstream>
@@ -103,7 +104,7 @@ class HanabiState {
     std::vector<int> full_deck_card_count_;
     int total_count_ = -1;  // Total number of cards available to be dealt out.
     int num_ranks_ = -1;    // From game.NumRanks(), used to map card to index.
-    std::vector<int> deck_history_;
+    SharedHistory<int> deck_history_;
     bool intervened_ = false;
   };
 
@@ -157,7 +158,9 @@ class HanabiState {
   // Get the discard pile (the element at the back is the most recent discard.)
   const std::vector<HanabiCard>& DiscardPile() const { return discard_pile_; }
   // Sequence of moves from beginning of game. Stored as <move, actor>.
-  const std::vector<HanabiHistoryItem>& MoveHistory() const {
+  // Shared with the copies of this state, so that copying a state does not
+  // copy its whole history.
+  const SharedHistory<HanabiHistoryItem>& MoveHistory() const {
     return move_history_;
   }
 
@@ -202,7 +205,7 @@ class HanabiState {
   // Back element of discard_pile_ is most recently discarded card.
   std::vector<HanabiCard> discard_pile_;
   std::vector<HanabiHand> hands_;
-  std::vector<HanabiHistoryItem> move_history_;
+  SharedHistory<HanabiHistoryItem> move_history_;
   int cur_player_ = -1;
   int next_non_chance_player_ = -1;  // Next non-chance player to act.
   int information_tokens_ = -1;
@@ -0,0 +1,148 @@
+// Copyright 2018 Google LLC
+//
+// Licensed under the Apache License, Version 2.0 (the "License");
+// you may not use this file except in compliance with the License.
+// You may obtain a copy of the License at
+//
+//    https://www.apache.org/licenses/LICENSE-2.0
+//
+// Unless required by applicable law or agreed to in writing, software
+// distributed under the License is distributed on an "AS IS" BASIS,
+// WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+// See the License for the specific language governing permissions and
+// limitations under the License.
+
+#ifndef __SHARED_HISTORY_H__
+#define __SHARED_HISTORY_H__
+
+#include <cassert>
+#include <cstddef>
+#include <iterator>
+#include <memory>
+#include <stdexcept>
+#include <string>
+#include <vector>
+
+namespace hanabi_learning_env {
+
+// Append-only sequence whose copies share storage. Items are stored in
+// immutable chunks of kChunkSize, shared by all copies, plus a short tail
+// owned by each copy, so copying a history of n items costs
+// O(n / kChunkSize + kChunkSize) instead of O(n), and appending to a copy
+// never affects the others.
+template <typename T>
+class SharedHistory {
+ public:
+  static constexpr size_t kChunkSize = 32;
+
+  class const_iterator {
+   public:
+    using iterator_category = std::random_access_iterator_tag;
+    using value_type = T;
+    using difference_type = std::ptrdiff_t;
+    using pointer = const T*;
+    using reference = const T&;
+
+    const_iterator() = default;
+    const_iterator(const SharedHistory* history, difference_type index)
+        : history_(history), index_(index) {}
+
+    reference operator*() const { return (*history_)[index_]; }
+    pointer operator->() const { return &(*history_)[index_]; }
+    reference operator[](difference_type n) const {
+      return (*history_)[index_ + n];
+    }
+
+    const_iterator& operator++() { ++index_; return *this; }
+    const_iterator& operator--() { --index_; return *this; }
+    const_iterator operator++(int) { return {history_, index_++}; }
+    const_iterator operator--(int) { return {history_, index_--}; }
+    const_iterator& operator+=(difference_type n) { index_ += n; return *this; }
+    const_iterator& operator-=(difference_type n) { index_ -= n; return *this; }
+    const_iterator operator+(difference_type n) const {
+      return {history_, index_ + n};
+    }
+    const_iterator operator-(difference_type n) const {
+      return {history_, index_ - n};
+    }
+    difference_type operator-(const const_iterator& other) const {
+      return index_ - other.index_;
+    }
+
+    bool operator==(const const_iterator& other) const {
+      return index_ == other.index_;
+    }
+    bool operator!=(const const_iterator& other) const {
+      return index_ != other.index_;
+    }
+    bool operator<(const const_iterator& other) const {
+      return index_ < other.index_;
+    }
+    bool operator>(const const_iterator& other) const {
+      return index_ > other.index_;
+    }
+    bool operator<=(const const_iterator& other) const {
+      return index_ <= other.index_;
+    }
+    bool operator>=(const const_iterator& other) const {
+      return index_ >= other.index_;
+    }
+
+   private:
+    const SharedHistory* history_ = nullptr;
+    difference_type index_ = 0;
+  };
+  using const_reverse_iterator = std::reverse_iterator<const_iterator>;
+
+  size_t size() const { return chunks_.size() * kChunkSize + tail_.size(); }
+  bool empty() const { return chunks_.empty() && tail_.empty(); }
+
+  const T& operator[](size_t index) const {
+    size_t chunk = index / kChunkSize;
+    if (chunk < chunks_.size()) {
+      return (*chunks_[chunk])[index % kChunkSize];
+    }
+    return tail_[index - chunks_.size() * kChunkSize];
+  }
+  // bounds checked like std::vector::at, which callers such as the C API's
+  // StateGetMoveHistory rely on
+  const T& at(size_t index) const {
+    if (index >= size()) {
+      throw std::out_of_range("SharedHistory::at: index " + std::to_string(index) +
+                              " >= size " + std::to_string(size()));
+    }
+    return (*this)[index];
+  }
+  const T& back() const { return (*this)[size() - 1]; }
+
+  void push_back(const T& item) {
+    if (tail_.empty()) {
+      tail_.reserve(kChunkSize);
+    }
+    tail_.push_back(item);
+    if (tail_.size() == kChunkSize) {
+      chunks_.push_back(
+          std::make_shared<const std::vector<T>>(std::move(tail_)));
+      tail_.clear();
+    }
+  }
+
+  const_iterator begin() const { return {this, 0}; }
+  const_iterator end() const {
+    return {this, static_cast<std::ptrdiff_t>(size())};
+  }
+  const_reverse_iterator rbegin() const {
+    return const_reverse_iterator(end());
+  }
+  const_reverse_iterator rend() const {
+    return const_reverse_iterator(begin());
+  }
+
+ private:
+  std::vector<std::shared_ptr<const std::vector<T>>> chunks_;
+  std::vector<T> tail_;
+};
+
+}  // namespace hanabi_learning_env
+
+#endif
@@ -0,0 +1,242 @@
+// Checks that IncrementalPrivateEncoder::Encode() matches
+// CanonicalObservationEncoder::EncodePrivate() bit for bit over complete
+// random self-play games, as an actor would call it: one encoder per observer
+// kept across the game, with and without a color permutation and hide_action,
+// and on the fictitious off-belief state, i.e. the real state with the
+// actor's own hand resampled, before and after the fictitious move.
+//
+// Usage: incremental_encoder_check [num_game] [seed]
+// Exits with 1 if any encoding differs.
+
+#include <algorithm>
+#include <cstdlib>
+#include <iostream>
+#include <memory>
+#include <numeric>
+#include <random>
+#include <string>
+#include <unordered_map>
+#include <vector>
+
+#include "canonical_encoders.h"
+#include "hanabi_game.h"
+#include "hanabi_observation.h"
+#include "hanabi_state.h"
+
+namespace hle = hanabi_learning_env;
+
+namespace {
+
+struct Variant {
+  bool shuffle_color;
+  bool hide_action;
+};
+
+const Variant kVariants[] = {
+    {false, false}, {true, false}, {false, true}, {true, true}};
+const int kNumVariant = sizeof(kVariants) / sizeof(kVariants[0]);
+
+// an encoder kept across one game, for one observer & variant
+struct Stream {
+  Stream(const hle::HanabiGame* game, const Variant& v, std::mt19937* rng)
+      : variant(v), encoder(new hle::IncrementalPrivateEncoder(game, 0)) {
+    color_permute.resize(game->NumColors());
+    std::iota(color_permute.begin(), color_permute.end(), 0);
+    if (variant.shuffle_color) {
+      std::shuffle(color_permute.begin(), color_permute.end(), *rng);
+    }
+    inv_color_permute.resize(color_permute.size());
+    for (size_t i = 0; i < color_permute.size(); ++i) {
+      inv_color_permute[color_permute[i]] = i;
+    }
+  }
+
+  Variant variant;
+  std::vector<int> color_permute;
+  std::vector<int> inv_color_permute;
+  std::unique_ptr<hle::IncrementalPrivateEncoder> encoder;
+};
+
+struct Counter {
+  long num_check = 0;
+  long num_mismatch = 0;
+};
+
+void Check(const hle::HanabiGame& game,
+           const hle::HanabiState& state,
+           int observer,
+           Stream* stream,
+           const std::string& what,
+           Counter* counter) {
+  hle::CanonicalObservationEncoder full_encoder(&game);
+  int length = full_encoder.PrivateLength();
+  std::vector<float> expected(length, 0);
+  full_encoder.EncodePrivate(hle::HanabiObservation(state, observer, true),
+                             std::vector<int>(),
+                             stream->variant.shuffle_color,
+                             stream->color_permute,
+                             stream->inv_color_permute,
+                             stream->variant.hide_action,
+                             expected.data());
+  // garbage in the output must not leak into the incremental encoding
+  std::vector<float> actual(length, -1);
+  stream->encoder->Encode(state,
+                          observer,
+                          stream->variant.shuffle_color,
+                          stream->color_permute,
+                          stream->inv_color_permute,
+                          stream->variant.hide_action,
+                          actual.data());
+
+  ++counter->num_check;
+  if (actual != expected) {
+    ++counter->num_mismatch;
+    int first = 0;
+    while (actual[first] == expected[first]) {
+      ++first;
+    }
+    std::cerr << "Mismatch: " << what << ", observer " << observer
+              << ", shuffle_color " << stream->variant.shuffle_color
+              << ", hide_action " << stream->variant.hide_action
+              << ", first at " << first << " (" << actual[first] << " vs "
+              << expected[first] << ")\n"
+              << state.ToString() << "\n";
+  }
+}
+
+// Resamples <player>'s hand among the cards it cannot see, consistent with
+// its card knowledge, the way off-belief learning builds the fictitious state.
+// Keeps the hand if sampling gets stuck.
+void ResampleHand(const hle::HanabiGame& game,
+                  hle::HanabiState* state,
+                  int player,
+                  std::mt19937* rng) {
+  auto& hand = state->Hands()[player];
+  auto& deck = state->Deck();
+  std::vector<int> remain = deck.CardCount();
+  for (const auto& card : hand.Cards()) {
+    ++remain[deck.CardToIndex(card.Color(), card.Rank())];
+  }
+
+  std::vector<hle::HanabiCardValue> cards;
+  for (const auto& knowledge : hand.Knowledge()) {
+    std::vector<hle::HanabiCardValue> candidates;
+    std::vector<int> weights;
+    for (int c = 0; c < game.NumColors(); ++c) {
+      for (int r = 0; r < game.NumRanks(); ++r) {
+        int count = remain[deck.CardToIndex(c, r)];
+        if (count > 0 && knowledge.IsCardPlausible(c, r)) {
+          candidates.push_back(hle::HanabiCardValue(c, r));
+          weights.push_back(count);
+        }
+      }
+    }
+    if (candidates.empty()) {
+      return;
+    }
+    std::discrete_distribution<int> dist(weights.begin(), weights.end());
+    auto card = candidates[dist(*rng)];
+    --remain[deck.CardToIndex(card.Color(), card.Rank())];
+    cards.push_back(card);
+  }
+
+  deck.PutCardsBack(hand.Cards());
+  deck.DealCards(cards);
+  hand.SetCards(cards);
+}
+
+void ApplyMove(hle::HanabiState* state, const hle::HanabiMove& move) {
+  state->ApplyMove(move);
+  while (!state->IsTerminal() && state->CurPlayer() == hle::kChancePlayerId) {
+    state->ApplyRandomChance();
+  }
+}
+
+hle::HanabiMove RandomMove(const hle::HanabiState& state, std::mt19937* rng) {
+  auto legal_moves = state.LegalMoves(state.CurPlayer());
+  std::uniform_int_distribution<int> dist(0, legal_moves.size() - 1);
+  return legal_moves[dist(*rng)];
+}
+
+void CheckGame(int num_player, int seed, Counter* counter) {
+  std::unordered_map<std::string, std::string> params = {
+      {"players", std::to_string(num_player)},
+      {"random_start_player", "1"},
+      {"seed", std::to_string(seed)}};
+  hle::HanabiGame game(params);
+  std::mt19937 rng(seed);
+
+  // [observer][variant]: the real state; the fictitious state seen by the
+  // partner before the fictitious move and by the actor after it
+  std::vector<std::vector<std::unique_ptr<Stream>>> real(num_player);
+  std::vector<std::vector<std::unique_ptr<Stream>>> fict_partner(num_player);
+  std::vector<std::vector<std::unique_ptr<Stream>>> fict_self(num_player);
+  for (int p = 0; p < num_player; ++p) {
+    for (int v = 0; v < kNumVariant; ++v) {
+      real[p].emplace_back(new Stream(&game, kVariants[v], &rng));
+      fict_partner[p].emplace_back(new Stream(&game, kVariants[v], &rng));
+      fict_self[p].emplace_back(new Stream(&game, kVariants[v], &rng));
+    }
+  }
+  // one fictitious state per actor, assigned into at every step
+  std::vector<std::unique_ptr<hle::HanabiState>> fict_states(num_player);
+
+  hle::HanabiState state(&game);
+  while (state.CurPlayer() == hle::kChancePlayerId) {
+    state.ApplyRandomChance();
+  }
+  while (!state.IsTerminal()) {
+    for (int p = 0; p < num_player; ++p) {
+      for (int v = 0; v < kNumVariant; ++v) {
+        Check(game, state, p, real[p][v].get(), "real state", counter);
+      }
+    }
+
+    for (int p = 0; p < num_player; ++p) {
+      if (fict_states[p] == nullptr) {
+        fict_states[p].reset(new hle::HanabiState(state));
+      } else {
+        *fict_states[p] = state;
+      }
+      auto& fict = *fict_states[p];
+      ResampleHand(game, &fict, p, &rng);
+      int cur_player = fict.CurPlayer();
+      if (cur_player != p) {
+        for (int v = 0; v < kNumVariant; ++v) {
+          Check(game, fict, cur_player, fict_partner[cur_player][v].get(),
+                "fictitious state", counter);
+        }
+      }
+      ApplyMove(&fict, RandomMove(fict, &rng));
+      for (int v = 0; v < kNumVariant; ++v) {
+        Check(game, fict, p, fict_self[p][v].get(),
+              "fictitious next state", counter);
+      }
+    }
+
+    ApplyMove(&state, RandomMove(state, &rng));
+  }
+  for (int p = 0; p < num_player; ++p) {
+    for (int v = 0; v < kNumVariant; ++v) {
+      Check(game, state, p, real[p][v].get(), "terminal state", counter);
+    }
+  }
+}
+
+}  // namespace
+
+int main(int argc, char** argv) {
+  int num_game = argc > 1 ? std::atoi(argv[1]) : 20;
+  int seed = argc > 2 ? std::atoi(argv[2]) : 1;
+
+  Counter counter;
+  for (int i = 0; i < num_game; ++i) {
+    for (int num_player = 2; num_player <= 5; ++num_player) {
+      CheckGame(num_player, seed + i, &counter);
+    }
+  }
+  std::cout << "games: " << num_game << " per player count, encodings: "
+            << counter.num_check << ", mismatches: " << counter.num_mismatch
+            << std::endl;
+  return counter.num_mismatch == 0 ? 0 : 1;
+}
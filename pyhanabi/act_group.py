@@ -37,6 +37,14 @@ class ActGroup:
         gamma,
         off_belief,
         belief_model,
+        act_max_wait_us=0,
+        act_latency_budget_us=0,
+        num_act_worker=1,
+        act_num_thread=0,
+        max_concurrent_call=1,
+        hid_table=False,
+        incremental_obs=False,
+        incremental_obs_check_freq=1000,
     ):
         self.devices = devices.split(",")
 
@@ -47,6 +55,13 @@ class ActGroup:
             runner.add_method("compute_priority", 100)
             if off_belief:
                 runner.add_method("compute_target", 5000)
+            # act calls block the actors, serve them ahead of the bulk calls
+            runner.set_workers("act", num_act_worker, 1, act_num_thread)
+            runner.set_max_concurrent_call(max_concurrent_call)
+            if act_max_wait_us > 0 or act_latency_budget_us > 0:
+                runner.set_batch_policy(
+                    "act", 0, act_max_wait_us, act_latency_budget_us
+                )
             self.model_runners.append(runner)
         self.num_runners = len(self.model_runners)
 
@@ -83,6 +98,10 @@ class ActGroup:
                         max_len,
                         gamma,
                     )
+                    if hid_table:
+                        actor.use_hid_table()
+                    if incremental_obs:
+                        actor.use_incremental_encoder(incremental_obs_check_freq)
                     seed += 1
                     thread_actors.append([actor])
                 self.actors.append(thread_actors)
@@ -116,6 +135,10 @@ class ActGroup:
                                 actor.set_belief_runner(
                                     self.belief_runner[i % len(self.belief_runner)]
                                 )
+                        elif hid_table:
+                            actor.use_hid_table()
+                        if incremental_obs:
+                            actor.use_incremental_encoder(incremental_obs_check_freq)
                         seed += 1
                         game_actors.append(actor)
                     for k in range(num_player):
@@ -134,6 +157,14 @@ class ActGroup:
             for runner in self.belief_runner:
                 runner.start()
 
+    def batch_stats(self):
+        """per runner, per method batch size & wait histograms"""
+        return [runner.stats() for runner in self.model_runners]
+
     def update_model(self, agent):
         for runner in self.model_runners:
             runner.update_model(agent)
+
+    def model_version(self):
+        """number of update_model calls, the act replies carry theirs"""
+        return self.model_runners[0].model_version()
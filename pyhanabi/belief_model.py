@@ -187,6 +187,67 @@ class ARBeliefModel(torch.jit.ScriptModule):
             "c0": c.transpose(0, 1).contiguous(),
         }
 
+    @torch.jit.script_method
+    def decode(self, o: torch.Tensor, obs: Dict[str, torch.Tensor]) -> torch.Tensor:
+        """
+        draw num_sample hands for each row of o: [batch, hid_dim]
+        the single layer auto_regress LSTM is unrolled by hand: the part of the
+        gates that comes from o is computed once, and the card embedding is
+        folded into a [25, 4 * hid_dim] table of gates, so that a step is a
+        lookup & a matmul with the hidden state, without one-hot/cat buffers
+        return: [batch, num_sample, hand_size]
+        """
+        bsize = o.size(0)
+        num_sample = self.num_sample
+        emb_dim = self.hid_dim // 8
+        w_ih = self.auto_regress.weight_ih_l0
+        w_hh_t = self.auto_regress.weight_hh_l0.t()
+        bias = self.auto_regress.bias_ih_l0 + self.auto_regress.bias_hh_l0
+        # the input is [card emb, o], the emb of the first card is 0
+        o_gates = torch.addmm(bias, o, w_ih[:, emb_dim:].t()).unsqueeze(1)
+        card_gates = torch.mm(self.emb.weight.t(), w_ih[:, :emb_dim].t())
+
+        # given the remaining count of each card, mask the cards that are used
+        # up or ruled out by the hints (zero in v0) at every step, so that the
+        # samples are valid hands by construction
+        constrained = "card_count" in obs
+        remain = torch.ones(bsize, num_sample, 25, device=o.device)
+        plausible = torch.ones(
+            bsize, self.hand_size, 25, dtype=torch.bool, device=o.device
+        )
+        if constrained:
+            remain = obs["card_count"].unsqueeze(1).repeat(1, num_sample, 1)
+            v0 = obs["v0"].view(bsize, self.hand_size, -1)[:, :, :25]
+            plausible = v0 > 0
+        used = torch.full((bsize, num_sample, 1), -1.0, device=o.device)
+
+        h = torch.zeros(bsize, num_sample, self.hid_dim, device=o.device)
+        c = torch.zeros(bsize, num_sample, self.hid_dim, device=o.device)
+        gates = o_gates
+        sample = torch.zeros(
+            bsize, num_sample, self.hand_size, dtype=torch.long, device=o.device
+        )
+        for i in range(self.hand_size):
+            gates = gates + torch.matmul(h, w_hh_t)
+            in_gate, forget_gate, cell_gate, out_gate = gates.chunk(4, 2)
+            c = forget_gate.sigmoid() * c + in_gate.sigmoid() * cell_gate.tanh()
+            h = out_gate.sigmoid() * c.tanh()
+            logit = self.fc(h)
+            if constrained:
+                valid = (remain > 0) & plausible[:, i : i + 1]
+                # empty slots (smaller hand) & dead ends are left unmasked, the
+                # actor rejects such samples
+                valid = valid | ~valid.any(2, keepdim=True)
+                logit = logit.masked_fill(~valid, float("-inf"))
+            prob = nn.functional.softmax(logit, 2)
+            sample_t = prob.view(bsize * num_sample, -1).multinomial(1)
+            sample_t = sample_t.view(bsize, num_sample, 1)
+            sample[:, :, i : i + 1] = sample_t
+            if constrained:
+                remain.scatter_add_(2, sample_t, used)
+            gates = o_gates + card_gates[sample_t.squeeze(2)]
+        return sample
+
     @torch.jit.script_method
     def sample(self, obs: Dict[str, torch.Tensor]) -> Dict[str, torch.Tensor]:
         bsize, num_lstm_layer, num_player, dim = obs["h0"].size()
@@ -204,31 +265,7 @@ class ARBeliefModel(torch.jit.ScriptModule):
 
         assert seq == 1, "seqlen should be 1"
         # assert bsize == 1, "batchsize for BeliefModel.sample should be 1"
-        o = o.view(bsize, hid_dim)
-        o = o.unsqueeze(1).expand(bsize, self.num_sample, hid_dim)
-
-        in_t = torch.zeros(bsize, self.num_sample, hid_dim // 8, device=o.device)
-        shape = (1, bsize * self.num_sample, self.hid_dim)
-        ar_hid = (
-            torch.zeros(*shape, device=o.device),
-            torch.zeros(*shape, device=o.device),
-        )
-        sample_list = []
-        for i in range(self.hand_size):
-            ar_in = torch.cat([in_t, o], 2).view(bsize * self.num_sample, 1, -1)
-            ar_out, ar_hid = self.auto_regress(ar_in, ar_hid)
-            logit = self.fc(ar_out.squeeze(1))
-            prob = nn.functional.softmax(logit, 1)
-            sample_t = prob.multinomial(1)
-            sample_t = sample_t.view(bsize, self.num_sample)
-            onehot_sample_t = torch.zeros(
-                bsize, self.num_sample, 25, device=sample_t.device
-            )
-            onehot_sample_t.scatter_(2, sample_t.unsqueeze(2), 1)
-            in_t = self.emb(onehot_sample_t)
-            sample_list.append(sample_t)
-
-        sample = torch.stack(sample_list, 2)
+        sample = self.decode(o.view(bsize, hid_dim), obs)
 
         h = h.view(num_lstm_layer, bsize, num_player, dim)
         c = c.view(num_lstm_layer, bsize, num_player, dim)
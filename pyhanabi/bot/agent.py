@@ -42,10 +42,8 @@ class RLAgent(Agent):
         return h0
 
     def observe_and_maybe_act(self, state: HleGameState, hid):
-        priv_s, publ_s, legal_move = state.observe()
-        adv, new_hid = self.agent.online_net.act(
-            priv_s, publ_s, hid,
-        )
+        priv_s, legal_move = state.observe()
+        adv, new_hid = self.agent.online_net.act(priv_s, hid)
         move = None
         if state.is_my_turn():
             # assert self.next_moves[table_id] is None
@@ -72,10 +70,8 @@ class SLAgent(Agent):
         return h0
 
     def observe_and_maybe_act(self, state: HleGameState, hid):
-        priv_s, publ_s, legal_move = state.observe()
-        logit, new_hid = self.agent.forward(
-            priv_s.unsqueeze(0), publ_s.unsqueeze(0), hid,
-        )
+        priv_s, legal_move = state.observe()
+        logit, new_hid = self.agent.forward(priv_s.unsqueeze(0), hid)
         move = None
         if state.is_my_turn():
             logit = logit.squeeze()
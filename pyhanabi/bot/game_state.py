@@ -188,11 +188,10 @@ class HleGameState:
 
         obs = torch.tensor(obs_vec, dtype=torch.float32)
         priv_s = obs[125:].unsqueeze(0)
-        publ_s = obs[125 * self.num_player:].unsqueeze(0)
 
         legal_move = torch.tensor(legal_move_vec, dtype=torch.float32)
 
-        return priv_s, publ_s, legal_move
+        return priv_s, legal_move
 
     def convert_move(self, hle_move):
         type_map = {
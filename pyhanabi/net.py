@@ -8,8 +8,17 @@ from collections import OrderedDict
 import torch
 import torch.nn as nn
 from typing import Tuple, Dict, Optional
-from itertools import permutations
 import common_utils
+from symmetry import (
+    ColourSymmetry,
+    GroupLiftLinear,
+    GroupLinear,
+    GroupLSTM,
+    GroupOutputLinear,
+    GroupPoolLinear,
+    perm_tables,
+    relative_table,
+)
 import math
 
 
@@ -83,7 +92,7 @@ class FFWDNet(torch.jit.ScriptModule):
 
     @torch.jit.script_method
     def act(
-        self, priv_s: torch.Tensor, publ_s: torch.Tensor, hid: Dict[str, torch.Tensor]
+        self, priv_s: torch.Tensor, hid: Dict[str, torch.Tensor]
     ) -> Tuple[torch.Tensor, Dict[str, torch.Tensor]]:
         assert priv_s.dim() == 2, "dim should be 2, [batch, dim], get %d" % priv_s.dim()
         o = self.net(priv_s)
@@ -94,10 +103,10 @@ class FFWDNet(torch.jit.ScriptModule):
     def forward(
         self,
         priv_s: torch.Tensor,
-        publ_s: torch.Tensor,
         legal_move: torch.Tensor,
         action: torch.Tensor,
         hid: Dict[str, torch.Tensor],
+        seq_len: Optional[torch.Tensor] = None,
     ) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor]:
         assert (
             priv_s.dim() == 3 or priv_s.dim() == 2
@@ -172,7 +181,6 @@ class LSTMNet(torch.jit.ScriptModule):
     def act(
         self,
         priv_s: torch.Tensor,
-        publ_s: torch.Tensor,
         hid: Dict[str, torch.Tensor],
     ) -> Tuple[torch.Tensor, Dict[str, torch.Tensor]]:
         assert priv_s.dim() == 2
@@ -210,10 +218,10 @@ class LSTMNet(torch.jit.ScriptModule):
     def forward(
         self,
         priv_s: torch.Tensor,
-        publ_s: torch.Tensor,
         legal_move: torch.Tensor,
         action: torch.Tensor,
         hid: Dict[str, torch.Tensor],
+        seq_len: Optional[torch.Tensor] = None,
     ) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor]:
         assert (
             priv_s.dim() == 3 or priv_s.dim() == 2
@@ -222,15 +230,23 @@ class LSTMNet(torch.jit.ScriptModule):
         one_step = False
         if priv_s.dim() == 2:
             priv_s = priv_s.unsqueeze(0)
-            publ_s = publ_s.unsqueeze(0)
             legal_move = legal_move.unsqueeze(0)
             action = action.unsqueeze(0)
             one_step = True
         x = self.net(priv_s)
         if len(hid) == 0:
             o, _ = self.lstm(x)
-        else:
+        elif seq_len is None:
             o, _ = self.lstm(x, (hid["h0"], hid["c0"]))
+        else:
+            # skip the padding steps beyond the length of each sequence
+            packed_x = nn.utils.rnn.pack_padded_sequence(
+                x, seq_len.long().cpu(), enforce_sorted=False
+            )
+            packed_o, _ = self.lstm(packed_x, (hid["h0"], hid["c0"]))
+            o, _ = nn.utils.rnn.pad_packed_sequence(
+                packed_o, total_length=x.size(0)
+            )
         a = self.fc_a(o)
         v = self.fc_v(o)
         q = duel(v, a, legal_move)
@@ -270,6 +286,8 @@ class PublicLSTMNet(torch.jit.ScriptModule):
             self.in_dim = in_dim
             self.priv_in_dim = in_dim[1]
             self.publ_in_dim = in_dim[2]
+        # publ_s is a view of priv_s, see public_view
+        self.publ_offset = self.priv_in_dim - self.publ_in_dim
 
         self.hid_dim = hid_dim
         self.out_dim = out_dim
@@ -310,11 +328,15 @@ class PublicLSTMNet(torch.jit.ScriptModule):
         hid = {"h0": torch.zeros(*shape), "c0": torch.zeros(*shape)}
         return hid
 
+    @torch.jit.script_method
+    def public_view(self, priv_s: torch.Tensor) -> torch.Tensor:
+        """publ_s is the suffix of priv_s without the partner hands, no copy"""
+        return priv_s.narrow(priv_s.dim() - 1, self.publ_offset, self.publ_in_dim)
+
     @torch.jit.script_method
     def act(
         self,
         priv_s: torch.Tensor,
-        publ_s: torch.Tensor,
         hid: Dict[str, torch.Tensor],
     ) -> Tuple[torch.Tensor, Dict[str, torch.Tensor]]:
         assert priv_s.dim() == 2
@@ -329,9 +351,8 @@ class PublicLSTMNet(torch.jit.ScriptModule):
         }
 
         priv_s = priv_s.unsqueeze(0)
-        publ_s = publ_s.unsqueeze(0)
 
-        x = self.publ_net(publ_s)
+        x = self.publ_net(self.public_view(priv_s))
         publ_o, (h, c) = self.lstm(x, (hid["h0"], hid["c0"]))
 
         priv_o = self.priv_net(priv_s)
@@ -356,10 +377,10 @@ class PublicLSTMNet(torch.jit.ScriptModule):
     def forward(
         self,
         priv_s: torch.Tensor,
-        publ_s: torch.Tensor,
         legal_move: torch.Tensor,
         action: torch.Tensor,
         hid: Dict[str, torch.Tensor],
+        seq_len: Optional[torch.Tensor] = None,
     ) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor]:
         assert (
             priv_s.dim() == 3 or priv_s.dim() == 2
@@ -368,16 +389,24 @@ class PublicLSTMNet(torch.jit.ScriptModule):
         one_step = False
         if priv_s.dim() == 2:
             priv_s = priv_s.unsqueeze(0)
-            publ_s = publ_s.unsqueeze(0)
             legal_move = legal_move.unsqueeze(0)
             action = action.unsqueeze(0)
             one_step = True
 
-        x = self.publ_net(publ_s)
+        x = self.publ_net(self.public_view(priv_s))
         if len(hid) == 0:
             publ_o, _ = self.lstm(x)
-        else:
+        elif seq_len is None:
             publ_o, _ = self.lstm(x, (hid["h0"], hid["c0"]))
+        else:
+            # skip the padding steps beyond the length of each sequence
+            packed_x = nn.utils.rnn.pack_padded_sequence(
+                x, seq_len.long().cpu(), enforce_sorted=False
+            )
+            packed_o, _ = self.lstm(packed_x, (hid["h0"], hid["c0"]))
+            publ_o, _ = nn.utils.rnn.pad_packed_sequence(
+                packed_o, total_length=x.size(0)
+            )
         priv_o = self.priv_net(priv_s)
         o = priv_o * publ_o
         a = self.fc_a(o)
@@ -406,7 +435,19 @@ class PublicLSTMNet(torch.jit.ScriptModule):
 class EquivariantLSTMNet(torch.jit.ScriptModule):
     __constants__ = ["hid_dim", "out_dim", "num_lstm_layer"]
 
-    def __init__(self, device, in_dim, hid_dim, out_dim, num_lstm_layer):
+    def __init__(
+        self,
+        device,
+        in_dim,
+        hid_dim,
+        out_dim,
+        num_lstm_layer,
+        group_type="cyclic",
+        num_symmetry_sample=0,
+        keep_identity=False,
+        exact_act=True,
+        group_colour=False,
+    ):
         super().__init__()
         # for backward compatibility
         if isinstance(in_dim, int):
@@ -444,86 +485,17 @@ class EquivariantLSTMNet(torch.jit.ScriptModule):
         self.pred_1st = nn.Linear(self.hid_dim, 5 * 3)
 
         # group symmetry
-        self.group_type = "cyclic"
-        colours = [0, 1, 2, 3, 4]
-        if self.group_type == "cyclic":
-            self.symmetries = torch.tensor([[0,1,2,3,4],[4,0,1,2,3],[3,4,0,1,2],[2,3,4,0,1],[1,2,3,4,0]])
-        elif self.group_type == "dihedral":
-            self.symmetries = torch.tensor([[0,1,2,3,4],
-              [1,2,3,4,0],
-              [2,3,4,0,1],
-              [3,4,0,1,2],
-              [4,0,1,2,3],
-              [0,4,3,2,1],
-              [4,3,2,1,0],
-              [3,2,1,0,4],
-              [2,1,0,4,3],
-              [1,0,4,3,2]])
-        else: # symmetric group
-            self.symmetries = torch.tensor(list(permutations(colours)))
-        self.num_symmetries = len(self.symmetries)
-        self.inv_symmetries = torch.argsort(self.symmetries)
-        self.input_perms = torch.eye((self.priv_in_dim))
-        self.output_perms = torch.eye((out_dim))
-        # input permutations
-        for symm in self.symmetries[1:]:
-            perm = torch.eye(self.priv_in_dim)
-
-            # partner hand
-            card_perm = torch.zeros(25)
-            for i,idx in enumerate(symm):
-                temp = torch.tensor([0,1,2,3,4], dtype=torch.long)
-                temp = 5*i+temp
-                card_perm[5*idx:5*(idx+1)] = temp
-
-            hand_perm = torch.zeros(125, dtype=torch.long)
-            for i in range(5):
-                hand_perm[25*i:25*(i+1)] = card_perm + 25*i
-
-            perm[0:125] = perm[hand_perm]
-
-             # fireworks
-            fireworks_perm = card_perm + 167
-            perm[167:192] = perm[fireworks_perm.long()]
-
-            # discards
-            discards_perm = torch.zeros(50, dtype=torch.long)
-            for i,idx in enumerate(symm):
-                temp = torch.tensor([203,204,205,206,207,208,209,210,211,212], dtype=torch.long)
-                temp = 10*i+temp
-                discards_perm[10*idx:10*(idx+1)] = temp
-
-            perm[203:253] = perm[discards_perm]
-
-            # last action
-            which_colour_perm = torch.tensor([261,261,261,261,261], dtype=torch.long) + symm
-            perm[261:266] = perm[which_colour_perm]
-            perm[281:306] = perm[card_perm.long() + 281]
-
-            # V0
-            for i in range(10):
-                perm[308+35*i:333+35*i] = perm[card_perm.long() + 308+35*i]
-                directly_revealed_colour_perm = torch.tensor([333,333,333,333,333], dtype=torch.long) + 35*i + symm
-                perm[333+35*i:338+35*i] = perm[directly_revealed_colour_perm]
-
-            # greedy action
-            if (self.priv_in_dim == 713):
-                which_colour_perm = torch.tensor([666,666,666,666,666], dtype=torch.long) + symm
-                perm[666:671] = perm[which_colour_perm]
-                perm[686:711] = perm[card_perm.long() + 686]
-
-            self.input_perms = torch.cat([self.input_perms, perm])
-        self.input_perms = self.input_perms.transpose(0, 1)
-        # output permutations, inverse of input transforms
-        for symm in self.inv_symmetries[1:]:
-            perm = torch.eye(self.out_dim)
-            temp = torch.tensor([10,10,10,10,10], dtype=torch.long)
-            perm[10:15] = perm[temp + symm]
-            self.output_perms = torch.cat([self.output_perms, perm])
-        self.output_perms = self.output_perms.reshape(self.num_symmetries, self.out_dim, self.out_dim)
-
-        #repeat hidden/cell state
-        self.hidden_cell_repeat = torch.eye(self.hid_dim).repeat(1, self.num_symmetries)
+        self.group_type = group_type
+        self.exact_act = bool(exact_act)
+        self.symmetry = ColourSymmetry(
+            self.group_type,
+            self.priv_in_dim,
+            self.publ_in_dim,
+            self.out_dim,
+            num_symmetry_sample,
+            keep_identity,
+            group_colour,
+        )
  
 
     @torch.jit.script_method
@@ -536,7 +508,6 @@ class EquivariantLSTMNet(torch.jit.ScriptModule):
     def act(
         self,
         priv_s: torch.Tensor,
-        publ_s: torch.Tensor,
         hid: Dict[str, torch.Tensor],
     ) -> Tuple[torch.Tensor, Dict[str, torch.Tensor]]:
         
@@ -551,24 +522,21 @@ class EquivariantLSTMNet(torch.jit.ScriptModule):
             "c0": hid["c0"].transpose(0, 1).flatten(1, 2).contiguous(),
         }
 
-        batchsize = priv_s.size(0)
-
-        priv_s = torch.matmul(priv_s, self.input_perms).reshape(batchsize*self.num_symmetries, self.priv_in_dim)
-
-        hid_h0 = torch.matmul(hid["h0"], self.hidden_cell_repeat).reshape(2, hid["h0"].size(1)*self.num_symmetries, self.hid_dim)
-
-        hid_c0 = torch.matmul(hid["c0"], self.hidden_cell_repeat).reshape(2, hid["c0"].size(1)*self.num_symmetries, self.hid_dim)
+        # expand batch to (a sample of) the group orbit: batch -> batch x num_elem
+        symm, weight = self.symmetry.sample(self.exact_act)
+        priv_s = self.symmetry.expand_priv(priv_s, symm)
+        hid_h0 = self.symmetry.expand_hid(hid["h0"], symm)
+        hid_c0 = self.symmetry.expand_hid(hid["c0"], symm)
 
         priv_s = priv_s.unsqueeze(0)
 
         x = self.net(priv_s)
         o, (h, c) = self.lstm(x, (hid_h0, hid_c0))
         a = self.fc_a(o)
-        a = a.squeeze(0).reshape(batchsize, self.num_symmetries, self.out_dim)
-        a = torch.matmul(a.transpose(0, 1), self.output_perms).sum(0)*1/self.num_symmetries
+        a = self.symmetry.average_output(a.squeeze(0), symm, weight)
 
-        h = h.reshape(2, -1, self.num_symmetries, self.hid_dim).sum(2)*1/self.num_symmetries
-        c = c.reshape(2, -1, self.num_symmetries, self.hid_dim).sum(2)*1/self.num_symmetries
+        h = self.symmetry.average(h, weight)
+        c = self.symmetry.average(c, weight)
 
         # hid size: [num_layer, batch x num_player, dim]
         # -> [batch, num_layer, num_player, dim]
@@ -583,14 +551,77 @@ class EquivariantLSTMNet(torch.jit.ScriptModule):
         
         return a, {"h0": h, "c0": c}
 
+    @torch.jit.script_method
+    def expand_orbit(
+        self,
+        priv_s: torch.Tensor,
+        hid: Dict[str, torch.Tensor],
+        seq_len: Optional[torch.Tensor] = None,
+        exact: bool = False,
+    ) -> Dict[str, torch.Tensor]:
+        """
+        expand the inputs to (a sample of) the group orbit, the result can be
+        shared by the nets with the same symmetry, e.g. online and target net
+        priv_s: [seq_len, batch, dim] -> [seq_len, batch x num_elem, dim]
+        """
+        symm, weight = self.symmetry.sample(exact)
+        orbit = {
+            "priv_s": self.symmetry.expand_priv(priv_s, symm),
+            "symm": symm,
+            "weight": weight,
+        }
+        if len(hid) > 0:
+            orbit["h0"] = self.symmetry.expand_hid(hid["h0"], symm)
+            orbit["c0"] = self.symmetry.expand_hid(hid["c0"], symm)
+        if seq_len is not None:
+            orbit["seq_len"] = self.symmetry.expand_seq_len(seq_len, symm)
+        return orbit
+
+    @torch.jit.script_method
+    def forward_orbit(
+        self,
+        orbit: Dict[str, torch.Tensor],
+        legal_move: torch.Tensor,
+        action: torch.Tensor,
+    ) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor]:
+        """forward on the output of expand_orbit, [seq_len, batch, dim]"""
+        x = self.net(orbit["priv_s"])
+        if "h0" not in orbit:
+            o, _ = self.lstm(x)
+        elif "seq_len" not in orbit:
+            o, _ = self.lstm(x, (orbit["h0"], orbit["c0"]))
+        else:
+            # skip the padding steps beyond the length of each sequence
+            packed_x = nn.utils.rnn.pack_padded_sequence(
+                x, orbit["seq_len"].long().cpu(), enforce_sorted=False
+            )
+            packed_o, _ = self.lstm(packed_x, (orbit["h0"], orbit["c0"]))
+            o, _ = nn.utils.rnn.pad_packed_sequence(packed_o, total_length=x.size(0))
+
+        symm, weight = orbit["symm"], orbit["weight"]
+        a = self.symmetry.average_output(self.fc_a(o), symm, weight)
+        v = self.symmetry.average(self.fc_v(o), weight)
+        o = self.symmetry.average(o, weight)
+        q = duel(v, a, legal_move)
+
+        # q: [seq_len, batch, num_action]
+        # action: [seq_len, batch]
+        qa = q.gather(2, action.unsqueeze(2)).squeeze(2)
+
+        assert q.size() == legal_move.size()
+        legal_q = (1 + q - q.min()) * legal_move
+        # greedy_action: [seq_len, batch]
+        greedy_action = legal_q.argmax(2).detach()
+        return qa, greedy_action, q, o
+
     @torch.jit.script_method
     def forward(
         self,
         priv_s: torch.Tensor,
-        publ_s: torch.Tensor,
         legal_move: torch.Tensor,
         action: torch.Tensor,
         hid: Dict[str, torch.Tensor],
+        seq_len: Optional[torch.Tensor] = None,
     ) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor]:
         assert (
             priv_s.dim() == 3 or priv_s.dim() == 2
@@ -599,42 +630,20 @@ class EquivariantLSTMNet(torch.jit.ScriptModule):
         one_step = False
         if priv_s.dim() == 2:
             priv_s = priv_s.unsqueeze(0)
-            publ_s = publ_s.unsqueeze(0)
             legal_move = legal_move.unsqueeze(0)
             action = action.unsqueeze(0)
             one_step = True
 
-        batchsize = priv_s.size(1)
-        priv_s = torch.matmul(priv_s, self.input_perms).reshape(80, batchsize*self.num_symmetries, self.priv_in_dim) 
-        x = self.net(priv_s)
-        if len(hid) == 0:
-            o, _ = self.lstm(x)
-        else:
-            hid_h0 = torch.matmul(hid["h0"], self.hidden_cell_repeat).reshape(2, hid["h0"].size(1)*self.num_symmetries, self.hid_dim)
-            hid_c0 = torch.matmul(hid["c0"], self.hidden_cell_repeat).reshape(2, hid["c0"].size(1)*self.num_symmetries, self.hid_dim)
-            o, _ = self.lstm(x, (hid_h0, hid_c0))
-
-        a = self.fc_a(o).reshape(80, batchsize, self.num_symmetries, self.out_dim)
-        a = torch.matmul(a.transpose(1, 2), self.output_perms).sum(1)*1/self.num_symmetries
-    
-        v = self.fc_v(o).reshape(80, batchsize, self.num_symmetries, -1).sum(2)*1/self.num_symmetries
-        q = duel(v, a, legal_move)
-
-        # q: [seq_len, batch, num_action]
-        # action: [seq_len, batch]
-        qa = q.gather(2, action.unsqueeze(2)).squeeze(2)
-
-        assert q.size() == legal_move.size()
-        legal_q = (1 + q - q.min()) * legal_move
-        # greedy_action: [seq_len, batch]
-        greedy_action = legal_q.argmax(2).detach()
+        # forward serves the actor side, e.g. the off-belief target, the
+        # sampled orbit is only meant for the learner, see R2D2Agent.td_error
+        orbit = self.expand_orbit(priv_s, hid, seq_len, self.exact_act)
+        qa, greedy_action, q, o = self.forward_orbit(orbit, legal_move, action)
 
         if one_step:
             qa = qa.squeeze(0)
             greedy_action = greedy_action.squeeze(0)
             o = o.squeeze(0)
             q = q.squeeze(0)
-        o = o.reshape(-1, batchsize, self.num_symmetries, self.hid_dim).sum(2)*1/self.num_symmetries
         return qa, greedy_action, q, o
 
     def pred_loss_1st(self, lstm_o, target, hand_slot_mask, seq_len):
@@ -643,7 +652,19 @@ class EquivariantLSTMNet(torch.jit.ScriptModule):
 class EquivariantPublicLSTMNet(torch.jit.ScriptModule):
     __constants__ = ["hid_dim", "out_dim", "num_lstm_layer"]
 
-    def __init__(self, device, in_dim, hid_dim, out_dim, num_lstm_layer):
+    def __init__(
+        self,
+        device,
+        in_dim,
+        hid_dim,
+        out_dim,
+        num_lstm_layer,
+        group_type="cyclic",
+        num_symmetry_sample=0,
+        keep_identity=False,
+        exact_act=True,
+        group_colour=False,
+    ):
         super().__init__()
         # for backward compatibility
         if isinstance(in_dim, int):
@@ -655,6 +676,8 @@ class EquivariantPublicLSTMNet(torch.jit.ScriptModule):
             self.in_dim = in_dim
             self.priv_in_dim = in_dim[1]
             self.publ_in_dim = in_dim[2]
+        # publ_s is a view of priv_s, see public_view
+        self.publ_offset = self.priv_in_dim - self.publ_in_dim
 
         self.hid_dim = hid_dim
         self.out_dim = out_dim
@@ -690,100 +713,17 @@ class EquivariantPublicLSTMNet(torch.jit.ScriptModule):
         self.pred_1st = nn.Linear(self.hid_dim, 5 * 3)
         
         # group symmetry
-        self.group_type = "cyclic"
-        colours = [0, 1, 2, 3, 4]
-        if self.group_type == "cyclic":
-            self.symmetries = torch.tensor([[0,1,2,3,4],[4,0,1,2,3],[3,4,0,1,2],[2,3,4,0,1],[1,2,3,4,0]])
-        elif self.group_type == "dihedral":
-            self.symmetries = torch.tensor([[0,1,2,3,4],
-              [1,2,3,4,0],
-              [2,3,4,0,1],
-              [3,4,0,1,2],
-              [4,0,1,2,3],
-              [0,4,3,2,1],
-              [4,3,2,1,0],
-              [3,2,1,0,4],
-              [2,1,0,4,3],
-              [1,0,4,3,2]])
-        else: # symmetric group
-            self.symmetries = torch.tensor(list(permutations(colours)))
-        self.num_symmetries = len(self.symmetries)
-        self.inv_symmetries = torch.argsort(self.symmetries)
-        self.priv_input_perms = torch.eye((self.priv_in_dim))
-        self.publ_input_perms = torch.eye((self.publ_in_dim))
-        self.output_perms = torch.eye((out_dim))
-        
-        # input permutations
-        for symm in self.symmetries[1:]:
-            perm_priv = torch.eye(self.priv_in_dim)
-            perm_publ = torch.eye(self.publ_in_dim)
-
-            # partner hand
-            card_perm = torch.zeros(25)
-            for i,idx in enumerate(symm):
-                temp = torch.tensor([0,1,2,3,4], dtype=torch.long)
-                temp = 5*i+temp
-                card_perm[5*idx:5*(idx+1)] = temp
-
-            hand_perm = torch.zeros(125, dtype=torch.long)
-            for i in range(5):
-                hand_perm[25*i:25*(i+1)] = card_perm + 25*i
-
-            perm_priv[0:125] = perm_priv[hand_perm]
-
-             # fireworks
-            fireworks_perm = card_perm + 167
-            perm_priv[167:192] = perm_priv[fireworks_perm.long()]
-            perm_publ[42:67] = perm_publ[fireworks_perm.long() - 125]
-
-            # discards
-            discards_perm = torch.zeros(50, dtype=torch.long)
-            for i,idx in enumerate(symm):
-                temp = torch.tensor([203,204,205,206,207,208,209,210,211,212], dtype=torch.long)
-                temp = 10*i+temp
-                discards_perm[10*idx:10*(idx+1)] = temp
-
-            perm_priv[203:253] = perm_priv[discards_perm]
-            perm_publ[78:128] = perm_publ[discards_perm - 125]
-
-            # last action
-            which_colour_perm = torch.tensor([261,261,261,261,261], dtype=torch.long) + symm
-            perm_priv[261:266] = perm_priv[which_colour_perm]
-            perm_priv[281:306] = perm_priv[card_perm.long() + 281]
-            perm_publ[136:141] = perm_publ[which_colour_perm - 125]
-            perm_publ[156:181] = perm_publ[card_perm.long() + 281 - 125]
-
-            # V0
-            for i in range(10):
-                perm_priv[308+35*i:333+35*i] = perm_priv[card_perm.long() + 308+35*i]
-                perm_publ[183+35*i:208+35*i] = perm_publ[card_perm.long() + 183+35*i]
-                directly_revealed_colour_perm = torch.tensor([333,333,333,333,333], dtype=torch.long) + 35*i + symm
-                perm_priv[333+35*i:338+35*i] = perm_priv[directly_revealed_colour_perm]
-                perm_publ[208+35*i:213+35*i] = perm_publ[directly_revealed_colour_perm - 125]
-
-            # greedy action
-            if (self.priv_in_dim == 713):
-                which_colour_perm = torch.tensor([666,666,666,666,666], dtype=torch.long) + symm
-                perm_priv[666:671] = perm_priv[which_colour_perm]
-                perm_publ[541:546] = perm_publ[which_colour_perm]
-                perm_priv[686:711] = perm_priv[card_perm.long() + 686]
-                perm_publ[561:586] = perm_publ[card_perm.long() + 686 - 125]
-
-            self.priv_input_perms = torch.cat([self.priv_input_perms, perm_priv])
-            self.publ_input_perms = torch.cat([self.publ_input_perms, perm_publ])
-                                              
-        self.priv_input_perms = self.priv_input_perms.transpose(0, 1)
-        self.publ_input_perms = self.publ_input_perms.transpose(0, 1)                       
-        # output permutations, inverse of input transforms
-        for symm in self.inv_symmetries[1:]:
-            perm = torch.eye(self.out_dim)
-            temp = torch.tensor([10,10,10,10,10], dtype=torch.long)
-            perm[10:15] = perm[temp + symm]
-            self.output_perms = torch.cat([self.output_perms, perm])
-        self.output_perms = self.output_perms.reshape(self.num_symmetries, self.out_dim, self.out_dim)
-
-        #repeat hidden/cell state
-        self.hidden_cell_repeat = torch.eye(self.hid_dim).repeat(1, self.num_symmetries)
+        self.group_type = group_type
+        self.exact_act = bool(exact_act)
+        self.symmetry = ColourSymmetry(
+            self.group_type,
+            self.priv_in_dim,
+            self.publ_in_dim,
+            self.out_dim,
+            num_symmetry_sample,
+            keep_identity,
+            group_colour,
+        )
         
 
     @torch.jit.script_method
@@ -792,11 +732,15 @@ class EquivariantPublicLSTMNet(torch.jit.ScriptModule):
         hid = {"h0": torch.zeros(*shape), "c0": torch.zeros(*shape)}
         return hid
 
+    @torch.jit.script_method
+    def public_view(self, priv_s: torch.Tensor) -> torch.Tensor:
+        """publ_s is the suffix of priv_s without the partner hands, no copy"""
+        return priv_s.narrow(priv_s.dim() - 1, self.publ_offset, self.publ_in_dim)
+
     @torch.jit.script_method
     def act(
         self,
         priv_s: torch.Tensor,
-        publ_s: torch.Tensor,
         hid: Dict[str, torch.Tensor],
     ) -> Tuple[torch.Tensor, Dict[str, torch.Tensor]]:
         assert priv_s.dim() == 2
@@ -809,28 +753,25 @@ class EquivariantPublicLSTMNet(torch.jit.ScriptModule):
             "h0": hid["h0"].transpose(0, 1).flatten(1, 2).contiguous(),
             "c0": hid["c0"].transpose(0, 1).flatten(1, 2).contiguous(),
         }
-                                              
-        batchsize = priv_s.size(0)                                      
-
-        priv_s = torch.matmul(priv_s, self.priv_input_perms).reshape(batchsize*self.num_symmetries, self.priv_in_dim)
-        publ_s = torch.matmul(publ_s, self.publ_input_perms).reshape(batchsize*self.num_symmetries, self.publ_in_dim)                                     
-        hid_h0 = torch.matmul(hid["h0"], self.hidden_cell_repeat).reshape(2, hid["h0"].size(1)*self.num_symmetries, self.hid_dim)
-        hid_c0 = torch.matmul(hid["c0"], self.hidden_cell_repeat).reshape(2, hid["c0"].size(1)*self.num_symmetries, self.hid_dim)                        
-                                              
+
+        # expand batch to (a sample of) the group orbit: batch -> batch x num_elem
+        symm, weight = self.symmetry.sample(self.exact_act)
+        priv_s = self.symmetry.expand_priv(priv_s, symm)
+        hid_h0 = self.symmetry.expand_hid(hid["h0"], symm)
+        hid_c0 = self.symmetry.expand_hid(hid["c0"], symm)
+
         priv_s = priv_s.unsqueeze(0)
-        publ_s = publ_s.unsqueeze(0)
 
-        x = self.publ_net(publ_s)
+        x = self.publ_net(self.public_view(priv_s))
         publ_o, (h, c) = self.lstm(x, (hid_h0, hid_c0))
 
         priv_o = self.priv_net(priv_s)
         o = priv_o * publ_o
         a = self.fc_a(o)
-        a = a.squeeze(0).reshape(batchsize, self.num_symmetries, self.out_dim)
-        a = torch.matmul(a.transpose(0, 1), self.output_perms).sum(0)*1/self.num_symmetries
-                                              
-        h = h.reshape(2, -1, self.num_symmetries, self.hid_dim).sum(2)*1/self.num_symmetries
-        c = c.reshape(2, -1, self.num_symmetries, self.hid_dim).sum(2)*1/self.num_symmetries
+        a = self.symmetry.average_output(a.squeeze(0), symm, weight)
+
+        h = self.symmetry.average(h, weight)
+        c = self.symmetry.average(c, weight)
 
         # hid size: [num_layer, batch x num_player, dim]
         # -> [batch, num_layer, num_player, dim]
@@ -845,14 +786,81 @@ class EquivariantPublicLSTMNet(torch.jit.ScriptModule):
 
         return a, {"h0": h, "c0": c}
 
+    @torch.jit.script_method
+    def expand_orbit(
+        self,
+        priv_s: torch.Tensor,
+        hid: Dict[str, torch.Tensor],
+        seq_len: Optional[torch.Tensor] = None,
+        exact: bool = False,
+    ) -> Dict[str, torch.Tensor]:
+        """
+        expand the inputs to (a sample of) the group orbit, the result can be
+        shared by the nets with the same symmetry, e.g. online and target net
+        priv_s: [seq_len, batch, dim] -> [seq_len, batch x num_elem, dim]
+        """
+        symm, weight = self.symmetry.sample(exact)
+        orbit = {
+            "priv_s": self.symmetry.expand_priv(priv_s, symm),
+            "symm": symm,
+            "weight": weight,
+        }
+        if len(hid) > 0:
+            orbit["h0"] = self.symmetry.expand_hid(hid["h0"], symm)
+            orbit["c0"] = self.symmetry.expand_hid(hid["c0"], symm)
+        if seq_len is not None:
+            orbit["seq_len"] = self.symmetry.expand_seq_len(seq_len, symm)
+        return orbit
+
+    @torch.jit.script_method
+    def forward_orbit(
+        self,
+        orbit: Dict[str, torch.Tensor],
+        legal_move: torch.Tensor,
+        action: torch.Tensor,
+    ) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor]:
+        """forward on the output of expand_orbit, [seq_len, batch, dim]"""
+        x = self.publ_net(self.public_view(orbit["priv_s"]))
+        if "h0" not in orbit:
+            publ_o, _ = self.lstm(x)
+        elif "seq_len" not in orbit:
+            publ_o, _ = self.lstm(x, (orbit["h0"], orbit["c0"]))
+        else:
+            # skip the padding steps beyond the length of each sequence
+            packed_x = nn.utils.rnn.pack_padded_sequence(
+                x, orbit["seq_len"].long().cpu(), enforce_sorted=False
+            )
+            packed_o, _ = self.lstm(packed_x, (orbit["h0"], orbit["c0"]))
+            publ_o, _ = nn.utils.rnn.pad_packed_sequence(
+                packed_o, total_length=x.size(0)
+            )
+        priv_o = self.priv_net(orbit["priv_s"])
+        o = priv_o * publ_o
+
+        symm, weight = orbit["symm"], orbit["weight"]
+        a = self.symmetry.average_output(self.fc_a(o), symm, weight)
+        v = self.symmetry.average(self.fc_v(o), weight)
+        o = self.symmetry.average(o, weight)
+        q = duel(v, a, legal_move)
+
+        # q: [seq_len, batch, num_action]
+        # action: [seq_len, batch]
+        qa = q.gather(2, action.unsqueeze(2)).squeeze(2)
+
+        assert q.size() == legal_move.size()
+        legal_q = (1 + q - q.min()) * legal_move
+        # greedy_action: [seq_len, batch]
+        greedy_action = legal_q.argmax(2).detach()
+        return qa, greedy_action, q, o
+
     @torch.jit.script_method
     def forward(
         self,
         priv_s: torch.Tensor,
-        publ_s: torch.Tensor,
         legal_move: torch.Tensor,
         action: torch.Tensor,
         hid: Dict[str, torch.Tensor],
+        seq_len: Optional[torch.Tensor] = None,
     ) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor]:
         assert (
             priv_s.dim() == 3 or priv_s.dim() == 2
@@ -861,27 +869,315 @@ class EquivariantPublicLSTMNet(torch.jit.ScriptModule):
         one_step = False
         if priv_s.dim() == 2:
             priv_s = priv_s.unsqueeze(0)
-            publ_s = publ_s.unsqueeze(0)
             legal_move = legal_move.unsqueeze(0)
             action = action.unsqueeze(0)
             one_step = True
 
-        batchsize = priv_s.size(1)
-        priv_s = torch.matmul(priv_s, self.priv_input_perms).reshape(80, batchsize*self.num_symmetries, self.priv_in_dim)
-        publ_s = torch.matmul(publ_s, self.publ_input_perms).reshape(80, batchsize*self.num_symmetries, self.publ_in_dim)
-                                              
-        x = self.publ_net(publ_s)
+        # forward serves the actor side, e.g. the off-belief target, the
+        # sampled orbit is only meant for the learner, see R2D2Agent.td_error
+        orbit = self.expand_orbit(priv_s, hid, seq_len, self.exact_act)
+        qa, greedy_action, q, o = self.forward_orbit(orbit, legal_move, action)
+
+        if one_step:
+            qa = qa.squeeze(0)
+            greedy_action = greedy_action.squeeze(0)
+            o = o.squeeze(0)
+            q = q.squeeze(0)
+        return qa, greedy_action, q, o
+
+    def pred_loss_1st(self, lstm_o, target, hand_slot_mask, seq_len):
+        return cross_entropy(self.pred_1st, lstm_o, target, hand_slot_mask, seq_len)
+
+
+class TiedEquivariantLSTMNet(torch.jit.ScriptModule):
+    """
+    LSTMNet built from the group tied layers in symmetry.py, exactly
+    equivariant without expanding the batch to the group orbit. The hidden
+    features are [num_symmetries x channel], hid_dim is rounded down to it.
+    """
+
+    __constants__ = ["hid_dim", "out_dim", "num_lstm_layer"]
+
+    def __init__(
+        self, device, in_dim, hid_dim, out_dim, num_lstm_layer, group_type="cyclic"
+    ):
+        super().__init__()
+        # for backward compatibility
+        if isinstance(in_dim, int):
+            assert in_dim == 783
+            self.in_dim = in_dim
+            self.priv_in_dim = in_dim - 125
+            self.publ_in_dim = in_dim - 2 * 125
+        else:
+            self.in_dim = in_dim
+            self.priv_in_dim = in_dim[1]
+            self.publ_in_dim = in_dim[2]
+
+        self.group_type = group_type
+        # the tied weights need the tables to form a group
+        priv_index, _, out_index = perm_tables(
+            group_type, self.priv_in_dim, out_dim, group_colour=True
+        )
+        rel_index = relative_table(priv_index)
+        self.num_symmetries = priv_index.size(0)
+        self.channel = hid_dim // self.num_symmetries
+        assert self.channel > 0, "hid_dim is smaller than the group"
+
+        self.hid_dim = self.channel * self.num_symmetries
+        self.out_dim = out_dim
+        self.num_ff_layer = 1
+        self.num_lstm_layer = num_lstm_layer
+
+        ff_layers = [GroupLiftLinear(priv_index, self.channel), nn.ReLU()]
+        for i in range(1, self.num_ff_layer):
+            ff_layers.append(GroupLinear(rel_index, self.channel, self.channel))
+            ff_layers.append(nn.ReLU())
+        self.net = nn.Sequential(*ff_layers)
+
+        self.lstm = GroupLSTM(rel_index, self.channel, self.num_lstm_layer)
+
+        self.fc_v = GroupPoolLinear(self.num_symmetries, self.channel, 1)
+        self.fc_a = GroupOutputLinear(out_index, self.channel)
+
+        # for aux task
+        self.pred_1st = GroupPoolLinear(self.num_symmetries, self.channel, 5 * 3)
+
+    @torch.jit.script_method
+    def get_h0(self, batchsize: int) -> Dict[str, torch.Tensor]:
+        shape = (self.num_lstm_layer, batchsize, self.hid_dim)
+        hid = {"h0": torch.zeros(*shape), "c0": torch.zeros(*shape)}
+        return hid
+
+    @torch.jit.script_method
+    def act(
+        self,
+        priv_s: torch.Tensor,
+        hid: Dict[str, torch.Tensor],
+    ) -> Tuple[torch.Tensor, Dict[str, torch.Tensor]]:
+        assert priv_s.dim() == 2
+        bsize = hid["h0"].size(0)
+        assert hid["h0"].dim() == 4
+        # hid size: [batch, num_layer, num_player, dim]
+        # -> [num_layer, batch x num_player, dim]
+        hid = {
+            "h0": hid["h0"].transpose(0, 1).flatten(1, 2).contiguous(),
+            "c0": hid["c0"].transpose(0, 1).flatten(1, 2).contiguous(),
+        }
+
+        priv_s = priv_s.unsqueeze(0)
+
+        x = self.net(priv_s)
+        o, (h, c) = self.lstm(x, (hid["h0"], hid["c0"]))
+        a = self.fc_a(o)
+        a = a.squeeze(0)
+
+        # hid size: [num_layer, batch x num_player, dim]
+        # -> [batch, num_layer, num_player, dim]
+        interim_hid_shape = (
+            self.num_lstm_layer,
+            bsize,
+            -1,
+            self.hid_dim,
+        )
+
+        h = h.view(*interim_hid_shape).transpose(0, 1)
+        c = c.view(*interim_hid_shape).transpose(0, 1)
+
+        return a, {"h0": h, "c0": c}
+
+    @torch.jit.script_method
+    def forward(
+        self,
+        priv_s: torch.Tensor,
+        legal_move: torch.Tensor,
+        action: torch.Tensor,
+        hid: Dict[str, torch.Tensor],
+        seq_len: Optional[torch.Tensor] = None,
+    ) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor]:
+        assert (
+            priv_s.dim() == 3 or priv_s.dim() == 2
+        ), "dim = 3/2, [seq_len(optional), batch, dim]"
+
+        one_step = False
+        if priv_s.dim() == 2:
+            priv_s = priv_s.unsqueeze(0)
+            legal_move = legal_move.unsqueeze(0)
+            action = action.unsqueeze(0)
+            one_step = True
+        x = self.net(priv_s)
         if len(hid) == 0:
-            publ_o, _ = self.lstm(x)
+            hid = self.get_h0(x.size(1))
+            hid = {"h0": hid["h0"].to(x.device), "c0": hid["c0"].to(x.device)}
+        if seq_len is None:
+            o, _ = self.lstm(x, (hid["h0"], hid["c0"]))
         else:
-            hid_h0 = torch.matmul(hid["h0"], self.hidden_cell_repeat).reshape(2, hid["h0"].size(1)*self.num_symmetries, self.hid_dim)
-            hid_c0 = torch.matmul(hid["c0"], self.hidden_cell_repeat).reshape(2, hid["c0"].size(1)*self.num_symmetries, self.hid_dim)                                  
-            publ_o, _ = self.lstm(x, (hid_h0, hid_c0))
+            o = self.lstm.forward_packed(x, (hid["h0"], hid["c0"]), seq_len)
+        a = self.fc_a(o)
+        v = self.fc_v(o)
+        q = duel(v, a, legal_move)
+
+        # q: [seq_len, batch, num_action]
+        # action: [seq_len, batch]
+        qa = q.gather(2, action.unsqueeze(2)).squeeze(2)
+
+        assert q.size() == legal_move.size()
+        legal_q = (1 + q - q.min()) * legal_move
+        # greedy_action: [seq_len, batch]
+        greedy_action = legal_q.argmax(2).detach()
+
+        if one_step:
+            qa = qa.squeeze(0)
+            greedy_action = greedy_action.squeeze(0)
+            o = o.squeeze(0)
+            q = q.squeeze(0)
+        return qa, greedy_action, q, o
+
+    def pred_loss_1st(self, lstm_o, target, hand_slot_mask, seq_len):
+        return cross_entropy(self.pred_1st, lstm_o, target, hand_slot_mask, seq_len)
+
+
+class TiedEquivariantPublicLSTMNet(torch.jit.ScriptModule):
+    """PublicLSTMNet built from the group tied layers, see TiedEquivariantLSTMNet"""
+
+    __constants__ = ["hid_dim", "out_dim", "num_lstm_layer"]
+
+    def __init__(
+        self, device, in_dim, hid_dim, out_dim, num_lstm_layer, group_type="cyclic"
+    ):
+        super().__init__()
+        # for backward compatibility
+        if isinstance(in_dim, int):
+            assert in_dim == 783
+            self.in_dim = in_dim
+            self.priv_in_dim = in_dim - 125
+            self.publ_in_dim = in_dim - 2 * 125
+        else:
+            self.in_dim = in_dim
+            self.priv_in_dim = in_dim[1]
+            self.publ_in_dim = in_dim[2]
+        # publ_s is a view of priv_s, see public_view
+        self.publ_offset = self.priv_in_dim - self.publ_in_dim
+
+        self.group_type = group_type
+        priv_index, publ_index, out_index = perm_tables(
+            group_type, self.priv_in_dim, out_dim, group_colour=True
+        )
+        rel_index = relative_table(priv_index)
+        self.num_symmetries = priv_index.size(0)
+        self.channel = hid_dim // self.num_symmetries
+        assert self.channel > 0, "hid_dim is smaller than the group"
+
+        self.hid_dim = self.channel * self.num_symmetries
+        self.out_dim = out_dim
+        self.num_ff_layer = 1
+        self.num_lstm_layer = num_lstm_layer
+
+        self.priv_net = nn.Sequential(
+            GroupLiftLinear(priv_index, self.channel),
+            nn.ReLU(),
+            GroupLinear(rel_index, self.channel, self.channel),
+            nn.ReLU(),
+            GroupLinear(rel_index, self.channel, self.channel),
+            nn.ReLU(),
+        )
+
+        ff_layers = [GroupLiftLinear(publ_index, self.channel), nn.ReLU()]
+        for i in range(1, self.num_ff_layer):
+            ff_layers.append(GroupLinear(rel_index, self.channel, self.channel))
+            ff_layers.append(nn.ReLU())
+        self.publ_net = nn.Sequential(*ff_layers)
+
+        self.lstm = GroupLSTM(rel_index, self.channel, self.num_lstm_layer)
+
+        self.fc_v = GroupPoolLinear(self.num_symmetries, self.channel, 1)
+        self.fc_a = GroupOutputLinear(out_index, self.channel)
+
+        # for aux task
+        self.pred_1st = GroupPoolLinear(self.num_symmetries, self.channel, 5 * 3)
+
+    @torch.jit.script_method
+    def get_h0(self, batchsize: int) -> Dict[str, torch.Tensor]:
+        shape = (self.num_lstm_layer, batchsize, self.hid_dim)
+        hid = {"h0": torch.zeros(*shape), "c0": torch.zeros(*shape)}
+        return hid
+
+    @torch.jit.script_method
+    def public_view(self, priv_s: torch.Tensor) -> torch.Tensor:
+        """publ_s is the suffix of priv_s without the partner hands, no copy"""
+        return priv_s.narrow(priv_s.dim() - 1, self.publ_offset, self.publ_in_dim)
+
+    @torch.jit.script_method
+    def act(
+        self,
+        priv_s: torch.Tensor,
+        hid: Dict[str, torch.Tensor],
+    ) -> Tuple[torch.Tensor, Dict[str, torch.Tensor]]:
+        assert priv_s.dim() == 2
+
+        bsize = hid["h0"].size(0)
+        assert hid["h0"].dim() == 4
+        # hid size: [batch, num_layer, num_player, dim]
+        # -> [num_layer, batch x num_player, dim]
+        hid = {
+            "h0": hid["h0"].transpose(0, 1).flatten(1, 2).contiguous(),
+            "c0": hid["c0"].transpose(0, 1).flatten(1, 2).contiguous(),
+        }
+
+        priv_s = priv_s.unsqueeze(0)
+
+        x = self.publ_net(self.public_view(priv_s))
+        publ_o, (h, c) = self.lstm(x, (hid["h0"], hid["c0"]))
+
+        priv_o = self.priv_net(priv_s)
+        o = priv_o * publ_o
+        a = self.fc_a(o)
+        a = a.squeeze(0)
+
+        # hid size: [num_layer, batch x num_player, dim]
+        # -> [batch, num_layer, num_player, dim]
+        interim_hid_shape = (
+            self.num_lstm_layer,
+            bsize,
+            -1,
+            self.hid_dim,
+        )
+        h = h.view(*interim_hid_shape).transpose(0, 1)
+        c = c.view(*interim_hid_shape).transpose(0, 1)
+
+        return a, {"h0": h, "c0": c}
+
+    @torch.jit.script_method
+    def forward(
+        self,
+        priv_s: torch.Tensor,
+        legal_move: torch.Tensor,
+        action: torch.Tensor,
+        hid: Dict[str, torch.Tensor],
+        seq_len: Optional[torch.Tensor] = None,
+    ) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor]:
+        assert (
+            priv_s.dim() == 3 or priv_s.dim() == 2
+        ), "dim = 3/2, [seq_len(optional), batch, dim]"
+
+        one_step = False
+        if priv_s.dim() == 2:
+            priv_s = priv_s.unsqueeze(0)
+            legal_move = legal_move.unsqueeze(0)
+            action = action.unsqueeze(0)
+            one_step = True
+
+        x = self.publ_net(self.public_view(priv_s))
+        if len(hid) == 0:
+            hid = self.get_h0(x.size(1))
+            hid = {"h0": hid["h0"].to(x.device), "c0": hid["c0"].to(x.device)}
+        if seq_len is None:
+            publ_o, _ = self.lstm(x, (hid["h0"], hid["c0"]))
+        else:
+            publ_o = self.lstm.forward_packed(x, (hid["h0"], hid["c0"]), seq_len)
         priv_o = self.priv_net(priv_s)
         o = priv_o * publ_o
-        a = self.fc_a(o).reshape(80, batchsize, self.num_symmetries, self.out_dim)
-        a = torch.matmul(a.transpose(1, 2), self.output_perms).sum(1)*1/self.num_symmetries                                      
-        v = self.fc_v(o).reshape(80, batchsize, self.num_symmetries, -1).sum(2)*1/self.num_symmetries
+        a = self.fc_a(o)
+        v = self.fc_v(o)
         q = duel(v, a, legal_move)
 
         # q: [seq_len, batch, num_action]
@@ -897,8 +1193,7 @@ class EquivariantPublicLSTMNet(torch.jit.ScriptModule):
             qa = qa.squeeze(0)
             greedy_action = greedy_action.squeeze(0)
             o = o.squeeze(0)
-            q = q.squeeze(0)                                      
-        o = o.reshape(-1, batchsize, self.num_symmetries, self.hid_dim).sum(2)*1/self.num_symmetries                                      
+            q = q.squeeze(0)
         return qa, greedy_action, q, o
 
     def pred_loss_1st(self, lstm_o, target, hand_slot_mask, seq_len):
@@ -8,7 +8,15 @@ from collections import OrderedDict
 import torch
 import torch.nn as nn
 from typing import Tuple, Dict
-from net import FFWDNet, PublicLSTMNet, LSTMNet, EquivariantLSTMNet, EquivariantPublicLSTMNet
+from net import (
+    FFWDNet,
+    PublicLSTMNet,
+    LSTMNet,
+    EquivariantLSTMNet,
+    EquivariantPublicLSTMNet,
+    TiedEquivariantLSTMNet,
+    TiedEquivariantPublicLSTMNet,
+)
 
 
 class R2D2Agent(torch.jit.ScriptModule):
@@ -42,18 +50,38 @@ class R2D2Agent(torch.jit.ScriptModule):
         nhead=None,
         nlayer=None,
         max_len=None,
+        equivariant_mode="symmetrize",
+        group_type="cyclic",
+        num_symmetry_sample=0,
+        keep_identity=False,
+        exact_act=True,
+        group_colour=False,
     ):
         super().__init__()
+        symmetry_args = (
+            group_type,
+            num_symmetry_sample,
+            keep_identity,
+            exact_act,
+            group_colour,
+        )
         if net == "ffwd":
             self.online_net = FFWDNet(in_dim, hid_dim, out_dim).to(device)
             self.target_net = FFWDNet(in_dim, hid_dim, out_dim).to(device)
         elif net == "publ-lstm":
-            if equivariant:
+            if equivariant and equivariant_mode == "tied":
+                self.online_net = TiedEquivariantPublicLSTMNet(
+                    device, in_dim, hid_dim, out_dim, num_lstm_layer, group_type
+                ).to(device)
+                self.target_net = TiedEquivariantPublicLSTMNet(
+                    device, in_dim, hid_dim, out_dim, num_lstm_layer, group_type
+                ).to(device)
+            elif equivariant and equivariant_mode == "symmetrize":
                 self.online_net = EquivariantPublicLSTMNet(
-                    device, in_dim, hid_dim, out_dim, num_lstm_layer
+                    device, in_dim, hid_dim, out_dim, num_lstm_layer, *symmetry_args
                 ).to(device)
                 self.target_net = EquivariantPublicLSTMNet(
-                    device, in_dim, hid_dim, out_dim, num_lstm_layer
+                    device, in_dim, hid_dim, out_dim, num_lstm_layer, *symmetry_args
                 ).to(device)
             else:
                 self.online_net = PublicLSTMNet(
@@ -63,12 +91,19 @@ class R2D2Agent(torch.jit.ScriptModule):
                     device, in_dim, hid_dim, out_dim, num_lstm_layer
                 ).to(device)
         elif net == "lstm":
-            if equivariant:
+            if equivariant and equivariant_mode == "tied":
+                self.online_net = TiedEquivariantLSTMNet(
+                    device, in_dim, hid_dim, out_dim, num_lstm_layer, group_type
+                ).to(device)
+                self.target_net = TiedEquivariantLSTMNet(
+                    device, in_dim, hid_dim, out_dim, num_lstm_layer, group_type
+                ).to(device)
+            elif equivariant and equivariant_mode == "symmetrize":
                 self.online_net = EquivariantLSTMNet(
-                    device, in_dim, hid_dim, out_dim, num_lstm_layer
+                    device, in_dim, hid_dim, out_dim, num_lstm_layer, *symmetry_args
                 ).to(device)
                 self.target_net = EquivariantLSTMNet(
-                    device, in_dim, hid_dim, out_dim, num_lstm_layer
+                    device, in_dim, hid_dim, out_dim, num_lstm_layer, *symmetry_args
                 ).to(device)
             else:
                 self.online_net = LSTMNet(
@@ -86,6 +121,11 @@ class R2D2Agent(torch.jit.ScriptModule):
             )
         else:
             assert False, f"{net} not implemented"
+        assert equivariant_mode in [
+            "symmetrize",
+            "tied",
+            "project",
+        ], f"{equivariant_mode} not implemented"
 
         for p in self.target_net.parameters():
             p.requires_grad = False
@@ -104,6 +144,12 @@ class R2D2Agent(torch.jit.ScriptModule):
         self.nhead = nhead
         self.nlayer = nlayer
         self.max_len = max_len
+        self.equivariant_mode = equivariant_mode
+        self.group_type = group_type
+        self.num_symmetry_sample = num_symmetry_sample
+        self.keep_identity = keep_identity
+        self.exact_act = exact_act
+        self.group_colour = group_colour
 
     @torch.jit.script_method
     def get_h0(self, batchsize: int) -> Dict[str, torch.Tensor]:
@@ -131,6 +177,12 @@ class R2D2Agent(torch.jit.ScriptModule):
             nhead=self.nhead,
             nlayer=self.nlayer,
             max_len=self.max_len,
+            equivariant_mode=self.equivariant_mode,
+            group_type=self.group_type,
+            num_symmetry_sample=self.num_symmetry_sample,
+            keep_identity=self.keep_identity,
+            exact_act=self.exact_act,
+            group_colour=self.group_colour,
         )
         cloned.load_state_dict(self.state_dict())
         cloned.train(self.training)
@@ -143,11 +195,10 @@ class R2D2Agent(torch.jit.ScriptModule):
     def greedy_act(
         self,
         priv_s: torch.Tensor,
-        publ_s: torch.Tensor,
         legal_move: torch.Tensor,
         hid: Dict[str, torch.Tensor],
     ) -> Tuple[torch.Tensor, Dict[str, torch.Tensor]]:
-        adv, new_hid = self.online_net.act(priv_s, publ_s, hid)
+        adv, new_hid = self.online_net.act(priv_s, hid)
         legal_adv = (1 + adv - adv.min()) * legal_move
         greedy_action = legal_adv.argmax(1).detach()
         return greedy_action, new_hid
@@ -156,13 +207,12 @@ class R2D2Agent(torch.jit.ScriptModule):
     def boltzmann_act(
         self,
         priv_s: torch.Tensor,
-        publ_s: torch.Tensor,
         legal_move: torch.Tensor,
         temperature: torch.Tensor,
         hid: Dict[str, torch.Tensor],
     ) -> Tuple[torch.Tensor, Dict[str, torch.Tensor], torch.Tensor]:
         temperature = temperature.unsqueeze(1)
-        adv, new_hid = self.online_net.act(priv_s, publ_s, hid)
+        adv, new_hid = self.online_net.act(priv_s, hid)
         assert adv.dim() == temperature.dim()
         logit = adv / temperature
         legal_logit = logit - (1 - legal_move) * 1e30
@@ -179,7 +229,6 @@ class R2D2Agent(torch.jit.ScriptModule):
             [batchsize] or [batchsize, num_player]
         """
         priv_s = obs["priv_s"]
-        publ_s = obs["publ_s"]
         legal_move = obs["legal_move"]
         if "eps" in obs:
             eps = obs["eps"].flatten(0, 1)
@@ -189,7 +238,6 @@ class R2D2Agent(torch.jit.ScriptModule):
         if self.vdn:
             bsize, num_player = obs["priv_s"].size()[:2]
             priv_s = obs["priv_s"].flatten(0, 1)
-            publ_s = obs["publ_s"].flatten(0, 1)
             legal_move = obs["legal_move"].flatten(0, 1)
         else:
             bsize, num_player = obs["priv_s"].size()[0], 1
@@ -199,11 +247,11 @@ class R2D2Agent(torch.jit.ScriptModule):
         if self.boltzmann:
             temp = obs["temperature"].flatten(0, 1)
             greedy_action, new_hid, prob = self.boltzmann_act(
-                priv_s, publ_s, legal_move, temp, hid
+                priv_s, legal_move, temp, hid
             )
             reply = {"prob": prob}
         else:
-            greedy_action, new_hid = self.greedy_act(priv_s, publ_s, legal_move, hid)
+            greedy_action, new_hid = self.greedy_act(priv_s, legal_move, hid)
             reply = {}
 
         if self.greedy:
@@ -221,8 +269,10 @@ class R2D2Agent(torch.jit.ScriptModule):
             # rand = rand.view(bsize, num_player)
 
         reply["a"] = action.detach().cpu()
-        reply["h0"] = new_hid["h0"].detach().cpu()
-        reply["c0"] = new_hid["c0"].detach().cpu()
+        # left on the device, the runner either keeps them in its hid table or
+        # moves them to cpu with the rest of the reply
+        reply["h0"] = new_hid["h0"].detach()
+        reply["c0"] = new_hid["c0"].detach()
         return reply
 
     @torch.jit.script_method
@@ -231,7 +281,6 @@ class R2D2Agent(torch.jit.ScriptModule):
     ) -> Dict[str, torch.Tensor]:
         assert self.multi_step == 1
         priv_s = input_["priv_s"]
-        publ_s = input_["publ_s"]
         legal_move = input_["legal_move"]
         act_hid = {
             "h0": input_["h0"],
@@ -247,13 +296,13 @@ class R2D2Agent(torch.jit.ScriptModule):
         if self.boltzmann:
             temp = input_["temperature"].flatten(0, 1)
             next_a, _, next_pa = self.boltzmann_act(
-                priv_s, publ_s, legal_move, temp, act_hid
+                priv_s, legal_move, temp, act_hid
             )
-            next_q = self.target_net(priv_s, publ_s, legal_move, next_a, fwd_hid)[2]
+            next_q = self.target_net(priv_s, legal_move, next_a, fwd_hid)[2]
             qa = (next_q * next_pa).sum(1)
         else:
-            next_a = self.greedy_act(priv_s, publ_s, legal_move, act_hid)[0]
-            qa = self.target_net(priv_s, publ_s, legal_move, next_a, fwd_hid)[0]
+            next_a = self.greedy_act(priv_s, legal_move, act_hid)[0]
+            qa = self.target_net(priv_s, legal_move, next_a, fwd_hid)[0]
 
         assert reward.size() == qa.size()
         target = reward + (1 - terminal) * self.gamma * qa
@@ -273,7 +322,6 @@ class R2D2Agent(torch.jit.ScriptModule):
 
         obs = {
             "priv_s": input_["priv_s"],
-            "publ_s": input_["publ_s"],
             "legal_move": input_["legal_move"],
         }
         if self.boltzmann:
@@ -289,7 +337,7 @@ class R2D2Agent(torch.jit.ScriptModule):
         bootstrap = input_["bootstrap"]
         seq_len = input_["seq_len"]
         err, _, _ = self.td_error(
-            obs, hid, action, reward, terminal, bootstrap, seq_len
+            obs, hid, action, reward, terminal, bootstrap, seq_len, self.exact_act
         )
         priority = err.abs()
         priority = self.aggregate_priority(priority, seq_len).detach().cpu()
@@ -305,10 +353,10 @@ class R2D2Agent(torch.jit.ScriptModule):
         terminal: torch.Tensor,
         bootstrap: torch.Tensor,
         seq_len: torch.Tensor,
+        exact: bool = False,
     ) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
         max_seq_len = obs["priv_s"].size(0)
         priv_s = obs["priv_s"]
-        publ_s = obs["publ_s"]
         legal_move = obs["legal_move"]
         action = action["a"]
 
@@ -316,25 +364,42 @@ class R2D2Agent(torch.jit.ScriptModule):
             hid[k] = v.flatten(1, 2).contiguous()
 
         bsize, num_player = priv_s.size(1), 1
+        # per row length so that the nets can skip the padding steps
+        row_seq_len = seq_len
         if self.vdn:
             num_player = priv_s.size(2)
             priv_s = priv_s.flatten(1, 2)
-            publ_s = publ_s.flatten(1, 2)
             legal_move = legal_move.flatten(1, 2)
             action = action.flatten(1, 2)
+            row_seq_len = seq_len.repeat_interleave(num_player)
 
         # this only works because the trajectories are padded,
         # i.e. no terminal in the middle
-        online_qa, greedy_a, online_q, lstm_o = self.online_net(
-            priv_s, publ_s, legal_move, action, hid
-        )
+        # the orbit averaging nets expand the batch to the group orbit once,
+        # shared by the online and the target net. Only the learner samples the
+        # orbit, the actors computing priorities pass exact=exact_act
+        orbit: Dict[str, torch.Tensor] = {}
+        if hasattr(self.online_net, "expand_orbit"):
+            orbit = self.online_net.expand_orbit(priv_s, hid, row_seq_len, exact)
+            online_qa, greedy_a, online_q, lstm_o = self.online_net.forward_orbit(
+                orbit, legal_move, action
+            )
+        else:
+            online_qa, greedy_a, online_q, lstm_o = self.online_net(
+                priv_s, legal_move, action, hid, row_seq_len
+            )
 
         if self.off_belief:
             target = obs["target"]
         else:
-            target_qa, _, target_q, _ = self.target_net(
-                priv_s, publ_s, legal_move, greedy_a, hid
-            )
+            if hasattr(self.target_net, "forward_orbit"):
+                target_qa, _, target_q, _ = self.target_net.forward_orbit(
+                    orbit, legal_move, greedy_a
+                )
+            else:
+                target_qa, _, target_q, _ = self.target_net(
+                    priv_s, legal_move, greedy_a, hid, row_seq_len
+                )
 
             if self.boltzmann:
                 temperature = obs["temperature"].flatten(1, 2).unsqueeze(2)
@@ -447,18 +512,16 @@ class R2D2Agent(torch.jit.ScriptModule):
     def behavior_clone_loss(self, online_q, batch, t, clone_bot, stat):
         max_seq_len = batch.obs["priv_s"].size(0)
         priv_s = batch.obs["priv_s"]
-        publ_s = batch.obs["publ_s"]
         legal_move = batch.obs["legal_move"]
 
         bsize, num_player = priv_s.size(1), 1
         if self.vdn:
             num_player = priv_s.size(2)
             priv_s = priv_s.flatten(1, 2)
-            publ_s = publ_s.flatten(1, 2)
             legal_move = legal_move.flatten(1, 2)
 
         with torch.no_grad():
-            target_logit, _ = clone_bot(priv_s, publ_s, None)
+            target_logit, _ = clone_bot(priv_s, None)
             target_logit = target_logit - (1 - legal_move) * 1e10
             target = nn.functional.softmax(target_logit, 2)
 
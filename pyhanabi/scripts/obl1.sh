@@ -32,7 +32,7 @@ python selfplay.py \
        --min_t 0.01 \
        --max_t 0.1 \
        --off_belief 1 \
-       --num_fict_sample 10 \
+       --num_fict_sample 1 \
        --belief_device cuda:3,cuda:4 \
        --belief_model exps/belief_obl0/model0.pthw \
        --load_model None \
@@ -17,6 +17,7 @@ from torch import nn
 from act_group import ActGroup
 from create import create_envs, create_threads
 from eval import evaluate
+from equiv_proj import EquivariantProjection
 import common_utils
 import rela
 import r2d2
@@ -36,8 +37,49 @@ def parse_args():
     parser.add_argument("--hide_action", type=int, default=0)
     parser.add_argument("--off_belief", type=int, default=0)
     parser.add_argument("--belief_model", type=str, default="None")
-    parser.add_argument("--num_fict_sample", type=int, default=10)
+    parser.add_argument("--num_fict_sample", type=int, default=1)
     parser.add_argument("--equivariant", type=int, default=0)
+    parser.add_argument(
+        "--equivariant_mode",
+        type=str,
+        default="symmetrize",
+        help="symmetrize: average over the orbit, tied: group tied weights, "
+        "project: plain net with weights projected to the equivariant subspace",
+    )
+    parser.add_argument(
+        "--equivariant_proj_freq",
+        type=int,
+        default=1,
+        help="#updates between weight projections for --equivariant_mode project",
+    )
+    parser.add_argument(
+        "--symmetry_group", type=str, default="cyclic", help="cyclic/dihedral/symmetric"
+    )
+    parser.add_argument(
+        "--num_symmetry_sample",
+        type=int,
+        default=0,
+        help="#group elements sampled per batch in training, 0: full orbit",
+    )
+    parser.add_argument(
+        "--symmetry_keep_identity",
+        type=int,
+        default=0,
+        help="always evaluate the identity as a control for the sampled orbit",
+    )
+    parser.add_argument(
+        "--exact_symmetry_act",
+        type=int,
+        default=1,
+        help="average over the full orbit on the actor side (act, priority, obl target)",
+    )
+    parser.add_argument(
+        "--group_colour_perm",
+        type=int,
+        default=0,
+        help="symmetrize/project with the colour tables that form a group, "
+        "see input_perm_index; tied always uses them",
+    )
     parser.add_argument("--belief_device", type=str, default="cuda:1")
 
     parser.add_argument("--load_model", type=str, default="")
@@ -85,6 +127,24 @@ def parse_args():
     )
     parser.add_argument("--max_len", type=int, default=80, help="max seq len")
     parser.add_argument("--prefetch", type=int, default=3, help="#prefetch batch")
+    parser.add_argument(
+        "--bit_pack_replay", type=int, default=0, help="store binary obs as bits"
+    )
+    parser.add_argument(
+        "--slab_replay", type=int, default=0, help="preallocated replay storage"
+    )
+    parser.add_argument(
+        "--num_prefetch_thread", type=int, default=1, help="#thread assembling batches"
+    )
+    parser.add_argument(
+        "--append_block_size", type=int, default=1, help="#episode per replay append"
+    )
+    parser.add_argument(
+        "--replay_snapshot", type=str, default="", help="replay warm start/save path"
+    )
+    parser.add_argument(
+        "--save_replay_freq", type=int, default=0, help="#epoch between snapshots"
+    )
 
     # thread setting
     parser.add_argument("--num_thread", type=int, default=10, help="#thread_loop")
@@ -95,6 +155,46 @@ def parse_args():
     parser.add_argument("--act_eps_alpha", type=float, default=7)
     parser.add_argument("--act_device", type=str, default="cuda:5")
     parser.add_argument("--actor_sync_freq", type=int, default=10)
+    parser.add_argument(
+        "--act_max_wait_us", type=int, default=0, help="max wait to batch act calls"
+    )
+    parser.add_argument(
+        "--act_latency_budget_us", type=int, default=0, help="tune act batching online"
+    )
+    parser.add_argument(
+        "--num_act_worker", type=int, default=1, help="act threads per device"
+    )
+    parser.add_argument(
+        "--act_num_thread", type=int, default=0, help="intra-op threads per act worker"
+    )
+    parser.add_argument(
+        "--max_concurrent_call",
+        type=int,
+        default=1,
+        help="model calls that may run on a device at once",
+    )
+    parser.add_argument(
+        "--act_hid_table",
+        type=int,
+        default=0,
+        help="keep the actors' lstm state on the act device, not with off_belief",
+    )
+    parser.add_argument(
+        "--incremental_obs",
+        type=int,
+        default=0,
+        help="re-encode only the parts of the observation that changed, "
+        "checked bit for bit by hanabi-learning-environment's "
+        "incremental_encoder_check",
+    )
+    parser.add_argument(
+        "--incremental_obs_check_freq",
+        type=int,
+        default=1000,
+        help="check every n-th incremental observation against a full encoding "
+        "and fall back to it on a mismatch, which fails the run at the end of "
+        "the epoch, 0: never",
+    )
 
     args = parser.parse_args()
     if args.off_belief == 1:
@@ -166,6 +266,12 @@ if __name__ == "__main__":
         False,  # uniform priority
         args.off_belief,
         args.equivariant,
+        equivariant_mode=args.equivariant_mode,
+        group_type=args.symmetry_group,
+        num_symmetry_sample=args.num_symmetry_sample,
+        keep_identity=args.symmetry_keep_identity,
+        exact_act=args.exact_symmetry_act,
+        group_colour=args.group_colour_perm,
     )
     agent.sync_target_with_online()
     print(agent.state_dict())
@@ -187,6 +293,18 @@ if __name__ == "__main__":
         clone_bot = None
 
     agent = agent.to(args.train_device)
+    if args.equivariant and args.equivariant_mode == "project":
+        equiv_proj = EquivariantProjection(
+            args.symmetry_group,
+            agent.online_net.priv_in_dim,
+            agent.online_net.out_dim,
+            args.train_device,
+            args.group_colour_perm,
+        )
+        equiv_proj.project(agent.online_net)
+        agent.sync_target_with_online()
+    else:
+        equiv_proj = None
     optim = torch.optim.Adam(agent.online_net.parameters(), lr=args.lr, eps=args.eps)
     print(agent)
     eval_agent = agent.clone(args.train_device, {"vdn": False, "boltzmann_act": False})
@@ -197,7 +315,13 @@ if __name__ == "__main__":
         args.priority_exponent,
         args.priority_weight,
         args.prefetch,
+        True,  # use sum tree
+        utils.get_bit_packed_keys(args.bit_pack_replay),
+        bool(args.slab_replay),
+        args.num_prefetch_thread,
+        args.append_block_size,
     )
+    utils.load_replay_snapshot(replay_buffer, args.replay_snapshot)
 
     belief_model = None
     if args.off_belief and args.belief_model != "None":
@@ -238,6 +362,14 @@ if __name__ == "__main__":
         args.gamma,
         args.off_belief,
         belief_model,
+        args.act_max_wait_us,
+        args.act_latency_budget_us,
+        args.num_act_worker,
+        args.act_num_thread,
+        args.max_concurrent_call,
+        args.act_hid_table and not args.off_belief,
+        args.incremental_obs,
+        args.incremental_obs_check_freq,
     )
 
     context, threads = create_threads(
@@ -247,10 +379,6 @@ if __name__ == "__main__":
         games,
     )
 
-    #if args.equivariant:
-    #    equiv = equiv_proj.EquivariantProjection(args.sad, args.train_device)
-    #    print("Equivariant projector constructed")
-
     act_group.start()
     context.start()
     while replay_buffer.size() < args.burn_in_frames:
@@ -281,6 +409,7 @@ if __name__ == "__main__":
                 agent.sync_target_with_online()
             if num_update % args.actor_sync_freq == 0:
                 act_group.update_model(agent)
+                replay_buffer.set_model_version(act_group.model_version())
 
             torch.cuda.synchronize()
             stopwatch.time("sync and updating")
@@ -306,26 +435,8 @@ if __name__ == "__main__":
             optim.step()
             optim.zero_grad()
 
-            #if args.equivariant:
-            #    assert(args.net == 'lstm' or args.net == 'publ-lstm')
-            #    state_dict = agent.online_net.state_dict()
-            #    if (args.net == 'lstm'):
-            #        assert(agent.online_net.num_ff_layer == 1)
-            #        input_weight = state_dict['net.0.weight']
-            #    elif (args.net == 'publ-lstm'):
-            #        input_weight = state_dict['priv_net.0.weight']
-            #    output_weight = state_dict['fc_a.weight']
-            #    output_bias = state_dict['fc_a.bias']
-            #    
-            #    symm_inp_weight, symm_out_weight, symm_out_bias = equiv.project(input_weight, output_weight, output_bias)
-            #    if args.net == 'publ-lstm':
-            #        state_dict['priv_net.0.weight'] = symm_inp_weight
-            #    elif args.net == 'lstm':
-            #        state_dict['net.0.weight'] = symm_inp_weight
-            #    state_dict['fc_a.weight'] = symm_out_weight
-            #    state_dict['fc_a.bias'] = symm_out_bias
-            #
-            #    agent.online_net.load_state_dict(state_dict)
+            if equiv_proj is not None and num_update % args.equivariant_proj_freq == 0:
+                equiv_proj.project(agent.online_net)
 
             torch.cuda.synchronize()
             stopwatch.time("update model")
@@ -336,11 +447,17 @@ if __name__ == "__main__":
             stat["loss"].feed(loss.detach().item())
             stat["grad_norm"].feed(g_norm)
             stat["boltzmann_t"].feed(batch.obs["temperature"][0].mean())
+            stat["policy_lag"].feed(
+                utils.get_policy_lag(batch, act_group.model_version())
+            )
 
         count_factor = args.num_player if args.method == "vdn" else 1
         print("EPOCH: %d" % epoch)
         tachometer.lap(replay_buffer, args.epoch_len * args.batchsize, count_factor)
         stopwatch.summary()
+        utils.save_replay_snapshot(
+            replay_buffer, args.replay_snapshot, epoch, args.save_replay_freq
+        )
         stat.summary(epoch)
 
         eval_seed = (9917 + epoch * 999999) % 7777777
@@ -386,4 +503,14 @@ if __name__ == "__main__":
                 "epoch %d, success rate for sampling ficticious state: %.2f%%"
                 % (epoch, 100 * np.mean(success_fict))
             )
+        if args.incremental_obs:
+            actors = common_utils.flatten(act_group.actors)
+            mismatch = sum(actor.get_encoder_mismatch() for actor in actors)
+            print("epoch %d, incremental encoding mismatches: %d" % (epoch, mismatch))
+            if mismatch > 0:
+                raise RuntimeError(
+                    "incremental observation encoding differs from the full one "
+                    "%d times, see hanabi-learning-environment's "
+                    "incremental_encoder_check" % mismatch
+                )
         print("==========")
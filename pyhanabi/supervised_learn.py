@@ -57,7 +57,6 @@ def train(
     for i in range(num_batch):
         batch, weight = replay_buffer.sample(batchsize, device)
         priv_s = batch.obs["priv_s"]
-        publ_s = batch.obs["publ_s"]
         legal_move = batch.obs["legal_move"]
         action = batch.action["a"]
         mask = torch.arange(0, priv_s.size(0), device=batch.seq_len.device)
@@ -66,7 +65,7 @@ def train(
             torch.cuda.synchronize()
             stopwatch.time("sample data")
 
-        logits, _ = model(priv_s, publ_s, None)
+        logits, _ = model(priv_s, None)
         loss = compute_loss(logits, legal_move, action, mask)
         loss.backward()
         if stopwatch is not None:
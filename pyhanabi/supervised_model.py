@@ -36,7 +36,6 @@ class LSTMNet(torch.jit.ScriptModule):
     def forward(
         self,
         priv_s: torch.Tensor,
-        publ_s: torch.Tensor,
         hid: Optional[Dict[str, torch.Tensor]] = None,
     ) -> Tuple[torch.Tensor, Dict[str, torch.Tensor]]:
         x = self.net(priv_s)
@@ -66,6 +65,8 @@ class PublicLSTMNet(torch.jit.ScriptModule):
         super().__init__()
         self.priv_in_dim = priv_in_dim
         self.publ_in_dim = publ_in_dim
+        # publ_s is the suffix of priv_s without the partner hands
+        self.publ_offset = priv_in_dim - publ_in_dim
 
         self.hid_dim = hid_dim
         self.out_dim = out_dim
@@ -101,9 +102,9 @@ class PublicLSTMNet(torch.jit.ScriptModule):
     def forward(
         self,
         priv_s: torch.Tensor,
-        publ_s: torch.Tensor,
         hid: Optional[Dict[str, torch.Tensor]] = None,
     ) -> Tuple[torch.Tensor, Dict[str, torch.Tensor]]:
+        publ_s = priv_s.narrow(priv_s.dim() - 1, self.publ_offset, self.publ_in_dim)
         x = self.publ_net(publ_s)
 
         if hid is not None:
@@ -183,22 +184,19 @@ class SupervisedAgent(torch.jit.ScriptModule):
     def forward(
         self,
         priv_s: torch.Tensor,
-        publ_s: torch.Tensor,
         hid: Optional[Dict[str, torch.Tensor]] = None,
     ) -> Tuple[torch.Tensor, Dict[str, torch.Tensor]]:
-        return self.net(priv_s, publ_s, hid)
+        return self.net(priv_s, hid)
 
     def greedy_act(
         self,
         priv_s: torch.Tensor,  # [batchsize, dim]
-        publ_s: torch.Tensor,  # [batchsize, dim]
         legal_move: torch.Tensor,  # batchsize, dim]
         hid: Dict[str, torch.Tensor],  # [num_layer, batchsize, dim]
     ) -> Tuple[torch.Tensor, Dict[str, torch.Tensor]]:
         """greedy act for 1 timestep"""
         priv_s = priv_s.unsqueeze(0)  # add time dim
-        publ_s = publ_s.unsqueeze(0)
-        logit, new_hid = self.forward(priv_s, publ_s, hid)
+        logit, new_hid = self.forward(priv_s, hid)
         logit = logit.squeeze(0)  # remove time dim
         assert logit.size() == legal_move.size()
         legal_logit = logit - (1 - legal_move) * 1e6
@@ -210,7 +208,6 @@ class SupervisedAgent(torch.jit.ScriptModule):
         bsize, dim = obs["priv_s"].size()
 
         priv_s = obs["priv_s"]
-        publ_s = obs["publ_s"]
         legal_move = obs["legal_move"]
 
         hid = {
@@ -218,7 +215,7 @@ class SupervisedAgent(torch.jit.ScriptModule):
             "c0": obs["c0"].transpose(0, 1).flatten(1, 2).contiguous(),
         }
 
-        logit, new_hid = self.forward(priv_s.unsqueeze(0), publ_s.unsqueeze(0), hid)
+        logit, new_hid = self.forward(priv_s.unsqueeze(0), hid)
         logit = logit.squeeze(0)
         legal_logit = logit - (1 - legal_move) * 1e6
         action = legal_logit.max(1)[1]
@@ -0,0 +1,535 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+#
+from itertools import permutations
+import math
+from typing import List, Optional, Tuple
+import torch
+import torch.nn as nn
+
+
+def get_symmetries(group_type):
+    """colour permutations of the group, [num_symmetries, num_colour]"""
+    if group_type == "cyclic":
+        symmetries = [
+            [0, 1, 2, 3, 4],
+            [4, 0, 1, 2, 3],
+            [3, 4, 0, 1, 2],
+            [2, 3, 4, 0, 1],
+            [1, 2, 3, 4, 0],
+        ]
+    elif group_type == "dihedral":
+        symmetries = [
+            [0, 1, 2, 3, 4],
+            [1, 2, 3, 4, 0],
+            [2, 3, 4, 0, 1],
+            [3, 4, 0, 1, 2],
+            [4, 0, 1, 2, 3],
+            [0, 4, 3, 2, 1],
+            [4, 3, 2, 1, 0],
+            [3, 2, 1, 0, 4],
+            [2, 1, 0, 4, 3],
+            [1, 0, 4, 3, 2],
+        ]
+    elif group_type == "symmetric":
+        symmetries = list(permutations([0, 1, 2, 3, 4]))
+    else:
+        assert False, f"{group_type} not implemented"
+    return torch.tensor(symmetries, dtype=torch.long)
+
+
+def input_perm_index(symm, priv_in_dim, group_colour=False):
+    """
+    index into the canonical 2 player priv_s encoding such that
+    priv_s[..., index] is priv_s with colours permuted by symm
+
+    The colour one-hot sections (last action, V0 colour hints, greedy action)
+    are permuted by symm itself as in the original symmetrized nets, which
+    only agrees with the card sections for involutions. group_colour moves
+    colour i to symm[i] there too, only those tables form a group
+    """
+    assert priv_in_dim in [658, 713], "only 2 player encoding is supported"
+    index = torch.arange(priv_in_dim)
+
+    # the cards of colour i are moved to colour symm[i]
+    colour_perm = symm.argsort() if group_colour else symm
+    card_perm = torch.zeros(25, dtype=torch.long)
+    for i, idx in enumerate(symm.tolist()):
+        card_perm[5 * idx : 5 * (idx + 1)] = 5 * i + torch.arange(5)
+
+    # partner hand
+    for i in range(5):
+        index[25 * i : 25 * (i + 1)] = card_perm + 25 * i
+
+    # fireworks
+    index[167:192] = card_perm + 167
+
+    # discards
+    for i, idx in enumerate(symm.tolist()):
+        index[203 + 10 * idx : 203 + 10 * (idx + 1)] = 203 + 10 * i + torch.arange(10)
+
+    # last action
+    index[261:266] = 261 + colour_perm
+    index[281:306] = card_perm + 281
+
+    # V0
+    for i in range(10):
+        index[308 + 35 * i : 333 + 35 * i] = card_perm + 308 + 35 * i
+        index[333 + 35 * i : 338 + 35 * i] = 333 + 35 * i + colour_perm
+
+    # greedy action
+    if priv_in_dim == 713:
+        index[666:671] = 666 + colour_perm
+        index[686:711] = card_perm + 686
+    return index
+
+
+def output_perm_index(symm, out_dim):
+    """
+    index into the action dim such that q[..., index] maps q computed on the
+    permuted input back to the original colours, i.e. the inverse transform
+    """
+    index = torch.arange(out_dim)
+    # reveal colour
+    index[10:15] = 10 + symm
+    return index
+
+
+def perm_tables(group_type, priv_in_dim, out_dim, group_colour=False):
+    """
+    index tables of all group elements for priv_s, publ_s and the action,
+    [num_symmetries, priv_in_dim], [.., publ_in_dim], [.., out_dim]
+    """
+    symmetries = get_symmetries(group_type)
+    assert symmetries[0].tolist() == list(range(5)), "1st must be identity"
+    priv_index = torch.stack(
+        [input_perm_index(s, priv_in_dim, group_colour) for s in symmetries]
+    )
+    # publ_s is priv_s without the partner hand
+    publ_index = priv_index[:, 125:] - 125
+    out_index = torch.stack([output_perm_index(s, out_dim) for s in symmetries])
+    return priv_index, publ_index, out_index
+
+
+def relative_table(perm_index):
+    """
+    rel[g, h] = g^-1 h, where the group product is read off the index
+    tables as perm_index[g][perm_index[h]] == perm_index[g h]
+    """
+    num_symmetries = perm_index.size(0)
+    lookup = {tuple(index.tolist()): g for g, index in enumerate(perm_index)}
+    compose = torch.zeros(num_symmetries, num_symmetries, dtype=torch.long)
+    for g in range(num_symmetries):
+        for h in range(num_symmetries):
+            product = tuple(perm_index[g][perm_index[h]].tolist())
+            assert product in lookup, "index tables do not form a group"
+            compose[g, h] = lookup[product]
+    inverse = (compose == 0).long().argmax(1)
+    return compose[inverse]
+
+
+class ColourSymmetry(torch.jit.ScriptModule):
+    """
+    Applies the colour permutations of a group to batches of observations
+    with precomputed index tables, and averages the outputs of the
+    expanded batch back over the group orbit.
+
+    With num_sample > 0 the orbit is estimated with num_sample group
+    elements drawn without replacement for every call of sample(). With
+    keep_identity the identity is always evaluated and weighted by
+    1 / num_symmetries, the other num_sample - 1 elements share the rest of
+    the weight, which keeps the estimate unbiased with a lower variance.
+    sample(exact=True) always returns the full orbit.
+
+    The tables are plain tensor attributes, moved along with the module in
+    _apply, so that they do not show up in the state_dict. group_colour
+    selects the tables that form a group, see input_perm_index.
+    """
+
+    __constants__ = [
+        "num_symmetries",
+        "num_sample",
+        "keep_identity",
+        "priv_in_dim",
+        "publ_in_dim",
+        "out_dim",
+    ]
+
+    def __init__(
+        self,
+        group_type,
+        priv_in_dim,
+        publ_in_dim,
+        out_dim,
+        num_sample=0,
+        keep_identity=False,
+        group_colour=False,
+    ):
+        super().__init__()
+        self.group_type = group_type
+        self.priv_in_dim = priv_in_dim
+        self.publ_in_dim = publ_in_dim
+        self.out_dim = out_dim
+
+        symmetries = get_symmetries(group_type)
+        self.num_symmetries = symmetries.size(0)
+
+        if num_sample >= self.num_symmetries:
+            num_sample = 0
+        assert num_sample == 0 or not keep_identity or num_sample >= 2
+        self.num_sample = num_sample
+        self.keep_identity = bool(keep_identity)
+
+        # publ_s is a view of the expanded priv_s, no separate table needed
+        assert publ_in_dim == priv_in_dim - 125
+        priv_index, _, out_index = perm_tables(
+            group_type, priv_in_dim, out_dim, group_colour
+        )
+
+        # [num_symmetries, dim]
+        self.symmetries = symmetries
+        self.priv_index = priv_index
+        self.out_index = out_index
+
+    def _apply(self, fn):
+        super()._apply(fn)
+        # fn only converts the dtype of floating point tensors
+        self.symmetries = fn(self.symmetries)
+        self.priv_index = fn(self.priv_index)
+        self.out_index = fn(self.out_index)
+        return self
+
+    @torch.jit.script_method
+    def sample(self, exact: bool) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        returns the group elements to evaluate and their weights in the
+        average, [num_elem], [num_elem]
+        """
+        device = self.symmetries.device
+        if exact or self.num_sample == 0:
+            symm = torch.arange(self.num_symmetries, device=device)
+            weight = torch.ones(self.num_symmetries, device=device)
+            return symm, weight / self.num_symmetries
+
+        if not self.keep_identity:
+            symm = torch.randperm(self.num_symmetries, device=device)
+            symm = symm[: self.num_sample]
+            weight = torch.ones(self.num_sample, device=device)
+            return symm, weight / self.num_sample
+
+        other = torch.randperm(self.num_symmetries - 1, device=device)
+        other = other[: self.num_sample - 1] + 1
+        symm = torch.cat([torch.zeros(1, dtype=other.dtype, device=device), other])
+        other_weight = (self.num_symmetries - 1) / (self.num_sample - 1)
+        weight = torch.full((self.num_sample,), other_weight, device=device)
+        weight[0] = 1.0
+        return symm, weight / self.num_symmetries
+
+    @torch.jit.script_method
+    def expand(self, x: torch.Tensor, index: torch.Tensor) -> torch.Tensor:
+        # x: [..., batch, dim] -> [..., batch x num_elem, dim]
+        size = x.size()
+        size[-2] = size[-2] * index.size(0)
+        return x.index_select(-1, index.flatten()).view(size)
+
+    @torch.jit.script_method
+    def expand_priv(self, priv_s: torch.Tensor, symm: torch.Tensor) -> torch.Tensor:
+        return self.expand(priv_s, self.priv_index.index_select(0, symm))
+
+    @torch.jit.script_method
+    def expand_hid(self, hid: torch.Tensor, symm: torch.Tensor) -> torch.Tensor:
+        # hid: [num_layer, batch, dim] -> [num_layer, batch x num_elem, dim]
+        return hid.repeat_interleave(symm.size(0), dim=1)
+
+    @torch.jit.script_method
+    def expand_seq_len(self, seq_len: torch.Tensor, symm: torch.Tensor) -> torch.Tensor:
+        # seq_len: [batch] -> [batch x num_elem]
+        return seq_len.repeat_interleave(symm.size(0))
+
+    @torch.jit.script_method
+    def average(self, x: torch.Tensor, weight: torch.Tensor) -> torch.Tensor:
+        # x: [..., batch x num_elem, dim] -> [..., batch, dim]
+        num_elem = weight.size(0)
+        size = x.size()
+        size[-2] = size[-2] // num_elem
+        size.insert(len(size) - 1, num_elem)
+        return (x.reshape(size) * weight.unsqueeze(1)).sum(-2)
+
+    @torch.jit.script_method
+    def average_output(
+        self, a: torch.Tensor, symm: torch.Tensor, weight: torch.Tensor
+    ) -> torch.Tensor:
+        # a: [..., batch x num_elem, out_dim] -> [..., batch, out_dim]
+        num_elem = symm.size(0)
+        out_index = self.out_index.index_select(0, symm)
+        # offset to index into the flattened [num_elem x out_dim] output
+        offset = self.out_dim * torch.arange(num_elem, device=out_index.device)
+        out_index = (out_index + offset.unsqueeze(1)).flatten()
+
+        size = a.size()
+        size[-2] = size[-2] // num_elem
+        size[-1] = num_elem * self.out_dim
+        a = a.reshape(size).index_select(-1, out_index)
+        size[-1] = self.out_dim
+        size.insert(len(size) - 1, num_elem)
+        return (a.view(size) * weight.unsqueeze(1)).sum(-2)
+
+
+# Layers with weights tied by the group structure, on features in the
+# regular representation, i.e. [..., num_symmetries x channel] where the
+# slice of element g holds the features of the input permuted by g. A single
+# forward of a net built from them is exactly equivariant, no orbit expansion.
+# The full weights are gathered from the tied parameters at every call.
+
+
+class GroupLiftLinear(torch.jit.ScriptModule):
+    """input encoding -> regular representation, h[g] = W x[perm_index[g]] + b"""
+
+    __constants__ = ["num_symmetries", "in_dim", "out_channel"]
+
+    def __init__(self, perm_index, out_channel):
+        super().__init__()
+        self.num_symmetries, self.in_dim = perm_index.size()
+        self.out_channel = out_channel
+        self.linear = nn.Linear(self.in_dim, out_channel)
+        # W is applied to x[perm_index[g]], i.e. x sees W[:, inv_index[g]]
+        self.inv_index = perm_index.argsort(1).flatten()
+
+    def _apply(self, fn):
+        super()._apply(fn)
+        self.inv_index = fn(self.inv_index)
+        return self
+
+    @torch.jit.script_method
+    def full_weight(self) -> Tuple[torch.Tensor, torch.Tensor]:
+        weight = self.linear.weight.index_select(1, self.inv_index)
+        weight = weight.view(self.out_channel, self.num_symmetries, self.in_dim)
+        weight = weight.transpose(0, 1).reshape(-1, self.in_dim)
+        bias = self.linear.bias.repeat(self.num_symmetries)
+        return weight, bias
+
+    @torch.jit.script_method
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        weight, bias = self.full_weight()
+        return nn.functional.linear(x, weight, bias)
+
+
+@torch.jit.script
+def tied_weight(
+    kernel: torch.Tensor, rel_index: torch.Tensor, num_symmetries: int, in_channel: int
+) -> torch.Tensor:
+    """
+    kernel: [num_gate, out_channel, num_symmetries x in_channel]
+    return: [num_gate x num_symmetries x out_channel, num_symmetries x in_channel]
+    """
+    num_gate, out_channel = kernel.size(0), kernel.size(1)
+    # [num_gate, num_symmetries(rel), out_channel, in_channel]
+    kernel = kernel.view(num_gate, out_channel, num_symmetries, in_channel)
+    kernel = kernel.transpose(1, 2)
+    weight = kernel.index_select(1, rel_index).view(
+        num_gate, num_symmetries, num_symmetries, out_channel, in_channel
+    )
+    weight = weight.transpose(2, 3).reshape(
+        num_gate * num_symmetries * out_channel, num_symmetries * in_channel
+    )
+    return weight
+
+
+class GroupLinear(torch.jit.ScriptModule):
+    """regular -> regular representation, h'[g] = sum_h K[g^-1 h] h[h] + b"""
+
+    __constants__ = ["num_symmetries", "in_channel", "out_channel"]
+
+    def __init__(self, rel_index, in_channel, out_channel):
+        super().__init__()
+        self.num_symmetries = rel_index.size(0)
+        self.in_channel = in_channel
+        self.out_channel = out_channel
+        # K[g] = weight[:, g * in_channel : (g + 1) * in_channel]
+        self.linear = nn.Linear(self.num_symmetries * in_channel, out_channel)
+        self.rel_index = rel_index.flatten()
+
+    def _apply(self, fn):
+        super()._apply(fn)
+        self.rel_index = fn(self.rel_index)
+        return self
+
+    @torch.jit.script_method
+    def full_weight(self) -> Tuple[torch.Tensor, torch.Tensor]:
+        weight = tied_weight(
+            self.linear.weight.unsqueeze(0),
+            self.rel_index,
+            self.num_symmetries,
+            self.in_channel,
+        )
+        bias = self.linear.bias.repeat(self.num_symmetries)
+        return weight, bias
+
+    @torch.jit.script_method
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        weight, bias = self.full_weight()
+        return nn.functional.linear(x, weight, bias)
+
+
+class GroupPoolLinear(torch.jit.ScriptModule):
+    """regular representation -> invariant output, pools over the group"""
+
+    __constants__ = ["num_symmetries", "in_channel"]
+
+    def __init__(self, num_symmetries, in_channel, out_dim):
+        super().__init__()
+        self.num_symmetries = num_symmetries
+        self.in_channel = in_channel
+        self.linear = nn.Linear(in_channel, out_dim)
+
+    @torch.jit.script_method
+    def full_weight(self) -> Tuple[torch.Tensor, torch.Tensor]:
+        weight = self.linear.weight.repeat(1, self.num_symmetries)
+        return weight / self.num_symmetries, self.linear.bias
+
+    @torch.jit.script_method
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        size = x.size()
+        size[-1] = self.num_symmetries
+        size.append(self.in_channel)
+        return self.linear(x.view(size).mean(-2))
+
+
+class GroupOutputLinear(torch.jit.ScriptModule):
+    """
+    regular representation -> action, q = mean_g (A h[g] + b)[out_index[g]],
+    the same orbit average as in ColourSymmetry.average_output
+    """
+
+    __constants__ = ["num_symmetries", "in_channel", "out_dim"]
+
+    def __init__(self, out_index, in_channel):
+        super().__init__()
+        self.num_symmetries, self.out_dim = out_index.size()
+        self.in_channel = in_channel
+        self.linear = nn.Linear(in_channel, self.out_dim)
+        self.out_index = out_index.flatten()
+
+    def _apply(self, fn):
+        super()._apply(fn)
+        self.out_index = fn(self.out_index)
+        return self
+
+    @torch.jit.script_method
+    def full_weight(self) -> Tuple[torch.Tensor, torch.Tensor]:
+        weight = self.linear.weight.index_select(0, self.out_index)
+        weight = weight.view(self.num_symmetries, self.out_dim, self.in_channel)
+        weight = weight.transpose(0, 1).reshape(self.out_dim, -1)
+        weight = weight / self.num_symmetries
+        bias = self.linear.bias.index_select(0, self.out_index)
+        bias = bias.view(self.num_symmetries, self.out_dim).mean(0)
+        return weight, bias
+
+    @torch.jit.script_method
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        weight, bias = self.full_weight()
+        return nn.functional.linear(x, weight, bias)
+
+
+class GroupLSTM(torch.jit.ScriptModule):
+    """
+    LSTM whose input, hidden and cell states are all in the regular
+    representation, every gate is a GroupLinear of x and h
+    """
+
+    __constants__ = ["num_symmetries", "channel", "num_layer"]
+
+    def __init__(self, rel_index, channel, num_layer):
+        super().__init__()
+        self.num_symmetries = rel_index.size(0)
+        self.channel = channel
+        self.num_layer = num_layer
+        self.rel_index = rel_index.flatten()
+
+        # [num_layer, num_gate, channel, num_symmetries x channel]
+        weight_shape = (num_layer, 4, channel, self.num_symmetries * channel)
+        bias_shape = (num_layer, 4, 1, channel)
+        self.weight_ih = nn.Parameter(torch.empty(weight_shape))
+        self.weight_hh = nn.Parameter(torch.empty(weight_shape))
+        self.bias_ih = nn.Parameter(torch.empty(bias_shape))
+        self.bias_hh = nn.Parameter(torch.empty(bias_shape))
+        # same init as nn.LSTM of the full hidden size
+        bound = 1.0 / math.sqrt(self.num_symmetries * channel)
+        for p in self.parameters():
+            nn.init.uniform_(p, -bound, bound)
+
+    def _apply(self, fn):
+        super()._apply(fn)
+        self.rel_index = fn(self.rel_index)
+        return self
+
+    @torch.jit.script_method
+    def flat_weights(self) -> List[torch.Tensor]:
+        # in the layout of nn.LSTM, i.e. w_ih, w_hh, b_ih, b_hh for each layer
+        weights: List[torch.Tensor] = []
+        for i in range(self.num_layer):
+            for weight in [self.weight_ih[i], self.weight_hh[i]]:
+                weights.append(
+                    tied_weight(
+                        weight, self.rel_index, self.num_symmetries, self.channel
+                    )
+                )
+            for bias in [self.bias_ih[i], self.bias_hh[i]]:
+                weights.append(bias.repeat(1, self.num_symmetries, 1).flatten())
+        return weights
+
+    @torch.jit.script_method
+    def forward(
+        self, x: torch.Tensor, hid: Tuple[torch.Tensor, torch.Tensor]
+    ) -> Tuple[torch.Tensor, Tuple[torch.Tensor, torch.Tensor]]:
+        # x: [seq_len, batch, dim], hid: [num_layer, batch, dim]
+        o, h, c = torch.lstm(
+            x,
+            [hid[0], hid[1]],
+            self.flat_weights(),
+            True,
+            self.num_layer,
+            0.0,
+            self.training,
+            False,
+            False,
+        )
+        return o, (h, c)
+
+    @torch.jit.script_method
+    def forward_packed(
+        self,
+        x: torch.Tensor,
+        hid: Tuple[torch.Tensor, torch.Tensor],
+        seq_len: torch.Tensor,
+    ) -> torch.Tensor:
+        """skip the padding steps beyond seq_len, the padded outputs are zero"""
+        packed_x = nn.utils.rnn.pack_padded_sequence(
+            x, seq_len.long().cpu(), enforce_sorted=False
+        )
+        sorted_indices = packed_x.sorted_indices
+        assert sorted_indices is not None
+        h0 = hid[0].index_select(1, sorted_indices)
+        c0 = hid[1].index_select(1, sorted_indices)
+        packed_o, _, _ = torch.lstm(
+            packed_x.data,
+            packed_x.batch_sizes,
+            [h0, c0],
+            self.flat_weights(),
+            True,
+            self.num_layer,
+            0.0,
+            self.training,
+            False,
+        )
+        packed_o = nn.utils.rnn.PackedSequence(
+            packed_o,
+            packed_x.batch_sizes,
+            packed_x.sorted_indices,
+            packed_x.unsorted_indices,
+        )
+        o, _ = nn.utils.rnn.pad_packed_sequence(packed_o, total_length=x.size(0))
+        return o
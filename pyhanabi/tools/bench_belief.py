@@ -0,0 +1,95 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+#
+# throughput of ARBeliefModel.sample, i.e. of the belief sampling done by the
+# OBL actors every step, on random inputs
+import argparse
+import os
+import sys
+import time
+
+import torch
+
+lib_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(lib_path)
+from belief_model import ARBeliefModel
+
+
+def make_input(bsize, in_dim, hand_size, h0):
+    obs = {
+        "priv_s": torch.rand(bsize, in_dim),
+        "h0": h0["h0"].transpose(0, 1).unsqueeze(2).repeat(bsize, 1, 1, 1),
+        "c0": h0["c0"].transpose(0, 1).unsqueeze(2).repeat(bsize, 1, 1, 1),
+    }
+    # every card is still available & plausible
+    obs["card_count"] = torch.full((bsize, 25), 3.0)
+    obs["v0"] = torch.full((bsize, hand_size * 35), 1 / 25)
+    return obs
+
+
+def bench(model, bsize, in_dim, constrained, num_iter, device):
+    obs = make_input(bsize, in_dim, model.hand_size, model.get_h0(1))
+    if not constrained:
+        obs.pop("card_count")
+    obs = {k: v.to(device) for k, v in obs.items()}
+
+    with torch.no_grad():
+        for _ in range(3):
+            model.sample(obs)
+        if device.startswith("cuda"):
+            torch.cuda.synchronize()
+        t = time.time()
+        for _ in range(num_iter):
+            model.sample(obs)
+        if device.startswith("cuda"):
+            torch.cuda.synchronize()
+    return time.time() - t
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--belief_model", type=str, default=None)
+    parser.add_argument("--device", type=str, default="cuda:0")
+    parser.add_argument(
+        "--in_dim", type=int, default=783, help="priv_s dim, without --belief_model"
+    )
+    parser.add_argument(
+        "--hid_dim", type=int, default=512, help="without --belief_model"
+    )
+    parser.add_argument("--fc_only", type=int, default=0)
+    parser.add_argument("--num_sample", type=int, default=1)
+    parser.add_argument(
+        "--batchsize", type=str, default="1,16,128,1024", help="comma separated"
+    )
+    parser.add_argument("--constrained", type=int, default=1)
+    parser.add_argument("--num_iter", type=int, default=100)
+    args = parser.parse_args()
+
+    if args.belief_model is None:
+        model = ARBeliefModel(
+            args.device,
+            args.in_dim,
+            args.hid_dim,
+            5,  # hand_size
+            25,  # bits per card
+            args.num_sample,
+            bool(args.fc_only),
+        ).to(args.device)
+        in_dim = args.in_dim
+    else:
+        model = ARBeliefModel.load(
+            args.belief_model, args.device, 5, args.num_sample, bool(args.fc_only)
+        )
+        in_dim = model.in_dim
+    model.train(False)
+
+    for bsize in [int(b) for b in args.batchsize.split(",")]:
+        t = bench(model, bsize, in_dim, args.constrained, args.num_iter, args.device)
+        num_hand = bsize * args.num_sample * args.num_iter
+        print(
+            f"batchsize: {bsize}, num_sample: {args.num_sample}, "
+            f"{1000 * t / args.num_iter:.3f} ms/call, {num_hand / t:.0f} hands/s"
+        )
@@ -0,0 +1,385 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+#
+"""
+Export an equivariant R2D2 agent to a plain LSTMNet/PublicLSTMNet checkpoint.
+The group tied nets are folded into the plain weights exactly and verified
+on random inputs, the orbit averaging nets are distilled on the self-play
+games of the equivariant agent and verified on fresh self-play states.
+"""
+import argparse
+import os
+import sys
+import time
+import pprint
+
+import torch
+import torch.nn as nn
+
+lib_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(lib_path)
+from act_group import ActGroup
+from create import create_envs, create_threads
+from eval import evaluate
+from net import TiedEquivariantLSTMNet, TiedEquivariantPublicLSTMNet
+import common_utils
+import rela
+import r2d2
+import utils
+
+
+def create_plain_agent(agent, device):
+    in_dim = agent.online_net.in_dim
+    plain = r2d2.R2D2Agent(
+        False,  # vdn
+        agent.multi_step,
+        agent.gamma,
+        agent.eta,
+        device,
+        in_dim,
+        agent.online_net.hid_dim,
+        agent.online_net.out_dim,
+        agent.net,
+        agent.num_lstm_layer,
+        False,  # boltzmann_act
+        agent.uniform_priority,
+        agent.off_belief,
+        0,  # equivariant
+    )
+    return plain.to(device)
+
+
+@torch.no_grad()
+def fold_tied_net(tied, plain):
+    """copy the full weights of the group tied layers into the plain net"""
+
+    def copy_linear(dst, src):
+        weight, bias = src.full_weight()
+        dst.weight.copy_(weight)
+        dst.bias.copy_(bias)
+
+    if isinstance(tied, TiedEquivariantPublicLSTMNet):
+        seqs = [(plain.priv_net, tied.priv_net), (plain.publ_net, tied.publ_net)]
+    else:
+        assert isinstance(tied, TiedEquivariantLSTMNet)
+        seqs = [(plain.net, tied.net)]
+    for dst_seq, src_seq in seqs:
+        for dst, src in zip(dst_seq, src_seq):
+            if isinstance(dst, nn.Linear):
+                copy_linear(dst, src)
+
+    # flat_weights is in the same layout as nn.LSTM
+    weights = tied.lstm.flat_weights()
+    for name, weight in zip(plain.lstm._flat_weights_names, weights):
+        getattr(plain.lstm, name).copy_(weight)
+
+    for name in ["fc_v", "fc_a", "pred_1st"]:
+        copy_linear(getattr(plain, name), getattr(tied, name))
+
+
+def compare_q(teacher, student, priv_s, legal_move, action, hid, seq_len):
+    """
+    q of both nets on the same inputs
+    return err: [seq_len, batch, num_action] on the legal actions of the valid
+    steps, agree: [batch] #steps with the same greedy action
+    """
+    with torch.no_grad():
+        _, teacher_a, teacher_q, _ = teacher.online_net(
+            priv_s, legal_move, action, hid, seq_len
+        )
+    _, student_a, student_q, _ = student.online_net(
+        priv_s, legal_move, action, hid, seq_len
+    )
+
+    max_seq_len = priv_s.size(0)
+    mask = torch.arange(0, max_seq_len, device=seq_len.device)
+    mask = (mask.unsqueeze(1) < seq_len.unsqueeze(0)).float()
+    err = (student_q - teacher_q.detach()) * legal_move * mask.unsqueeze(2)
+    agree = ((student_a == teacher_a).float() * mask).sum(0)
+    return err, agree
+
+
+def distill_loss(teacher, student, batch):
+    """
+    regress student q onto teacher q on the legal actions of the valid steps
+    return loss: [batch], agree: [batch], num_step: [batch]
+    """
+    hid = {k: v.flatten(1, 2).contiguous() for k, v in batch.h0.items()}
+    err, agree = compare_q(
+        teacher,
+        student,
+        batch.obs["priv_s"],
+        batch.obs["legal_move"],
+        batch.action["a"],
+        hid,
+        batch.seq_len,
+    )
+    loss = err.pow(2).sum(2).sum(0)
+    return loss, agree, batch.seq_len
+
+
+@torch.no_grad()
+def verify_fold(teacher, student, max_len, args):
+    """
+    action agreement & max |q difference| of the folded net on random binary
+    observations, legal moves & lstm states, no self-play needed
+    """
+    net = teacher.online_net
+    device = args.train_device
+    num_agree = 0
+    num_step = 0
+    max_diff = 0
+    for _ in range(args.num_verify_batch):
+        size = (max_len, args.batchsize)
+        priv_s = (torch.rand(*size, net.priv_in_dim, device=device) < 0.5).float()
+        legal_move = (torch.rand(*size, net.out_dim, device=device) < 0.5).float()
+        legal_move[:, :, -1] = 1  # at least one legal move
+        action = torch.randint(0, net.out_dim, size, device=device)
+        hid_size = (net.num_lstm_layer, args.batchsize, net.hid_dim)
+        hid = {
+            "h0": torch.randn(*hid_size, device=device),
+            "c0": torch.randn(*hid_size, device=device),
+        }
+        seq_len = torch.randint(1, max_len + 1, (args.batchsize,), device=device)
+        err, agree = compare_q(
+            teacher, student, priv_s, legal_move, action, hid, seq_len
+        )
+        max_diff = max(max_diff, err.abs().max().item())
+        num_agree += agree.sum().item()
+        num_step += seq_len.sum().item()
+    return num_agree / num_step, max_diff
+
+
+def distill(teacher, student, cfg, args):
+    """distill on the self-play games of the teacher, returns the agreement"""
+    max_len = cfg["max_len"]
+    games = create_envs(
+        args.num_thread * args.num_game_per_thread,
+        args.seed,
+        cfg["num_player"],
+        cfg["train_bomb"],
+        max_len,
+    )
+    replay_buffer = rela.RNNPrioritizedReplay(
+        args.replay_buffer_size,
+        args.seed,
+        args.priority_exponent,
+        args.priority_weight,
+        args.prefetch,
+    )
+    explore_eps = utils.generate_explore_eps(
+        args.act_base_eps, args.act_eps_alpha, args.num_t
+    )
+    act_group = ActGroup(
+        args.act_device,
+        teacher,
+        args.seed,
+        args.num_thread,
+        args.num_game_per_thread,
+        cfg["num_player"],
+        explore_eps,
+        [],  # boltzmann_t
+        "iql",
+        cfg["sad"],
+        0,  # shuffle_color
+        cfg["hide_action"],
+        True,  # trinary, 3 bits for aux task
+        replay_buffer,
+        teacher.multi_step,
+        max_len,
+        teacher.gamma,
+        False,  # off_belief
+        None,  # belief_model
+    )
+    context, threads = create_threads(
+        args.num_thread,
+        args.num_game_per_thread,
+        act_group.actors,
+        games,
+    )
+    act_group.start()
+    context.start()
+    while replay_buffer.size() < args.burn_in_frames:
+        print("warming up replay buffer:", replay_buffer.size())
+        time.sleep(1)
+
+    optim = torch.optim.Adam(student.online_net.parameters(), lr=args.lr, eps=args.eps)
+    stat = common_utils.MultiCounter(args.save_dir)
+    for epoch in range(args.num_epoch):
+        stat.reset()
+        for _ in range(args.epoch_len):
+            batch, weight = replay_buffer.sample(args.batchsize, args.train_device)
+            loss, agree, seq_len = distill_loss(teacher, student, batch)
+            replay_buffer.update_priority((loss / seq_len).detach().cpu())
+            loss = (loss / seq_len * weight).mean()
+            loss.backward()
+            g_norm = torch.nn.utils.clip_grad_norm_(
+                student.online_net.parameters(), args.grad_clip
+            )
+            optim.step()
+            optim.zero_grad()
+            stat["loss"].feed(loss.detach().item())
+            stat["grad_norm"].feed(g_norm)
+            stat["agreement"].feed((agree.sum() / seq_len.sum()).item())
+        stat.summary(epoch)
+
+    agreement = verify(teacher, student, replay_buffer, args)
+    context.terminate()
+    while not context.terminated():
+        time.sleep(0.5)
+    return agreement
+
+
+def verify(teacher, student, replay_buffer, args):
+    num_agree = 0
+    num_step = 0
+    for _ in range(args.num_verify_batch):
+        batch, _ = replay_buffer.sample(args.batchsize, args.train_device)
+        with torch.no_grad():
+            loss, agree, seq_len = distill_loss(teacher, student, batch)
+        replay_buffer.update_priority(loss.detach().cpu())
+        num_agree += agree.sum().item()
+        num_step += seq_len.sum().item()
+    return num_agree / num_step
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="export equivariant agent")
+    parser.add_argument("--model", type=str, required=True)
+    parser.add_argument("--save_dir", type=str, required=True)
+    parser.add_argument("--seed", type=int, default=1)
+
+    # distillation
+    parser.add_argument("--lr", type=float, default=6.25e-5)
+    parser.add_argument("--eps", type=float, default=1.5e-5, help="Adam epsilon")
+    parser.add_argument("--grad_clip", type=float, default=5)
+    parser.add_argument("--batchsize", type=int, default=64)
+    parser.add_argument("--num_epoch", type=int, default=100)
+    parser.add_argument("--epoch_len", type=int, default=1000)
+    parser.add_argument("--burn_in_frames", type=int, default=10000)
+    parser.add_argument("--replay_buffer_size", type=int, default=100000)
+    parser.add_argument("--priority_exponent", type=float, default=0.9)
+    parser.add_argument("--priority_weight", type=float, default=0.6)
+    parser.add_argument("--prefetch", type=int, default=3)
+
+    # self-play of the equivariant agent
+    parser.add_argument("--num_thread", type=int, default=10)
+    parser.add_argument("--num_game_per_thread", type=int, default=40)
+    parser.add_argument("--act_base_eps", type=float, default=0.1)
+    parser.add_argument("--act_eps_alpha", type=float, default=7)
+    parser.add_argument("--num_t", type=int, default=80)
+    parser.add_argument("--act_device", type=str, default="cuda:1")
+    parser.add_argument("--train_device", type=str, default="cuda:0")
+
+    # verification
+    parser.add_argument("--num_verify_batch", type=int, default=100)
+    parser.add_argument("--num_eval_game", type=int, default=1000)
+    parser.add_argument(
+        "--min_agreement",
+        type=float,
+        default=0.99,
+        help="only save the exported model above this action agreement",
+    )
+    parser.add_argument(
+        "--fold_atol",
+        type=float,
+        default=1e-3,
+        help="only save a folded tied net if its q values differ at most this much",
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    pprint.pprint(vars(args))
+    common_utils.set_all_seeds(args.seed)
+
+    teacher, cfg = utils.load_agent(
+        args.model,
+        {"device": args.train_device, "vdn": False, "equivariant": 1},
+    )
+    teacher.train(False)
+    student = create_plain_agent(teacher, args.train_device)
+    exact = isinstance(
+        teacher.online_net, (TiedEquivariantLSTMNet, TiedEquivariantPublicLSTMNet)
+    )
+    print("teacher:", type(teacher.online_net).__name__)
+    print("student:", type(student.online_net).__name__)
+    max_diff = 0
+    if exact:
+        print("group tied weights, folding into the plain net")
+        fold_tied_net(teacher.online_net, student.online_net)
+        agreement, max_diff = verify_fold(teacher, student, cfg["max_len"], args)
+        print("max |q difference| of the folded net: %.3g" % max_diff)
+    else:
+        print("orbit averaging net, distilling on self-play")
+        agreement = distill(teacher, student, cfg, args)
+    print(
+        "action agreement on %d batches: %.2f%%"
+        % (args.num_verify_batch, 100 * agreement)
+    )
+
+    teacher_score, teacher_perfect, *_ = evaluate(
+        [teacher for _ in range(cfg["num_player"])],
+        args.num_eval_game,
+        args.seed,
+        0,  # bomb
+        0,  # eps
+        cfg["sad"],
+        cfg["hide_action"],
+        device=args.train_device,
+    )
+    student_score, student_perfect, *_ = evaluate(
+        [student for _ in range(cfg["num_player"])],
+        args.num_eval_game,
+        args.seed,
+        0,  # bomb
+        0,  # eps
+        cfg["sad"],
+        cfg["hide_action"],
+        device=args.train_device,
+    )
+    print(
+        "equivariant score: %.3f, perfect: %.2f%%"
+        % (teacher_score, 100 * teacher_perfect)
+    )
+    print("plain score: %.3f, perfect: %.2f%%" % (student_score, 100 * student_perfect))
+
+    if agreement < args.min_agreement:
+        print("agreement below %.2f%%, not saving" % (100 * args.min_agreement))
+        sys.exit(1)
+    if max_diff > args.fold_atol:
+        print("q difference above %.3g, not saving" % args.fold_atol)
+        sys.exit(1)
+
+    if not os.path.exists(args.save_dir):
+        os.makedirs(args.save_dir)
+    # load_agent reads the config from the train.log next to the model. the
+    # tied nets round hid_dim down to a multiple of the group size, so record
+    # the width the plain net is actually built with instead of the teacher's
+    plain_cfg = dict(cfg)
+    plain_cfg["hid_dim"] = student.online_net.hid_dim
+    plain_cfg.pop("rnn_hid_dim", None)
+    plain_cfg["equivariant"] = 0
+    with open(os.path.join(args.save_dir, "train.log"), "w") as f:
+        f.write(pprint.pformat(plain_cfg) + "\n")
+    save_path = os.path.join(args.save_dir, "model0.pthw")
+    print("saving model to:", save_path)
+    torch.save(student.online_net.state_dict(), save_path)
+
+    # load_weight only warns on a shape mismatch, make sure the exported
+    # model really comes back with its weights
+    reloaded, _ = utils.load_agent(
+        save_path, {"device": args.train_device, "vdn": False}
+    )
+    exported = student.online_net.state_dict()
+    for k, v in reloaded.online_net.state_dict().items():
+        if k not in exported or v.size() != exported[k].size():
+            raise RuntimeError(
+                "re-loaded model does not match the exported shape at %s" % k
+            )
+        if not torch.equal(v, exported[k]):
+            raise RuntimeError("%s not re-loaded" % k)
@@ -41,28 +41,29 @@ def run_game(agents, seed, verbose, op):
         actions = []
         new_hids = []
 
-        for i, (agent, hid) in enumerate(zip(agents, hids)):
-            # Note: argument here is (game_state, player_idx, hide_action)
-            # make sure to specify the correct hide_action value
-            if op:
-                obs = hanalearn.observe_op(
-                    game.get_hle_state(),
-                    i,
-                    True,
-                    color_permutes[i],
-                    inv_color_permutes[i],
-                    False,
-                    True,
-                    False,
-                )
-            else:
-                obs = hanalearn.observe(game.get_hle_state(), i, False)
+        # Note: make sure to specify the correct hide_action value
+        # all players are observed at once, obs[k][i] is player i's
+        if op:
+            obs = hanalearn.observe_batch(
+                [game.get_hle_state()] * len(agents),
+                list(range(len(agents))),
+                shuffle_color=True,
+                color_permutes=color_permutes,
+                inv_color_permutes=inv_color_permutes,
+                hide_action=False,
+            )
+        else:
+            obs = hanalearn.observe_batch(
+                [game.get_hle_state()] * len(agents),
+                list(range(len(agents))),
+                hide_action=False,
+            )
 
-            priv_s = obs["priv_s"].cuda().unsqueeze(0)
-            publ_s = obs["publ_s"].cuda().unsqueeze(0)
-            legal_move = obs["legal_move"].cuda().unsqueeze(0)
+        for i, (agent, hid) in enumerate(zip(agents, hids)):
+            priv_s = obs["priv_s"][i].cuda().unsqueeze(0)
+            legal_move = obs["legal_move"][i].cuda().unsqueeze(0)
 
-            action, new_hid = agent.greedy_act(priv_s, publ_s, legal_move, hid)
+            action, new_hid = agent.greedy_act(priv_s, legal_move, hid)
             if i == 0:
                 actions.append([action.item()])
             else:
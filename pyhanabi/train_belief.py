@@ -51,6 +51,24 @@ def parse_args():
     parser.add_argument("--burn_in_frames", type=int, default=80000)
     parser.add_argument("--replay_buffer_size", type=int, default=2 ** 20)
     parser.add_argument("--prefetch", type=int, default=3, help="#prefetch batch")
+    parser.add_argument(
+        "--bit_pack_replay", type=int, default=0, help="store binary obs as bits"
+    )
+    parser.add_argument(
+        "--slab_replay", type=int, default=0, help="preallocated replay storage"
+    )
+    parser.add_argument(
+        "--num_prefetch_thread", type=int, default=1, help="#thread assembling batches"
+    )
+    parser.add_argument(
+        "--append_block_size", type=int, default=1, help="#episode per replay append"
+    )
+    parser.add_argument(
+        "--replay_snapshot", type=str, default="", help="replay warm start/save path"
+    )
+    parser.add_argument(
+        "--save_replay_freq", type=int, default=0, help="#epoch between snapshots"
+    )
 
     # thread setting
     parser.add_argument("--num_thread", type=int, default=40, help="#thread_loop")
@@ -101,7 +119,13 @@ def create_rl_context(args):
         1.0,  # priority exponent
         0.0,  # priority weight
         args.prefetch,
+        True,  # use sum tree
+        utils.get_bit_packed_keys(args.bit_pack_replay),
+        bool(args.slab_replay),
+        args.num_prefetch_thread,
+        args.append_block_size,
     )
+    utils.load_replay_snapshot(replay_buffer, args.replay_snapshot)
 
     if args.rand:
         explore_eps = [1]
@@ -188,7 +212,13 @@ def create_sl_context(args):
         priority_exponent,
         priority_weight,
         args.prefetch,
+        True,  # use sum tree
+        utils.get_bit_packed_keys(args.bit_pack_replay),
+        bool(args.slab_replay),
+        args.num_prefetch_thread,
+        args.append_block_size,
     )
+    utils.load_replay_snapshot(replay_buffer, args.replay_snapshot)
     data_gen = hanalearn.CloneDataGenerator(
         replay_buffer,
         args.num_player,
@@ -306,6 +336,9 @@ if __name__ == "__main__":
 
         count_factor = 1
         tachometer.lap(replay_buffer, args.epoch_len * args.batchsize, count_factor)
+        utils.save_replay_snapshot(
+            replay_buffer, args.replay_snapshot, epoch, args.save_replay_freq
+        )
 
         force_save_name = None
         if epoch > 0 and epoch % 100 == 0:
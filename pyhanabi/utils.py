@@ -17,6 +17,34 @@ import common_utils
 from supervised_model import SupervisedAgent
 
 
+def get_bit_packed_keys(bit_pack):
+    """obs keys stored as bit fields in the replay buffer, missing ones are skipped"""
+    if not bit_pack:
+        return []
+    return ["priv_s", "legal_move", "own_hand", "own_hand_ar_in"]
+
+
+def load_replay_snapshot(replay_buffer, path):
+    """warm start the (empty) replay buffer from <path> if it exists"""
+    if not path or not os.path.exists(path):
+        return
+    t = time.time()
+    replay_buffer.load(path, True)  # mmap
+    print(
+        "loaded %d episodes from %s in %.1fs"
+        % (replay_buffer.size(), path, time.time() - t)
+    )
+
+
+def save_replay_snapshot(replay_buffer, path, epoch, freq):
+    """save every <freq> epochs, the previous snapshot is replaced atomically"""
+    if not path or freq <= 0 or (epoch + 1) % freq != 0:
+        return
+    t = time.time()
+    replay_buffer.save(path)
+    print("saved replay snapshot to %s in %.1fs" % (path, time.time() - t))
+
+
 def load_supervised_agent(weight_file, device):
     # this is a bit hard-coded, works for now
     print("loading file from: ", weight_file)
@@ -185,8 +213,13 @@ def load_agent(weight_file, overwrite):
         config["nlayer"] = cfg["nlayer"]
         config["max_len"] = cfg["max_len"]
 
-    config["equivariant"] = 0
-    
+    # equivariant checkpoints have to be asked for explicitly
+    config["equivariant"] = overwrite.get("equivariant", 0)
+    if config["equivariant"]:
+        config["equivariant_mode"] = cfg.get("equivariant_mode", "symmetrize")
+        config["group_type"] = cfg.get("symmetry_group", "cyclic")
+        config["group_colour"] = bool(cfg.get("group_colour_perm", 0))
+
     agent = r2d2.R2D2Agent(**config).to(config["device"])
     load_weight(agent.online_net, weight_file, config["device"])
     agent.sync_target_with_online()
@@ -246,6 +279,8 @@ class Tachometer:
         self.num_train = 0
         self.t = None
         self.total_time = 0
+        self.prefetch_stats = None
+        self.replay_stats = None
 
     def start(self):
         self.t = time.time()
@@ -262,6 +297,10 @@ class Tachometer:
         )
         self.num_buffer = num_buffer
         self.num_train += num_train
+        if hasattr(replay_buffer, "prefetch_stats"):
+            self._lap_prefetch(replay_buffer.prefetch_stats(), t)
+        if hasattr(replay_buffer, "stats"):
+            self._lap_replay(replay_buffer.stats(), t)
         print(
             "Total Time: %s, %ds"
             % (common_utils.sec2str(self.total_time), self.total_time)
@@ -274,6 +313,52 @@ class Tachometer:
             )
         )
 
+    def _lap_prefetch(self, stats, t):
+        last = self.prefetch_stats
+        self.prefetch_stats = stats
+        if last is not None:
+            keys = ["num_sample", "num_wait", "wait_time"]
+            stats = {k: stats[k] - last[k] for k in keys}
+        if stats["num_sample"] == 0:
+            return
+        print(
+            "Prefetch: waited for %d/%d batches, wait time: %.1fs (%.1f%%)"
+            % (
+                stats["num_wait"],
+                stats["num_sample"],
+                stats["wait_time"],
+                100 * stats["wait_time"] / t,
+            )
+        )
+
+    def _lap_replay(self, stats, t):
+        stats = {k: v.numpy() for k, v in stats.items()}
+        last = self.replay_stats
+        self.replay_stats = stats
+        # cumulative counters, report the difference since the last lap
+        lap = {}
+        for k in ["num_evict", "evict_sample_count", "sample_age_hist"]:
+            lap[k] = stats[k] - (0 if last is None else last[k])
+
+        num_evict = int(lap["num_evict"])
+        print(
+            "Replay: evict rate: %.1f/s, #sample per evicted: %.2f, tree drift: %.3g"
+            % (
+                num_evict / t,
+                lap["evict_sample_count"] / max(num_evict, 1),
+                stats["tree_drift"],
+            )
+        )
+        print(
+            "Replay: priority mean: %.4f, hist by half decade [<1e-4, >=1e2]: %s"
+            % (stats["priority_mean"], stats["priority_hist"])
+        )
+        print("Replay: #sample per slot [0, >=16]: %s" % stats["sample_count_hist"])
+        print(
+            "Replay: sample age in model versions [0, 1, 2-3, 4-7, ...]: %s"
+            % lap["sample_age_hist"]
+        )
+
 
 def load_weight(model, weight_file, device, *, state_dict=None):
     if state_dict is None:
@@ -320,6 +405,15 @@ def get_num_acts(actors):
     return total_acts
 
 
+# mean number of model updates between acting & training over the valid steps
+def get_policy_lag(batch, model_version):
+    version = batch.action["model_version"]
+    step = torch.arange(version.size(0), device=version.device)
+    mask = (step.unsqueeze(1) < batch.seq_len.unsqueeze(0)).float()
+    lag = (model_version - version).float() * mask
+    return (lag.sum() / mask.sum()).item()
+
+
 def generate_explore_eps(base_eps, alpha, num_env):
     if num_env == 1:
         if base_eps < 1e-6:
@@ -9,6 +9,15 @@
 namespace rela {
 
 FutureReply BatchRunner::call(const std::string& method, const TensorDict& t) const {
+  return getBatcher(method).send(t);
+}
+
+BatchSlot BatchRunner::reserve(
+    const std::string& method, const TensorDict& layout) const {
+  return getBatcher(method).reserve(layout);
+}
+
+Batcher& BatchRunner::getBatcher(const std::string& method) const {
   auto batcherIt = batchers_.find(method);
   if (batcherIt == batchers_.end()) {
     std::cerr << "Error: Cannot find method: " << method << std::endl;
@@ -18,16 +27,52 @@ FutureReply BatchRunner::call(const std::string& method, const TensorDict& t) co
     }
     assert(false);
   }
-  return batcherIt->second->send(t);
+  return *batcherIt->second;
+}
+
+void BatchRunner::setBatchPolicy(
+    const std::string& method, int targetBatchsize, int maxWaitUs, int latencyBudgetUs) {
+  BatchPolicy policy;
+  policy.targetBatchsize = targetBatchsize;
+  policy.maxWaitUs = maxWaitUs;
+  policy.latencyBudgetUs = latencyBudgetUs;
+  std::lock_guard<std::mutex> lk(mtxPolicy_);
+  policies_[method] = policy;
+  ++policyVersion_;
+  auto batcherIt = batchers_.find(method);
+  if (batcherIt != batchers_.end()) {
+    batcherIt->second->setPolicy(policy);
+  }
+}
+
+std::unordered_map<std::string, TensorDict> BatchRunner::stats() const {
+  std::unordered_map<std::string, TensorDict> stats;
+  for (auto& kv : batchers_) {
+    stats[kv.first] = kv.second->stats();
+  }
+  return stats;
 }
 
 void BatchRunner::start() {
   for (size_t i = 0; i < methods_.size(); ++i) {
     batchers_.emplace(methods_[i], std::make_unique<Batcher>(batchsizes_[i]));
   }
+  {
+    std::lock_guard<std::mutex> lk(mtxPolicy_);
+    for (auto& kv : policies_) {
+      auto batcherIt = batchers_.find(kv.first);
+      if (batcherIt != batchers_.end()) {
+        batcherIt->second->setPolicy(kv.second);
+      }
+    }
+  }
 
   for (auto& kv : batchers_) {
-    threads_.emplace_back(&BatchRunner::runnerLoop, this, kv.first);
+    auto workersIt = workers_.find(kv.first);
+    int numWorker = workersIt == workers_.end() ? 1 : workersIt->second.numWorker;
+    for (int i = 0; i < numWorker; ++i) {
+      threads_.emplace_back(&BatchRunner::runnerLoop, this, kv.first, i);
+    }
   }
 }
 
@@ -49,56 +94,165 @@ rela::TensorDict BatchRunner::blockCall(const std::string& method, const TensorD
   torch::NoGradGuard ng;
   std::vector<torch::jit::IValue> input;
   input.push_back(tensor_dict::toIValue(t, device_));
-  torch::jit::IValue output;
-  {
-    std::lock_guard<std::mutex> lk(mtxUpdate_);
-    output = jitModel_->get_method(method)(input);
-  }
+  int idx = acquireModel();
+  auto output = models_[idx].get_method(method)(input);
+  releaseModel(idx);
   return tensor_dict::fromIValue(output, torch::kCPU, true);
 }
 
-void BatchRunner::runnerLoop(const std::string& method) {
-  auto batcherIt = batchers_.find(method);
-  if (batcherIt == batchers_.end()) {
-    std::cerr << "Error: RunnerLoop, Cannot find method: " << method << std::endl;
-    assert(false);
+void BatchRunner::updateModel(py::object agent) {
+  auto src = agent.attr("_c").cast<torch::jit::script::Module*>();
+  py::gil_scoped_release release;
+  std::lock_guard<std::mutex> lk(mtxUpdate_);
+  int idle = 1 - currentModel_;
+  if (idle == 1 && versions_[1] == 0) {
+    // the second copy is made at the first update
+    models_[1] = models_[0].clone();
+  }
+  while (numUser_[idle] > 0) {
+    std::this_thread::yield();
+  }
+
+  torch::NoGradGuard ng;
+  auto copy = [](const auto& from, const auto& to) {
+    auto toIt = to.begin();
+    for (const auto& named : from) {
+      assert(toIt != to.end() && (*toIt).name == named.name);
+      (*toIt).value.copy_(named.value);
+      ++toIt;
+    }
+    assert(!(toIt != to.end()));
+  };
+  copy(src->named_parameters(), models_[idle].named_parameters());
+  copy(src->named_buffers(), models_[idle].named_buffers());
+
+  versions_[idle] = ++modelVersion_;
+  currentModel_ = idle;
+}
+
+int BatchRunner::acquireModel() {
+  while (true) {
+    int idx = currentModel_;
+    ++numUser_[idx];
+    // the update may have started to overwrite it before we registered
+    if (idx == currentModel_) {
+      return idx;
+    }
+    --numUser_[idx];
+  }
+}
+
+void BatchRunner::runnerLoop(const std::string& method, int workerIdx) {
+  auto& batcher = getBatcher(method);
+  MethodWorkers workers;
+  auto workersIt = workers_.find(method);
+  if (workersIt != workers_.end()) {
+    workers = workersIt->second;
+  }
+  if (workers.numThread > 0) {
+    at::set_num_threads(workers.numThread);
+  }
+  HidTable* hidTable = nullptr;
+  auto hidTableIt = hidTables_.find(method);
+  if (hidTableIt != hidTables_.end()) {
+    hidTable = hidTableIt->second.get();
+  }
+  std::string name = method;
+  if (workers.numWorker > 1) {
+    name += "[" + std::to_string(workerIdx) + "]";
   }
-  auto& batcher = *(batcherIt->second);
 
   int aggSize = 0;
   int aggCount = 0;
+  int64_t aggWaitUs = 0;
+
+  int maxBatchsize = 0;
+  for (size_t i = 0; i < methods_.size(); ++i) {
+    if (methods_[i] == method) {
+      maxBatchsize = batchsizes_[i];
+    }
+  }
+  // the batcher is shared by the workers, the first one tunes its policy
+  bool tunePolicy = workerIdx == 0;
+  BatchPolicy policy;
+  int policyVersion = -1;
+  BatchPolicyController controller(maxBatchsize);
 
   while (!batcher.terminated()) {
+    if (tunePolicy && policyVersion != policyVersion_) {
+      std::lock_guard<std::mutex> lk(mtxPolicy_);
+      policyVersion = policyVersion_;
+      auto policyIt = policies_.find(method);
+      if (policyIt != policies_.end()) {
+        policy = policyIt->second;
+      }
+    }
+
     auto batch = batcher.get();
     if (batch.empty()) {
       assert(batcher.terminated());
       break;
     }
+    int batchsize = batch.data.begin()->second.size(0);
 
     if (logFreq_ > 0) {
-      aggSize += (batch.begin()->second.size(0));
+      aggSize += batchsize;
+      aggWaitUs += batch.waitUs;
       aggCount += 1;
 
       if (aggCount % logFreq_ == 0) {
-        std::cout << method << ", average batchsize: " << aggSize / (float)aggCount
-                  << ", call count: " << aggCount << std::endl;
+        auto current = batcher.policy();
+        std::cout << name << ", average batchsize: " << aggSize / (float)aggCount
+                  << ", average wait: " << aggWaitUs / (float)aggCount << "us"
+                  << ", call count: " << aggCount
+                  << ", target batchsize: " << current.targetBatchsize
+                  << ", max wait: " << current.maxWaitUs << "us" << std::endl;
         aggSize = 0;
+        aggWaitUs = 0;
         aggCount = 0;
       }
     }
 
+    auto computeStart = std::chrono::steady_clock::now();
+    deviceGate_.acquire(workers.priority);
     {
-      std::lock_guard<std::mutex> lk(mtxDevice_);
-
       torch::NoGradGuard ng;
+      auto data = batch.data;
+      torch::Tensor hidSlot;
+      if (hidTable != nullptr && data.count("hid_slot")) {
+        hidSlot = hidTable->read(data, device_);
+      }
       std::vector<torch::jit::IValue> input;
-      input.push_back(tensor_dict::toIValue(batch, device_));
-      torch::jit::IValue output;
-      {
-        std::lock_guard<std::mutex> lk(mtxUpdate_);
-        output = jitModel_->get_method(method)(input);
+      input.push_back(tensor_dict::toIValue(data, device_));
+      int idx = acquireModel();
+      auto output = models_[idx].get_method(method)(input);
+      int64_t version = versions_[idx];
+      releaseModel(idx);
+      TensorDict reply;
+      if (hidSlot.defined()) {
+        // the state stays on the device, the rest goes to cpu as usual
+        for (auto& kv : output.toGenericDict()) {
+          reply[kv.key().toStringRef()] = kv.value().toTensor().detach();
+        }
+        hidTable->write(hidSlot, reply);
+        for (auto& kv : reply) {
+          kv.second = kv.second.to(torch::kCPU);
+        }
+      } else {
+        reply = tensor_dict::fromIValue(output, torch::kCPU, true);
+      }
+      reply["model_version"] = torch::full({batchsize}, version, torch::kInt64);
+      batcher.set(batch, std::move(reply));
+    }
+    deviceGate_.release();
+
+    if (tunePolicy && policy.latencyBudgetUs > 0) {
+      int64_t computeUs = std::chrono::duration_cast<std::chrono::microseconds>(
+                              std::chrono::steady_clock::now() - computeStart)
+                              .count();
+      if (controller.update(batchsize, batch.waitUs, computeUs, &policy)) {
+        batcher.setPolicy(policy);
       }
-      batcher.set(tensor_dict::fromIValue(output, torch::kCPU, true));
     }
   }
 }
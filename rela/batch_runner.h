@@ -6,7 +6,10 @@
 //
 #pragma once
 
+#include <array>
+#include <atomic>
 #include <cassert>
+#include <stdexcept>
 #include <thread>
 
 #include "rela/batcher.h"
@@ -14,6 +17,126 @@
 
 namespace rela {
 
+// admits up to <capacity> holders at a time, waiting holders of a higher
+// priority are admitted first
+class PriorityGate {
+ public:
+  void setCapacity(int capacity) {
+    assert(capacity > 0);
+    {
+      std::lock_guard<std::mutex> lk(m_);
+      capacity_ = capacity;
+    }
+    cv_.notify_all();
+  }
+
+  void acquire(int priority) {
+    std::unique_lock<std::mutex> lk(m_);
+    ++numWaiting_[priority];
+    cv_.wait(lk, [&] {
+      return numActive_ < capacity_ && numWaiting_.rbegin()->first == priority;
+    });
+    if (--numWaiting_[priority] == 0) {
+      numWaiting_.erase(priority);
+    }
+    ++numActive_;
+  }
+
+  void release() {
+    {
+      std::lock_guard<std::mutex> lk(m_);
+      --numActive_;
+    }
+    cv_.notify_all();
+  }
+
+ private:
+  std::mutex m_;
+  std::condition_variable cv_;
+  int capacity_ = 1;
+  int numActive_ = 0;
+  // priority -> number of waiting holders
+  std::map<int, int> numWaiting_;
+};
+
+// how a method is served: <numWorker> threads get & run its batches, the
+// calls of all methods share the device through a PriorityGate,
+// numThread > 0 sets the intra-op threads of each worker (per thread with
+// the OpenMP backend)
+class MethodWorkers {
+ public:
+  int numWorker = 1;
+  int priority = 0;
+  int numThread = 0;
+};
+
+// recurrent state of the callers of a method kept on the device, one row per
+// caller: a call sends its "hid_slot" & "hid_reset" (1 at the start of an
+// episode) instead of the state, the rows are gathered into the input before
+// the forward & the new state in the reply is written back, so the state
+// never goes through the host. Reset rows start from zeros, as get_h0.
+// A caller has at most one call in flight, thus concurrent batches touch
+// disjoint rows
+class HidTable {
+ public:
+  // <h0> is the state of one caller, without the batch dim; the table is
+  // sized at the first read, all the callers register before that
+  int addSlot(const TensorDict& h0) {
+    if (!table_.empty()) {
+      throw std::runtime_error(
+          "HidTable: cannot add a slot after the first call, register every "
+          "actor's hid slot before the runner starts");
+    }
+    if (rowLayout_.empty()) {
+      rowLayout_ = h0;
+    }
+    assert(h0.size() == rowLayout_.size());
+    for (auto& kv : h0) {
+      assert(kv.second.sizes() == rowLayout_.at(kv.first).sizes());
+    }
+    return numSlot_++;
+  }
+
+  // replaces "hid_slot" & "hid_reset" of <input> with the state of the rows,
+  // returns the rows to write back
+  torch::Tensor read(TensorDict& input, const torch::Device& device) {
+    std::call_once(allocated_, [&] {
+      for (auto& kv : rowLayout_) {
+        auto size = utils::pushLeft((int64_t)numSlot_, kv.second.sizes().vec());
+        table_[kv.first] = torch::zeros(size, kv.second.options().device(device));
+      }
+    });
+    auto slot = input.at("hid_slot").to(device);
+    auto reset = input.at("hid_reset").to(device).to(torch::kBool);
+    input.erase("hid_slot");
+    input.erase("hid_reset");
+    for (auto& kv : table_) {
+      auto hid = kv.second.index_select(0, slot);
+      std::vector<int64_t> size(hid.dim(), 1);
+      size[0] = -1;
+      hid.masked_fill_(reset.view(size), 0);
+      input[kv.first] = hid;
+    }
+    return slot;
+  }
+
+  // moves the new state out of <reply> into the rows
+  void write(const torch::Tensor& slot, TensorDict& reply) {
+    for (auto& kv : table_) {
+      auto it = reply.find(kv.first);
+      assert(it != reply.end());
+      kv.second.index_copy_(0, slot, it->second.to(kv.second.device()));
+      reply.erase(it);
+    }
+  }
+
+ private:
+  TensorDict rowLayout_;
+  int numSlot_ = 0;
+  std::once_flag allocated_;
+  TensorDict table_;
+};
+
 class BatchRunner {
  public:
   BatchRunner(
@@ -26,12 +149,14 @@ class BatchRunner {
       , device_(torch::Device(device))
       , batchsizes_(methods.size(), maxBatchsize)
       , methods_(methods) {
+    models_[0] = *jitModel_;
   }
 
   BatchRunner(py::object pyModel, const std::string& device)
       : pyModel_(pyModel)
       , jitModel_(pyModel_.attr("_c").cast<torch::jit::script::Module*>())
       , device_(torch::Device(device)) {
+    models_[0] = *jitModel_;
   }
 
   BatchRunner(const BatchRunner&) = delete;
@@ -50,15 +175,66 @@ class BatchRunner {
     methods_.push_back(method);
   }
 
+  // see BatchPolicy, can be called before or after start
+  void setBatchPolicy(
+      const std::string& method,
+      int targetBatchsize,
+      int maxWaitUs,
+      int latencyBudgetUs = 0);
+
+  // see MethodWorkers, must be called before start
+  void setWorkers(
+      const std::string& method, int numWorker, int priority = 0, int numThread = 0) {
+    assert(threads_.empty());
+    assert(numWorker > 0);
+    auto& workers = workers_[method];
+    workers.numWorker = numWorker;
+    workers.priority = priority;
+    workers.numThread = numThread;
+  }
+
+  // number of calls of any method that may run on the device at once
+  void setMaxConcurrentCall(int maxConcurrentCall) {
+    deviceGate_.setCapacity(maxConcurrentCall);
+  }
+
+  // a row of the HidTable of <method> for a caller whose state is <h0>, must
+  // be called before start
+  int addHidSlot(const std::string& method, const TensorDict& h0) {
+    if (!threads_.empty()) {
+      throw std::runtime_error(
+          "BatchRunner: addHidSlot(" + method + ") after start(), register "
+          "every actor's hid slot before starting the runner");
+    }
+    auto& table = hidTables_[method];
+    if (table == nullptr) {
+      table = std::make_unique<HidTable>();
+    }
+    return table->addSlot(h0);
+  }
+
+  // per method, see Batcher::stats
+  std::unordered_map<std::string, TensorDict> stats() const;
+
   FutureReply call(const std::string& method, const TensorDict& t) const;
 
+  // call() with the input written in place, see Batcher::reserve
+  BatchSlot reserve(const std::string& method, const TensorDict& layout) const;
+
   void start();
 
   void stop();
 
-  void updateModel(py::object agent) {
-    std::lock_guard<std::mutex> lk(mtxUpdate_);
-    pyModel_.attr("load_state_dict")(agent.attr("state_dict")());
+  // copies the parameters of <agent> into the idle copy of the model & makes
+  // it current, the calls keep running on the other copy meanwhile; copy 0
+  // aliases the python model given to the constructor, so every other update
+  // writes into that model's own parameters
+  void updateModel(py::object agent);
+
+  // number of updates so far, replies carry the version of the model that
+  // computed them in "model_version"
+  int64_t modelVersion() const {
+    return modelVersion_;
   }
 
   const torch::jit::script::Module& jitModel() {
@@ -69,7 +245,16 @@ class BatchRunner {
   rela::TensorDict blockCall(const std::string& method, const TensorDict& t);
 
  private:
-  void runnerLoop(const std::string& method);
+  Batcher& getBatcher(const std::string& method) const;
+
+  void runnerLoop(const std::string& method, int workerIdx);
+
+  // index of the current model, held until releaseModel
+  int acquireModel();
+
+  void releaseModel(int idx) {
+    --numUser_[idx];
+  }
 
   py::object pyModel_;
   torch::jit::script::Module* const jitModel_;
@@ -77,8 +262,27 @@ class BatchRunner {
   std::vector<int> batchsizes_;
   std::vector<std::string> methods_;
 
-  // ideally this mutex should be 1 per device, thus global
-  std::mutex mtxDevice_;
+  // guards policies_, the runner loops own a copy of their policy & reload it
+  // when policyVersion_ changes
+  mutable std::mutex mtxPolicy_;
+  std::map<std::string, BatchPolicy> policies_;
+  std::atomic<int> policyVersion_ = 0;
+
+  std::map<std::string, MethodWorkers> workers_;
+  std::map<std::string, std::unique_ptr<HidTable>> hidTables_;
+
+  // ideally this gate should be 1 per device, thus global
+  PriorityGate deviceGate_;
+  // double buffered model, the calls run on models_[currentModel_] without
+  // locking; an update waits for the calls still running on the idle copy,
+  // i.e. started before the previous update, overwrites it & swaps.
+  // models_[0] shares its parameters with *jitModel_, models_[1] is a clone
+  std::array<torch::jit::script::Module, 2> models_;
+  std::array<int64_t, 2> versions_ = {0, 0};
+  std::array<std::atomic<int>, 2> numUser_ = {0, 0};
+  std::atomic<int> currentModel_ = 0;
+  std::atomic<int64_t> modelVersion_ = 0;
+  // serializes the updates
   std::mutex mtxUpdate_;
 
   mutable std::map<std::string, std::unique_ptr<Batcher>> batchers_;
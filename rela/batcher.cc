@@ -4,6 +4,9 @@
 // This source code is licensed under the license found in the
 // LICENSE file in the root directory of this source tree.
 //
+#include <algorithm>
+#include <cmath>
+
 #include "rela/batcher.h"
 #include "rela/utils.h"
 
@@ -53,30 +56,97 @@ TensorDict FutureReply::get() {
   return ret;
 }
 
+namespace {
+
+// floor(log2(v)) + 1 for v > 0, 0 otherwise, capped at numBin - 1
+int log2Bin(int64_t v, int numBin) {
+  int bin = 0;
+  while (v > 0 && bin < numBin - 1) {
+    v >>= 1;
+    ++bin;
+  }
+  return bin;
+}
+}  // namespace
+
+bool BatchPolicyController::update(
+    int batchsize, int64_t waitUs, int64_t computeUs, BatchPolicy* policy) {
+  int target = policy->targetBatchsize > 0 ? policy->targetBatchsize : maxBatchsize_;
+  ++count_;
+  numFull_ += batchsize >= target;
+  maxBatchsizeSeen_ = std::max(maxBatchsizeSeen_, batchsize);
+  maxLatencyUs_ = std::max(maxLatencyUs_, waitUs + computeUs);
+  if (count_ < window_) {
+    return false;
+  }
+
+  int budget = policy->latencyBudgetUs;
+  bool overBudget = maxLatencyUs_ > budget;
+  if (overBudget) {
+    policy->maxWaitUs /= 2;
+  } else {
+    policy->maxWaitUs = std::min(budget, policy->maxWaitUs + std::max(1, budget / 16));
+  }
+
+  if (numFull_ * 2 >= count_ && !overBudget) {
+    target = std::min(maxBatchsize_, target + std::max(1, target / 4));
+  } else if (numFull_ * 2 < count_) {
+    target = std::max(1, maxBatchsizeSeen_);
+  }
+  policy->targetBatchsize = target;
+
+  count_ = 0;
+  numFull_ = 0;
+  maxBatchsizeSeen_ = 0;
+  maxLatencyUs_ = 0;
+  return true;
+}
+
 Batcher::Batcher(int batchsize)
     : batchsize_(batchsize)
+    , targetBatchsize_(batchsize)
+    , batchsizeHist_(kNumSizeBin, 0)
+    , waitHist_(kNumWaitBin, 0)
     , nextSlot_(0)
     , numActiveWrite_(0)
-    , fillingReply_(std::make_shared<FutureReply_>())
-    , filledReply_(nullptr) {
+    , fillingReply_(std::make_shared<FutureReply_>()) {
   assert(batchsize_ > 0);
 }
 
+FutureReply BatchSlot::commit() {
+  assert(batcher_ != nullptr);
+  auto batcher = batcher_;
+  batcher_ = nullptr;
+  return batcher->commit(*this);
+}
+
 // send data into batcher
 FutureReply Batcher::send(const TensorDict& t) {
+  auto slot = reserve(t);
+  // this will copy
+  for (const auto& kv : t) {
+    auto& dest = slot.data.at(kv.first);
+    if (dest.sizes() != kv.second.sizes()) {
+      std::cout << "cannot batch data, batcher need size: " << dest.sizes()
+                << ", get: " << kv.second.sizes() << std::endl;
+    }
+    dest.copy_(kv.second);
+  }
+  return slot.commit();
+}
+
+BatchSlot Batcher::reserve(const TensorDict& layout) {
   std::unique_lock<std::mutex> lk(mNextSlot_);
 
   // init buffer
   if (fillingBuffer_.empty()) {
-    assert(filledBuffer_.empty());
-    fillingBuffer_ = allocateBatchStorage(t, batchsize_);
-    filledBuffer_ = allocateBatchStorage(t, batchsize_);
+    fillingBuffer_ = allocateBatchStorage(layout, batchsize_);
   } else {
-    if (t.size() != fillingBuffer_.size()) {
+    if (layout.size() != fillingBuffer_.size()) {
       std::cout << "key in buffer: " << std::endl;
       utils::printMapKey(fillingBuffer_);
       std::cout << "key in data: " << std::endl;
-      utils::printMapKey(t);
+      utils::printMapKey(layout);
       assert(false);
     }
   }
@@ -85,69 +155,138 @@ FutureReply Batcher::send(const TensorDict& t) {
   // wait if current batch is full and not extracted
   cvNextSlot_.wait(lk, [this] { return nextSlot_ < batchsize_; });
 
-  int slot = nextSlot_;
+  BatchSlot slot;
+  slot.batcher_ = this;
+  slot.slot_ = nextSlot_;
+  if (slot.slot_ == 0) {
+    firstArrival_ = Clock::now();
+  }
   ++nextSlot_;
   ++numActiveWrite_;
   lk.unlock();
 
-  // this will copy
-  for (const auto& kv : t) {
-    if (fillingBuffer_[kv.first][slot].sizes() != kv.second.sizes()) {
-      std::cout << "cannot batch data, batcher need size: "
-                << fillingBuffer_[kv.first][slot].sizes()
-                << ", get: " << kv.second.sizes() << std::endl;
-    }
-    fillingBuffer_[kv.first][slot] = kv.second;
+  // the buffers are not swapped until this write is committed
+  assert(fillingReply_ != nullptr);
+  slot.reply_ = fillingReply_;
+  for (auto& kv : fillingBuffer_) {
+    slot.data[kv.first] = kv.second[slot.slot_];
   }
+  return slot;
+}
 
+FutureReply Batcher::commit(BatchSlot& slot) {
+  slot.data.clear();
+  std::unique_lock<std::mutex> lk(mNextSlot_);
   // batch has not been extracted yet
   assert(numActiveWrite_ > 0);
-  assert(fillingReply_ != nullptr);
-  auto reply = fillingReply_;
-  lk.lock();
   --numActiveWrite_;
+  bool allWritten = numActiveWrite_ == 0;
   lk.unlock();
-  if (numActiveWrite_ == 0) {
+  if (allWritten) {
     cvGetBatch_.notify_one();
   }
-  return FutureReply(reply, slot);
+  return FutureReply(std::move(slot.reply_), slot.slot_);
 }
 
 // get batch input from batcher
-TensorDict Batcher::get() {
+FilledBatch Batcher::get() {
   std::unique_lock<std::mutex> lk(mNextSlot_);
-  cvGetBatch_.wait(
-      lk, [this] { return (nextSlot_ > 0 && numActiveWrite_ == 0) || exit_; });
+  while (!exit_) {
+    auto deadline = firstArrival_ + std::chrono::microseconds(maxWaitUs_);
+    bool expired = Clock::now() >= deadline;
+    if (nextSlot_ > 0 && numActiveWrite_ == 0) {
+      if (maxWaitUs_ <= 0 || nextSlot_ >= targetBatchsize_ || expired) {
+        break;
+      }
+    }
+    if (nextSlot_ > 0 && maxWaitUs_ > 0 && !expired) {
+      cvGetBatch_.wait_until(lk, deadline);
+    } else {
+      // empty batch, or past the deadline with writes still active: do not
+      // spin, commit notifies when the last active write is done
+      cvGetBatch_.wait(lk);
+    }
+  }
 
+  FilledBatch batch;
   if (exit_) {
-    return TensorDict();
+    return batch;
   }
 
   int bsize = nextSlot_;
+  batch.waitUs = std::chrono::duration_cast<std::chrono::microseconds>(
+                     Clock::now() - firstArrival_)
+                     .count();
+  ++numBatch_;
+  sumBatchsize_ += bsize;
+  sumWaitUs_ += batch.waitUs;
+  ++batchsizeHist_[log2Bin(bsize, kNumSizeBin + 1) - 1];
+  ++waitHist_[log2Bin(batch.waitUs, kNumWaitBin)];
+
   nextSlot_ = 0;
-  // assert previous reply has been handled
-  assert(filledReply_ == nullptr);
-  std::swap(fillingBuffer_, filledBuffer_);
-  std::swap(fillingReply_, filledReply_);
+  batch.buffer_ = std::move(fillingBuffer_);
+  batch.reply_ = std::move(fillingReply_);
   fillingReply_ = std::make_shared<FutureReply_>();
-
+  if (!freeBuffers_.empty()) {
+    fillingBuffer_ = std::move(freeBuffers_.back());
+    freeBuffers_.pop_back();
+  } else {
+    // all other buffers are being answered, at most one per consumer
+    fillingBuffer_ =
+        allocateBatchStorage(tensor_dict::index(batch.buffer_, 0), batchsize_);
+  }
   lk.unlock();
   cvNextSlot_.notify_all();
 
-  TensorDict batch;
-  for (const auto& kv : filledBuffer_) {
-    batch[kv.first] = kv.second.narrow(0, 0, bsize).contiguous();
+  for (const auto& kv : batch.buffer_) {
+    batch.data[kv.first] = kv.second.narrow(0, 0, bsize);
   }
-
   return batch;
 }
 
 // set batch reply for batcher
-void Batcher::set(TensorDict&& t) {
+void Batcher::set(FilledBatch& batch, TensorDict&& t) {
   for (const auto& kv : t) {
     assert(kv.second.device().is_cpu());
   }
-  filledReply_->set(std::move(t));
-  filledReply_ = nullptr;
+  assert(batch.reply_ != nullptr);
+  batch.reply_->set(std::move(t));
+  batch.reply_ = nullptr;
+  batch.data.clear();
+
+  std::lock_guard<std::mutex> lk(mNextSlot_);
+  freeBuffers_.push_back(std::move(batch.buffer_));
+}
+
+void Batcher::setPolicy(const BatchPolicy& policy) {
+  {
+    std::lock_guard<std::mutex> lk(mNextSlot_);
+    targetBatchsize_ = policy.targetBatchsize > 0
+        ? std::min(policy.targetBatchsize, batchsize_)
+        : batchsize_;
+    maxWaitUs_ = policy.maxWaitUs;
+  }
+  cvGetBatch_.notify_all();
+}
+
+BatchPolicy Batcher::policy() {
+  std::lock_guard<std::mutex> lk(mNextSlot_);
+  BatchPolicy policy;
+  policy.targetBatchsize = targetBatchsize_;
+  policy.maxWaitUs = maxWaitUs_;
+  return policy;
+}
+
+TensorDict Batcher::stats() {
+  std::lock_guard<std::mutex> lk(mNextSlot_);
+  return {
+      {"num_batch", torch::tensor(numBatch_, torch::kInt64)},
+      {"sum_batchsize", torch::tensor(sumBatchsize_, torch::kInt64)},
+      {"sum_wait_us", torch::tensor(sumWaitUs_, torch::kInt64)},
+      {"batchsize_hist", torch::tensor(batchsizeHist_, torch::kInt64)},
+      {"wait_us_hist", torch::tensor(waitHist_, torch::kInt64)},
+      {"target_batchsize", torch::tensor(targetBatchsize_, torch::kInt64)},
+      {"max_wait_us", torch::tensor(maxWaitUs_, torch::kInt64)},
+  };
 }
 }  // namespace rela
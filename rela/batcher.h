@@ -6,6 +6,8 @@
 //
 #pragma once
 
+#include <chrono>
+
 #include "rela/tensor_dict.h"
 #include "rela/utils.h"
 
@@ -53,6 +55,92 @@ class FutureReply {
 
 using Future = FutureReply;
 
+class Batcher;
+
+// a slot of the filling batch reserved for one entry, <data> are views of the
+// entry in the batch buffers that are written in place instead of being
+// copied by send(); commit() hands the entry to the batch. The batch is not
+// handed out before all of its reserved slots are committed
+class BatchSlot {
+ public:
+  BatchSlot() = default;
+
+  bool isNull() const {
+    return batcher_ == nullptr;
+  }
+
+  // <data> must not be used afterwards
+  FutureReply commit();
+
+  TensorDict data;
+
+ private:
+  friend class Batcher;
+
+  Batcher* batcher_ = nullptr;
+  int slot_ = -1;
+  std::shared_ptr<FutureReply_> reply_;
+};
+
+// when the batcher hands out a batch: once it holds <targetBatchsize> entries
+// or its oldest entry has waited <maxWaitUs>, whichever comes first. With
+// maxWaitUs <= 0 it is handed out as soon as no write is in progress, i.e.
+// the size depends on the timing of the threads. With latencyBudgetUs > 0,
+// BatchRunner tunes target & wait online, see BatchPolicyController
+class BatchPolicy {
+ public:
+  int targetBatchsize = 0;  // <= 0 for the max batchsize
+  int maxWaitUs = 0;
+  int latencyBudgetUs = 0;
+};
+
+// throughput under a latency budget, the latency of a batch being the wait of
+// its oldest entry + the forward time. Every <window> batches:
+//   the wait is halved if the worst latency is over budget, otherwise grows
+//   by 1/16 of the budget (AIMD);
+//   the target grows by 1/4 if most batches fill up within the budget,
+//   otherwise it is set to the largest size reached, so that batches are not
+//   held back for entries that do not arrive in time
+class BatchPolicyController {
+ public:
+  BatchPolicyController(int maxBatchsize, int window = 32)
+      : maxBatchsize_(maxBatchsize)
+      , window_(window) {
+  }
+
+  // returns whether <policy> has been changed
+  bool update(int batchsize, int64_t waitUs, int64_t computeUs, BatchPolicy* policy);
+
+ private:
+  const int maxBatchsize_;
+  const int window_;
+
+  int count_ = 0;
+  int numFull_ = 0;
+  int maxBatchsizeSeen_ = 0;
+  int64_t maxLatencyUs_ = 0;
+};
+
+// a batch handed out by Batcher::get & answered with Batcher::set, <data>
+// are views of a batch buffer that is reused once the batch is answered
+class FilledBatch {
+ public:
+  bool empty() const {
+    return data.empty();
+  }
+
+  TensorDict data;
+  // wait of the oldest entry
+  int64_t waitUs = 0;
+
+ private:
+  friend class Batcher;
+
+  TensorDict buffer_;
+  std::shared_ptr<FutureReply_> reply_;
+};
+
+// several threads may get & answer batches concurrently
 class Batcher {
  public:
   Batcher(int batchsize);
@@ -79,14 +167,44 @@ class Batcher {
   // send data into batcher
   FutureReply send(const TensorDict& t);
 
-  // get batch input from batcher
-  TensorDict get();
+  // reserve a slot to write an entry in place, <layout>: an entry with the
+  // keys & shapes of the batch, only read to allocate the buffers
+  BatchSlot reserve(const TensorDict& layout);
+
+  // get batch input from batcher, empty once terminated
+  FilledBatch get();
 
   // set batch reply for batcher
-  void set(TensorDict&& t);
+  void set(FilledBatch& batch, TensorDict&& t);
+
+  void setPolicy(const BatchPolicy& policy);
+
+  BatchPolicy policy();
+
+  // cumulative, batchsize_hist: bin k for [2^k, 2^(k+1)),
+  // wait_us_hist: bin 0 for < 1us, bin k for [2^(k-1), 2^k) us
+  TensorDict stats();
+
+  static constexpr int kNumSizeBin = 16;
+  static constexpr int kNumWaitBin = 24;
 
  private:
+  friend class BatchSlot;
+
+  using Clock = std::chrono::steady_clock;
+
+  FutureReply commit(BatchSlot& slot);
+
   const int batchsize_;
+  int targetBatchsize_;
+  int maxWaitUs_ = 0;
+  Clock::time_point firstArrival_;
+
+  int64_t numBatch_ = 0;
+  int64_t sumBatchsize_ = 0;
+  int64_t sumWaitUs_ = 0;
+  std::vector<int64_t> batchsizeHist_;
+  std::vector<int64_t> waitHist_;
 
   int nextSlot_;
   int numActiveWrite_;
@@ -95,8 +213,8 @@ class Batcher {
   TensorDict fillingBuffer_;
   std::shared_ptr<FutureReply_> fillingReply_;
 
-  TensorDict filledBuffer_;
-  std::shared_ptr<FutureReply_> filledReply_;
+  // buffers of the answered batches
+  std::vector<TensorDict> freeBuffers_;
 
   bool exit_ = false;
   std::condition_variable cvGetBatch_;
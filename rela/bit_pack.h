@@ -0,0 +1,136 @@
+// Copyright (c) Facebook, Inc. and its affiliates.
+// All rights reserved.
+//
+// This source code is licensed under the license found in the
+// LICENSE file in the root directory of this source tree.
+//
+#pragma once
+
+#include <torch/extension.h>
+#include <vector>
+
+namespace rela {
+
+namespace bit_pack {
+
+inline torch::Tensor bitWeights(const torch::Device& device) {
+  return torch::tensor({1, 2, 4, 8, 16, 32, 64, 128}, torch::kUInt8).to(device);
+}
+
+// bool [..., dim] -> uint8 [..., ceil(dim / 8)]
+inline torch::Tensor packBits(const torch::Tensor& mask) {
+  auto dim = mask.size(-1);
+  auto numByte = (dim + 7) / 8;
+  auto bits = mask.to(torch::kUInt8);
+  if (numByte * 8 != dim) {
+    auto padSize = bits.sizes().vec();
+    padSize.back() = numByte * 8 - dim;
+    bits = torch::cat({bits, torch::zeros(padSize, bits.options())}, -1);
+  }
+  auto size = bits.sizes().vec();
+  size.back() = numByte;
+  size.push_back(8);
+  bits = bits.view(size) * bitWeights(bits.device());
+  return bits.sum(-1, false, torch::kUInt8);
+}
+
+// uint8 [..., ceil(dim / 8)] -> bool [..., dim]
+inline torch::Tensor unpackBits(const torch::Tensor& bits, int64_t dim) {
+  auto mask = bits.unsqueeze(-1).bitwise_and(bitWeights(bits.device())).ne(0);
+  return mask.flatten(-2, -1).narrow(-1, 0, dim);
+}
+}  // namespace bit_pack
+
+// lossless compact storage of mostly binary features, e.g. priv_s
+// the non-zero mask is packed 8 per byte, the few entries that are not 0/1
+// (the v0 belief part of the canonical encoding) are flagged in a second bit
+// mask and kept as float in <values>, in row-major order
+class PackedTensor {
+ public:
+  PackedTensor() = default;
+
+  PackedTensor(const torch::Tensor& t)
+      : dtype(t.scalar_type())
+      , dim(t.size(-1)) {
+    auto nonZero = t.ne(0);
+    bits = bit_pack::packBits(nonZero);
+    auto nonBinaryMask = nonZero.logical_and(t.ne(1));
+    if (nonBinaryMask.any().item<bool>()) {
+      nonBinary = bit_pack::packBits(nonBinaryMask);
+      values = t.masked_select(nonBinaryMask).to(torch::kFloat32);
+    }
+  }
+
+  torch::Tensor unpack() const {
+    auto t = bit_pack::unpackBits(bits, dim).to(dtype);
+    if (nonBinary.defined()) {
+      auto mask = bit_pack::unpackBits(nonBinary, dim);
+      t.masked_scatter_(mask, values.to(dtype));
+    }
+    return t;
+  }
+
+  torch::ScalarType dtype;
+  int64_t dim;
+  torch::Tensor bits;
+  // undefined if all entries are 0/1
+  torch::Tensor nonBinary;
+  torch::Tensor values;
+};
+
+namespace bit_pack {
+
+// unpack a batch packed along dim 0, bits/nonBinary: [batch, ..., numByte]
+// <values> of each element in batch order, nonBinary may be undefined
+inline torch::Tensor unpackBatch(
+    const torch::Tensor& bits,
+    const torch::Tensor& nonBinary,
+    const std::vector<torch::Tensor>& values,
+    int64_t dim,
+    torch::ScalarType dtype,
+    const torch::Device& device) {
+  auto t = unpackBits(bits.to(device), dim).to(dtype);
+  if (nonBinary.defined() && !values.empty()) {
+    auto mask = unpackBits(nonBinary.to(device), dim);
+    t.masked_scatter_(mask, torch::cat(values, 0).to(device).to(dtype));
+  }
+  return t;
+}
+
+// unpack a batch at once on <device>, only the packed bytes are transferred
+inline torch::Tensor stackUnpack(
+    const std::vector<PackedTensor>& vec, int stackdim, const torch::Device& device) {
+  assert(vec.size() >= 1);
+  std::vector<torch::Tensor> bits;
+  std::vector<torch::Tensor> nonBinary;
+  std::vector<torch::Tensor> values;
+  bool hasNonBinary = false;
+  for (const auto& p : vec) {
+    bits.push_back(p.bits);
+    if (p.nonBinary.defined()) {
+      hasNonBinary = true;
+      values.push_back(p.values);
+    }
+  }
+  if (hasNonBinary) {
+    for (const auto& p : vec) {
+      nonBinary.push_back(
+          p.nonBinary.defined() ? p.nonBinary : torch::zeros_like(p.bits));
+    }
+  }
+
+  // stack on 0 so that <values> follow the row-major order of the batch
+  auto t = unpackBatch(
+      torch::stack(bits, 0),
+      hasNonBinary ? torch::stack(nonBinary, 0) : torch::Tensor(),
+      values,
+      vec[0].dim,
+      vec[0].dtype,
+      device);
+  if (stackdim != 0) {
+    t = t.movedim(0, stackdim).contiguous();
+  }
+  return t;
+}
+}  // namespace bit_pack
+}  // namespace rela
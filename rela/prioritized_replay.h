@@ -6,22 +6,45 @@
 //
 #pragma once
 
+#include <algorithm>
+#include <chrono>
+#include <array>
+#include <atomic>
 #include <cmath>
-#include <future>
+#include <condition_variable>
+#include <deque>
+#include <functional>
+#include <memory>
+#include <mutex>
 #include <random>
+#include <stdexcept>
 #include <thread>
+#include <type_traits>
+#include <unordered_map>
 #include <vector>
 
+#include "rela/replay_snapshot.h"
+#include "rela/slab.h"
+#include "rela/sum_tree.h"
 #include "rela/tensor_dict.h"
 #include "rela/transition.h"
 
 namespace rela {
 
+// storage of the replay buffer, the weights are either scanned linearly for
+// sampling or, with useSumTree, mirrored in a sum tree where the slots
+// outside of [head_, safeTail_) always have zero weight
+// with useSlab (RNNTransition only), the elements live in a TransitionSlab
+// instead of a vector of individually allocated tensors
+// alpha is the priority exponent, only used to report the priorities in stats
 template <class DataType>
 class ConcurrentQueue {
  public:
-  ConcurrentQueue(int capacity)
+  ConcurrentQueue(int capacity, bool useSumTree, bool useSlab, float alpha = 1)
       : capacity(capacity)
+      , useSumTree(useSumTree)
+      , useSlab(useSlab)
+      , alpha(alpha)
       , head_(0)
       , tail_(0)
       , size_(0)
@@ -29,14 +52,33 @@ class ConcurrentQueue {
       , safeSize_(0)
       , sum_(0)
       , evicted_(capacity, false)
+      , written_(capacity, false)
       , elements_(capacity)
-      , weights_(capacity, 0) {
+      , weights_(capacity, 0)
+      , tree_(useSumTree ? capacity : 1)
+      , slab_(useSlab ? std::make_unique<TransitionSlab>(capacity) : nullptr)
+      , version_(capacity, 0)
+      , sampleCount_(capacity, 0)
+      , sampleAgeHist_(kNumAgeBin, 0)
+      , priorityHist_(kNumPriorityBin, 0)
+      , sampleCountHist_(kMaxSampleCount + 1, 0)
+      , pinCount_(capacity, 0) {
+    assert(!useSlab || (std::is_same_v<DataType, RNNTransition>));
+  }
+
+  // upper edges of the priority bins in stats, half decades in [1e-4, 1e2]
+  static std::vector<double> priorityBins() {
+    std::vector<double> bins;
+    for (int i = -8; i <= 4; ++i) {
+      bins.push_back(std::pow(10.0, 0.5 * i));
+    }
+    return bins;
   }
 
   int safeSize(float* sum) const {
     std::unique_lock<std::mutex> lk(m_);
     if (sum != nullptr) {
-      *sum = sum_;
+      *sum = useSumTree ? tree_.total() : sum_;
     }
     return safeSize_;
   }
@@ -55,7 +97,17 @@ class ConcurrentQueue {
     safeSize_ = 0;
     sum_ = 0;
     std::fill(evicted_.begin(), evicted_.end(), false);
+    std::fill(written_.begin(), written_.end(), false);
     std::fill(weights_.begin(), weights_.end(), 0.0);
+    tree_.clear();
+    std::fill(sampleCount_.begin(), sampleCount_.end(), 0);
+    std::fill(sampleAgeHist_.begin(), sampleAgeHist_.end(), 0);
+    std::fill(priorityHist_.begin(), priorityHist_.end(), 0);
+    std::fill(sampleCountHist_.begin(), sampleCountHist_.end(), 0);
+    prioritySum_ = 0;
+    std::fill(pinCount_.begin(), pinCount_.end(), 0);
+    numEvict_ = 0;
+    evictSampleCount_ = 0;
   }
 
   void terminate() {
@@ -64,53 +116,103 @@ class ConcurrentQueue {
   }
 
   void append(const DataType& data, float weight) {
-    int blockSize = 1;
+    blockAppend({data}, {weight});
+  }
+
+  // reserve the slots of the whole block with one lock, copy outside of the
+  // lock, then publish. A writer never waits for the slower writers ahead of
+  // it: it marks its slots as written and whoever completes the contiguous
+  // run after safeTail_ moves safeTail_ over it. Without <wait>, a block that
+  // does not fit is dropped instead of waiting for space; returns if appended
+  bool blockAppend(
+      const std::vector<DataType>& block,
+      const std::vector<float>& weights,
+      bool wait = true) {
+    int blockSize = block.size();
+    assert(blockSize <= capacity && (int)weights.size() == blockSize);
     std::unique_lock<std::mutex> lk(m_);
-    cvSize_.wait(lk, [=] { return terminated_ || (size_ + blockSize <= capacity); });
-    if (terminated_) {
-      return;
+    if (wait) {
+      cvSize_.wait(lk, [=] { return terminated_ || (size_ + blockSize <= capacity); });
+    }
+    if (terminated_ || size_ + blockSize > capacity) {
+      return false;
     }
 
     int start = tail_;
-    int end = (tail_ + blockSize) % capacity;
-
-    tail_ = end;
+    tail_ = (tail_ + blockSize) % capacity;
     size_ += blockSize;
     checkSize(head_, tail_, size_);
 
     lk.unlock();
 
-    float sum = 0;
-    elements_[start] = data;
-    weights_[start] = weight;
-    sum += weight;
+    for (int i = 0; i < blockSize; ++i) {
+      int id = (start + i) % capacity;
+      store(id, block[i]);
+      weights_[id] = weights[i];
+      version_[id] = modelVersion_;
+      sampleCount_[id] = 0;
+    }
 
     lk.lock();
 
-    cvTail_.wait(lk, [=] { return safeTail_ == start; });
-    safeTail_ = end;
-    safeSize_ += blockSize;
-    sum_ += sum;
+    for (int i = 0; i < blockSize; ++i) {
+      written_[(start + i) % capacity] = true;
+    }
+    std::vector<int> ids;
+    std::vector<double> newWeights;
+    while (safeSize_ < size_ && written_[safeTail_]) {
+      written_[safeTail_] = false;
+      sum_ += weights_[safeTail_];
+      addStats(weights_[safeTail_], 0, 1);
+      ids.push_back(safeTail_);
+      newWeights.push_back(weights_[safeTail_]);
+      safeTail_ = (safeTail_ + 1) % capacity;
+      ++safeSize_;
+    }
+    if (useSumTree && !ids.empty()) {
+      // the slots only become visible to the sampler once they are safe
+      tree_.set(ids, newWeights);
+    }
     checkSize(head_, safeTail_, safeSize_);
-
-    lk.unlock();
-    cvTail_.notify_all();
+    return true;
   }
 
   // ------------------------------------------------------------- //
-  // blockPop, update are thread-safe against blockAppend
+  // blockPop, update, pin & unpin are thread-safe against blockAppend
   // but they are NOT thread-safe against each other
-  void blockPop(int blockSize) {
+
+  // pops at most <blockSize> elements, stops at the first pinned slot so that
+  // a slot being gathered is never handed to the writers; returns #popped
+  int blockPop(int blockSize) {
+    int numPop = 0;
+    while (numPop < blockSize && pinCount_[(head_ + numPop) % capacity] == 0) {
+      ++numPop;
+    }
+    if (numPop == 0) {
+      return 0;
+    }
+    blockSize = numPop;
+
     double diff = 0;
     int head = head_;
+    std::vector<int> ids(blockSize);
     for (int i = 0; i < blockSize; ++i) {
       diff -= weights_[head];
       evicted_[head] = true;
+      ids[i] = head;
       head = (head + 1) % capacity;
     }
 
     {
       std::lock_guard<std::mutex> lk(m_);
+      for (auto id : ids) {
+        evictSampleCount_ += sampleCount_[id];
+        addStats(weights_[id], sampleCount_[id], -1);
+      }
+      numEvict_ += blockSize;
+      if (useSumTree) {
+        tree_.set(ids, std::vector<double>(blockSize, 0.0));
+      }
       sum_ += diff;
       head_ = head;
       safeSize_ -= blockSize;
@@ -119,35 +221,180 @@ class ConcurrentQueue {
       checkSize(head_, safeTail_, safeSize_);
     }
     cvSize_.notify_all();
+    return blockSize;
+  }
+
+  // a pinned slot stays static, i.e. is not popped, until unpinned
+  void pin(const std::vector<int>& ids) {
+    for (auto id : ids) {
+      ++pinCount_[id];
+    }
+  }
+
+  void unpin(const std::vector<int>& ids) {
+    for (auto id : ids) {
+      --pinCount_[id];
+      assert(pinCount_[id] >= 0);
+    }
   }
 
   void update(const std::vector<int>& ids, const torch::Tensor& weights) {
     double diff = 0;
     auto weightAcc = weights.accessor<float, 1>();
+    // the same slot can be sampled more than once in a batch, keep the last
+    std::unordered_map<int, double> updates;
+    std::unordered_map<int, float> oldWeights;
     for (int i = 0; i < (int)ids.size(); ++i) {
       auto id = ids[i];
       if (evicted_[id]) {
         continue;
       }
+      oldWeights.emplace(id, weights_[id]);
       diff += (weightAcc[i] - weights_[id]);
       weights_[id] = weightAcc[i];
+      updates[id] = weightAcc[i];
     }
 
     std::lock_guard<std::mutex> lk_(m_);
+    for (const auto& kv : updates) {
+      addStats(oldWeights.at(kv.first), sampleCount_[kv.first], -1);
+      addStats(kv.second, sampleCount_[kv.first], 1);
+    }
+    if (useSumTree && !updates.empty()) {
+      std::vector<int> updateIds;
+      std::vector<double> updateWeights;
+      updateIds.reserve(updates.size());
+      updateWeights.reserve(updates.size());
+      for (const auto& kv : updates) {
+        updateIds.push_back(kv.first);
+        updateWeights.push_back(kv.second);
+      }
+      tree_.set(updateIds, updateWeights);
+    }
     sum_ += diff;
   }
 
+  // stratified sampling over the sum tree, <batchsize> segments of equal mass
+  // holds the lock while walking the tree because append modifies the nodes
+  // shared with the safe region, O(batchsize * log(capacity))
+  // returns the safe size, the sampled slot ids and their weights
+  int sampleIds(
+      int batchsize,
+      std::mt19937& rng,
+      std::vector<int>* ids,
+      std::vector<float>* weights,
+      float* sum) {
+    assert(useSumTree);
+    std::lock_guard<std::mutex> lk(m_);
+    double total = tree_.total();
+    assert(safeSize_ >= batchsize && total > 0);
+
+    double segment = total / batchsize;
+    std::uniform_real_distribution<double> dist(0.0, segment);
+    ids->resize(batchsize);
+    weights->resize(batchsize);
+    for (int i = 0; i < batchsize; ++i) {
+      double rand = std::min(dist(rng) + i * segment, total);
+      int id = tree_.find(rand);
+      (*ids)[i] = id;
+      (*weights)[i] = weights_[id];
+    }
+    *sum = total;
+    return safeSize_;
+  }
+
   // ------------------------------------------------------------- //
   // accessing elements is never locked, operate safely!
   DataType get(int idx) {
     int id = (head_ + idx) % capacity;
-    return elements_[id];
+    return load(id);
   }
 
   DataType getElementAndMark(int idx) {
     int id = (head_ + idx) % capacity;
-    evicted_[id] = false;
-    return elements_[id];
+    markById({id});
+    return load(id);
+  }
+
+  DataType getElementAndMarkById(int id) {
+    markById({id});
+    return load(id);
+  }
+
+  void markById(const std::vector<int>& ids) {
+    std::lock_guard<std::mutex> lk(m_);
+    for (auto id : ids) {
+      mark(id);
+    }
+  }
+
+  // slab only, gather the slots into one batch, the slots must remain static
+  // until it returns, i.e. pin them or call it before blockPop. Not locked
+  SlabBatch gatherById(const std::vector<int>& ids, bool pin) const {
+    assert(useSlab);
+    return slab_->gather(ids, pin);
+  }
+
+  // slab only, the device part of the batch assembly, can run without lock
+  DataType toBatch(SlabBatch& batch, const std::string& device) const {
+    if constexpr (std::is_same_v<DataType, RNNTransition>) {
+      return slab_->toBatch(batch, device);
+    } else {
+      assert(false);
+      return DataType();
+    }
+  }
+
+  // the stored (packed) form & weight of the safe elements in insertion order,
+  // the caller makes sure that they are not popped meanwhile
+  std::vector<DataType> safeElements(std::vector<float>* weights) const {
+    int head;
+    int safeSize;
+    {
+      std::lock_guard<std::mutex> lk(m_);
+      head = head_;
+      safeSize = safeSize_;
+    }
+    std::vector<DataType> elements;
+    elements.reserve(safeSize);
+    weights->clear();
+    for (int i = 0; i < safeSize; ++i) {
+      int id = (head + i) % capacity;
+      if constexpr (std::is_same_v<DataType, RNNTransition>) {
+        if (useSlab) {
+          elements.push_back(slab_->readPacked(id));
+          weights->push_back(weights_[id]);
+          continue;
+        }
+      }
+      elements.push_back(elements_[id]);
+      weights->push_back(weights_[id]);
+    }
+    return elements;
+  }
+
+  // the version of the actor models, recorded for each appended element
+  void setModelVersion(int version) {
+    modelVersion_ = version;
+  }
+
+  // aggregates of the safe region kept up to date by append, mark, update &
+  // blockPop, plus the cumulative counters; O(#bins), see PrioritizedReplay
+  TensorDict stats() const {
+    std::lock_guard<std::mutex> lk(m_);
+    double treeSum = useSumTree ? tree_.total() : sum_;
+    return {
+        {"size", torch::tensor((int64_t)safeSize_, torch::kInt64)},
+        {"priority_hist", torch::tensor(priorityHist_, torch::kInt64)},
+        {"priority_mean",
+         torch::tensor(safeSize_ > 0 ? float(prioritySum_ / safeSize_) : 0.0f)},
+        {"sample_count_hist", torch::tensor(sampleCountHist_, torch::kInt64)},
+        {"sample_age_hist", torch::tensor(sampleAgeHist_, torch::kInt64)},
+        {"tree_drift", torch::tensor(float(std::abs(treeSum - sum_)))},
+        {"num_evict", torch::tensor(numEvict_, torch::kInt64)},
+        {"evict_sample_count", torch::tensor(evictSampleCount_, torch::kInt64)},
+        {"model_version", torch::tensor((int64_t)modelVersion_, torch::kInt64)},
+    };
   }
 
   float getWeight(int idx, int* id) {
@@ -157,8 +404,64 @@ class ConcurrentQueue {
   }
 
   const int capacity;
+  const bool useSumTree;
+  const bool useSlab;
+  const float alpha;
 
  private:
+  void store(int id, const DataType& data) {
+    if constexpr (std::is_same_v<DataType, RNNTransition>) {
+      if (useSlab) {
+        slab_->write(id, data);
+        return;
+      }
+    }
+    elements_[id] = data;
+  }
+
+  // bin 0: age 0, bin k: [2^(k-1), 2^k), the last bin is open
+  static constexpr int kNumAgeBin = 16;
+  // see priorityBins, the first & the last bin are open
+  static constexpr int kNumPriorityBin = 14;
+  // the last bin of the sample counts is >= kMaxSampleCount
+  static constexpr int kMaxSampleCount = 16;
+
+  // add (sign 1) or remove (sign -1) a safe slot from the aggregates, under m_
+  void addStats(float weight, int sampleCount, int sign) {
+    double priority = alpha > 0 ? std::pow((double)weight, 1.0 / alpha) : weight;
+    static const auto bins = priorityBins();
+    int bin = std::upper_bound(bins.begin(), bins.end(), priority) - bins.begin();
+    priorityHist_[bin] += sign;
+    prioritySum_ += sign * priority;
+    sampleCountHist_[std::min(sampleCount, kMaxSampleCount)] += sign;
+  }
+
+  // called for every sampled slot, under the sampler lock & m_
+  void mark(int id) {
+    evicted_[id] = false;
+    int count = sampleCount_[id]++;
+    if (count < kMaxSampleCount) {
+      --sampleCountHist_[count];
+      ++sampleCountHist_[count + 1];
+    }
+    int age = std::max(0, modelVersion_ - version_[id]);
+    int bin = 0;
+    while (age > 0 && bin < kNumAgeBin - 1) {
+      age >>= 1;
+      ++bin;
+    }
+    ++sampleAgeHist_[bin];
+  }
+
+  DataType load(int id) const {
+    if constexpr (std::is_same_v<DataType, RNNTransition>) {
+      if (useSlab) {
+        return slab_->read(id);
+      }
+    }
+    return elements_[id];
+  }
+
   void checkSize(int head, int tail, int size) {
     if (size == 0) {
       assert(tail == head);
@@ -178,7 +481,6 @@ class ConcurrentQueue {
 
   mutable std::mutex m_;
   std::condition_variable cvSize_;
-  std::condition_variable cvTail_;
 
   int head_;
   int tail_;
@@ -188,9 +490,27 @@ class ConcurrentQueue {
   int safeSize_;
   double sum_;
   std::vector<bool> evicted_;
+  // slots in [safeTail_, tail_) whose copy has finished
+  std::vector<bool> written_;
 
   std::vector<DataType> elements_;
   std::vector<float> weights_;
+  SumTree tree_;
+  std::unique_ptr<TransitionSlab> slab_;
+
+  // stats, see stats(), the aggregates are guarded by m_
+  std::atomic<int> modelVersion_ = 0;
+  std::vector<int> version_;
+  std::vector<int> sampleCount_;
+  std::vector<int64_t> sampleAgeHist_;
+  std::vector<int64_t> priorityHist_;
+  std::vector<int64_t> sampleCountHist_;
+  double prioritySum_ = 0;
+  int64_t numEvict_ = 0;
+  int64_t evictSampleCount_ = 0;
+
+  // #in flight gathers of each slot, see pin()
+  std::vector<int> pinCount_;
 
   bool terminated_ = false;
 };
@@ -198,32 +518,93 @@ class ConcurrentQueue {
 template <class DataType>
 class PrioritizedReplay {
  public:
-  PrioritizedReplay(int capacity, int seed, float alpha, float beta, int prefetch)
+  PrioritizedReplay(
+      int capacity,
+      int seed,
+      float alpha,
+      float beta,
+      int prefetch,
+      bool useSumTree = true,
+      const std::vector<std::string>& bitPackedKeys = {},
+      bool useSlab = false,
+      int numPrefetchThread = 1,
+      int appendBlockSize = 1)
       : alpha_(alpha)  // priority exponent
       , beta_(beta)    // importance sampling exponent
       , prefetch_(prefetch)
+      , numPrefetchThread_(numPrefetchThread)
+      , appendBlockSize_(appendBlockSize)
       , capacity_(capacity)
-      , storage_(int(1.25 * capacity))
+      , bitPackedKeys_(bitPackedKeys)
+      , storage_(int(1.25 * capacity), useSumTree, useSlab, alpha)
       , numAdd_(0) {
+    if constexpr (!std::is_same_v<DataType, RNNTransition>) {
+      // fail here instead of in the actor threads calling add
+      if (!bitPackedKeys_.empty()) {
+        throw std::invalid_argument("bit packed obs are only supported for RNNTransition");
+      }
+    }
     rng_.seed(seed);
+    assert(numPrefetchThread_ >= 1);
+    assert(appendBlockSize_ >= 1 && appendBlockSize_ <= capacity_);
+  }
+
+  ~PrioritizedReplay() {
+    stopPrefetch_();
   }
 
   void clear() {
     assert(sampledIds_.empty());
-    while (!futures_.empty()) {
-      futures_.pop();
+    stopPrefetch_();
+    for (auto& shard : appendShards_) {
+      std::lock_guard<std::mutex> lk(shard.m);
+      shard.data.clear();
+      shard.weights.clear();
     }
     storage_.clear();
     numAdd_ = 0;
   }
 
+  // the staged samples that do not fit any more are dropped, nothing samples
+  // them after terminate anyway
   void terminate() {
+    stopPrefetch_();
+    flush_(false);
     storage_.terminate();
   }
 
+  // with appendBlockSize > 1, the samples are staged in the shard of the
+  // calling thread and appended to the storage one block at a time, so that
+  // the actor threads do not meet on the lock of the storage. The staged
+  // samples count in numAdd but are not sampled before their block is full
+  // or flush is called
   void add(const DataType& sample, float priority) {
     numAdd_ += 1;
-    storage_.append(sample, std::pow(priority, alpha_));
+    DataType data = sample;
+    if (!bitPackedKeys_.empty()) {
+      // pack before taking the lock of the storage
+      packObs(data, bitPackedKeys_);
+    }
+    float weight = std::pow(priority, alpha_);
+    if (appendBlockSize_ == 1) {
+      storage_.append(data, weight);
+      return;
+    }
+
+    auto& shard = appendShards_[shardIndex_()];
+    std::vector<DataType> block;
+    std::vector<float> weights;
+    {
+      std::lock_guard<std::mutex> lk(shard.m);
+      shard.data.push_back(std::move(data));
+      shard.weights.push_back(weight);
+      if ((int)shard.data.size() < appendBlockSize_) {
+        return;
+      }
+      std::swap(block, shard.data);
+      std::swap(weights, shard.weights);
+    }
+    storage_.blockAppend(block, weights);
   }
 
   void add(const DataType& sample) {
@@ -231,6 +612,12 @@ class PrioritizedReplay {
     add(sample, priority);
   }
 
+  // append the staged samples of every shard, e.g. after a finite producer
+  // is done; waits for space like add
+  void flush() {
+    flush_(true);
+  }
+
   std::tuple<DataType, torch::Tensor> sample(int batchsize, const std::string& device) {
     if (!sampledIds_.empty()) {
       std::cout << "Error: previous samples' priority has not been updated." << std::endl;
@@ -244,26 +631,40 @@ class PrioritizedReplay {
       return std::make_tuple(batch, priority);
     }
 
-    if (futures_.empty()) {
-      std::tie(batch, priority, sampledIds_) = sample_(batchsize, device);
-    } else {
-      std::tie(batch, priority, sampledIds_) = futures_.front().get();
-      futures_.pop();
+    if (prefetchThreads_.empty()) {
+      startPrefetch_(batchsize, device);
     }
-
-    while ((int)futures_.size() < prefetch_) {
-      auto f = std::async(
-          std::launch::async,
-          &PrioritizedReplay<DataType>::sample_,
-          this,
-          batchsize,
-          device);
-      futures_.push(std::move(f));
+    assert(batchsize == prefetchBatchsize_ && device == prefetchDevice_);
+
+    std::unique_lock<std::mutex> lk(mReady_);
+    ++numSample_;
+    if (ready_.empty()) {
+      ++numWait_;
+      auto start = std::chrono::steady_clock::now();
+      cvReady_.wait(lk, [this] { return !ready_.empty(); });
+      std::chrono::duration<double> wait = std::chrono::steady_clock::now() - start;
+      waitTime_ += wait.count();
     }
+    std::tie(batch, priority, sampledIds_) = std::move(ready_.front());
+    ready_.pop_front();
+    lk.unlock();
+    cvSpace_.notify_one();
 
     return std::make_tuple(batch, priority);
   }
 
+  // num_sample: #batches returned by sample with prefetch on
+  // num_wait: #times the ready queue was empty, wait_time: seconds spent waiting
+  std::unordered_map<std::string, float> prefetchStats() const {
+    std::lock_guard<std::mutex> lk(mReady_);
+    return {
+        {"num_sample", (float)numSample_},
+        {"num_wait", (float)numWait_},
+        {"wait_time", (float)waitTime_},
+        {"num_ready", (float)ready_.size()},
+    };
+  }
+
   void updatePriority(const torch::Tensor& priority) {
     if (priority.size(0) == 0) {
       sampledIds_.clear();
@@ -282,7 +683,58 @@ class PrioritizedReplay {
   }
 
   DataType get(int idx) {
-    return storage_.get(idx);
+    return unpackObs(storage_.get(idx));
+  }
+
+  // write the sampleable elements & their priorities to <path>, see
+  // replay_snapshot.h. The slab slots are written in place, so sampling
+  // (which pops) is blocked while writing, otherwise only while collecting
+  void save(const std::string& path) {
+    flush();
+    std::unique_lock<std::mutex> lk(mSampler_);
+    std::vector<float> weights;
+    auto elements = storage_.safeElements(&weights);
+    if (!storage_.useSlab) {
+      lk.unlock();
+    }
+
+    std::vector<TensorDict> rows;
+    rows.reserve(elements.size());
+    for (size_t i = 0; i < elements.size(); ++i) {
+      auto fields = snapshot::toFields(elements[i]);
+      fields["__weight"] = torch::tensor(weights[i]);
+      rows.push_back(std::move(fields));
+    }
+    snapshot::save(path, rows);
+  }
+
+  // warm start an empty replay from a snapshot, keeps the newest <capacity>
+  // elements. With mmap, the elements reference the file mapped copy-on-write
+  // and are only paged in when sampled, unless copied into the slab
+  void load(const std::string& path, bool mmap) {
+    if (storage_.size() != 0) {
+      throw std::runtime_error("replay snapshot " + path + ": load into a non empty replay");
+    }
+    auto rows = snapshot::load(path, mmap);
+    int start = std::max(0, (int)rows.size() - capacity_);
+
+    std::vector<DataType> block;
+    std::vector<float> weights;
+    block.reserve(rows.size() - start);
+    weights.reserve(rows.size() - start);
+    for (int i = start; i < (int)rows.size(); ++i) {
+      auto& fields = rows[i];
+      weights.push_back(fields.at("__weight").item<float>());
+      fields.erase("__weight");
+      DataType data;
+      snapshot::fromFields(fields, &data);
+      // in case the snapshot was written by a replay w/o bit packing
+      packObs(data, bitPackedKeys_);
+      block.push_back(std::move(data));
+    }
+    if (!block.empty()) {
+      storage_.blockAppend(block, weights);
+    }
   }
 
   int size() const {
@@ -293,10 +745,111 @@ class PrioritizedReplay {
     return numAdd_;
   }
 
+  void setModelVersion(int version) {
+    storage_.setModelVersion(version);
+  }
+
+  // aggregates for monitoring, kept up to date incrementally by the storage,
+  // so that neither the elements nor the per-slot arrays are copied
+  //   priority_hist: #slots per half decade of priority, [< 1e-4, ..., >= 1e2]
+  //   priority_mean: mean priority of the sampleable slots
+  //   sample_count_hist: #slots sampled 0, 1, ..., >= 16 times
+  //   sample_age_hist: #sampled slots per age in model versions, see mark()
+  //   tree_drift: |sum tree total - running sum| of the weights
+  //   num_evict, evict_sample_count: #evicted & #times they were sampled
+  // sample_age_hist, num_evict & evict_sample_count are cumulative
+  TensorDict stats() const {
+    auto stats = storage_.stats();
+    auto bins = ConcurrentQueue<DataType>::priorityBins();
+    stats["priority_bins"] = torch::tensor(bins, torch::kFloat64).to(torch::kFloat32);
+    return stats;
+  }
+
  private:
   using SampleWeightIds = std::tuple<DataType, torch::Tensor, std::vector<int>>;
 
+  struct AppendShard {
+    std::mutex m;
+    std::vector<DataType> data;
+    std::vector<float> weights;
+  };
+
+  // a thread gets its shard index once, the threads only share a shard when
+  // there are more of them than shards
+  static int shardIndex_() {
+    static std::atomic<int> nextShard{0};
+    thread_local int shard = nextShard++ % kNumAppendShard;
+    return shard;
+  }
+
+  void flush_(bool wait) {
+    for (auto& shard : appendShards_) {
+      std::vector<DataType> block;
+      std::vector<float> weights;
+      {
+        std::lock_guard<std::mutex> lk(shard.m);
+        std::swap(block, shard.data);
+        std::swap(weights, shard.weights);
+      }
+      if (!block.empty()) {
+        storage_.blockAppend(block, weights, wait);
+      }
+    }
+  }
+
+  // the workers keep at most <prefetch_> batches ready or in flight, each only
+  // holds mSampler_ inside sample_ to draw (& pin) the ids, the batch assembly
+  // & device transfer run in parallel
+  void startPrefetch_(int batchsize, const std::string& device) {
+    prefetchBatchsize_ = batchsize;
+    prefetchDevice_ = device;
+    prefetchDone_ = false;
+    for (int i = 0; i < numPrefetchThread_; ++i) {
+      prefetchThreads_.emplace_back([this, batchsize, device]() {
+        while (true) {
+          {
+            std::unique_lock<std::mutex> lk(mReady_);
+            cvSpace_.wait(lk, [this] {
+              return prefetchDone_ || (int)ready_.size() + numInFlight_ < prefetch_;
+            });
+            if (prefetchDone_) {
+              return;
+            }
+            ++numInFlight_;
+          }
+
+          auto sample = sample_(batchsize, device);
+
+          {
+            std::lock_guard<std::mutex> lk(mReady_);
+            --numInFlight_;
+            ready_.push_back(std::move(sample));
+          }
+          cvReady_.notify_one();
+        }
+      });
+    }
+  }
+
+  // drop the prefetched batches, a later sample restarts the workers
+  void stopPrefetch_() {
+    {
+      std::lock_guard<std::mutex> lk(mReady_);
+      prefetchDone_ = true;
+    }
+    cvSpace_.notify_all();
+    for (auto& t : prefetchThreads_) {
+      t.join();
+    }
+    prefetchThreads_.clear();
+    ready_.clear();
+  }
+
   SampleWeightIds sample_(int batchsize, const std::string& device) {
+    if (storage_.useSumTree) {
+      return sampleSumTree_(batchsize, device);
+    }
+
     std::unique_lock<std::mutex> lk(mSampler_);
 
     float sum;
@@ -323,8 +876,9 @@ class PrioritizedReplay {
       while (nextIdx <= size) {
         if (accSum > 0 && accSum >= rand) {
           assert(nextIdx >= 1);
-          DataType element = storage_.getElementAndMark(nextIdx - 1);
-          samples.push_back(element);
+          if (!storage_.useSlab) {
+            samples.push_back(storage_.getElementAndMark(nextIdx - 1));
+          }
           weightAcc[i] = w;
           ids[i] = id;
           break;
@@ -342,39 +896,119 @@ class PrioritizedReplay {
         ++nextIdx;
       }
     }
-    assert((int)samples.size() == batchsize);
+    if (storage_.useSlab) {
+      storage_.markById(ids);
+      storage_.pin(ids);
+    }
+    assert(storage_.useSlab || (int)samples.size() == batchsize);
 
-    // pop storage if full
-    size = storage_.size();
-    if (size > capacity_) {
-      storage_.blockPop(size - capacity_);
+    popIfFull_();
+
+    // safe to unlock, because <samples> contains copys & the slots to gather
+    // are pinned
+    lk.unlock();
+
+    auto batch = storage_.useSlab ? gatherAndUnpin_(ids, device)
+                                  : makeBatch(samples, device);
+
+    weights = weights / sum;
+    weights = torch::pow(size * weights, -beta_);
+    weights /= weights.max();
+    if (device != "cpu") {
+      weights = weights.to(torch::Device(device));
     }
+    return std::make_tuple(batch, weights, ids);
+  }
 
-    // safe to unlock, because <samples> contains copys
+  SampleWeightIds sampleSumTree_(int batchsize, const std::string& device) {
+    std::unique_lock<std::mutex> lk(mSampler_);
+
+    float sum;
+    std::vector<int> ids;
+    std::vector<float> w;
+    int size = storage_.sampleIds(batchsize, rng_, &ids, &w, &sum);
+    // the sampled slots remain static until the next blockPop below
+
+    std::vector<DataType> samples;
+    if (storage_.useSlab) {
+      storage_.markById(ids);
+      storage_.pin(ids);
+    } else {
+      samples.reserve(batchsize);
+      for (auto id : ids) {
+        samples.push_back(storage_.getElementAndMarkById(id));
+      }
+    }
+
+    popIfFull_();
+
+    // safe to unlock, because <samples> contains copys & the slots to gather
+    // are pinned
     lk.unlock();
 
+    auto batch = storage_.useSlab ? gatherAndUnpin_(ids, device)
+                                  : makeBatch(samples, device);
+    auto weights = torch::from_blob(w.data(), {batchsize}, torch::kFloat32).clone();
     weights = weights / sum;
     weights = torch::pow(size * weights, -beta_);
     weights /= weights.max();
     if (device != "cpu") {
       weights = weights.to(torch::Device(device));
     }
-    auto batch = makeBatch(samples, device);
     return std::make_tuple(batch, weights, ids);
   }
 
+  // under mSampler_, the pop stops at pinned slots and the rest of it is
+  // retried by the next sample or unpin
+  void popIfFull_() {
+    int size = storage_.size();
+    if (size > capacity_) {
+      storage_.blockPop(size - capacity_);
+    }
+  }
+
+  // gather the pinned slots without holding mSampler_, so that the workers
+  // only serialize on drawing the ids
+  DataType gatherAndUnpin_(const std::vector<int>& ids, const std::string& device) {
+    auto slabBatch = storage_.gatherById(ids, device != "cpu");
+    {
+      std::lock_guard<std::mutex> lk(mSampler_);
+      storage_.unpin(ids);
+      popIfFull_();
+    }
+    return storage_.toBatch(slabBatch, device);
+  }
+
   const float alpha_;
   const float beta_;
   const int prefetch_;
+  const int numPrefetchThread_;
+  const int appendBlockSize_;
   const int capacity_;
+  const std::vector<std::string> bitPackedKeys_;
 
   ConcurrentQueue<DataType> storage_;
   std::atomic<int> numAdd_;
+  static constexpr int kNumAppendShard = 16;
+  std::array<AppendShard, kNumAppendShard> appendShards_;
 
   // make sure that sample & update does not overlap
   std::mutex mSampler_;
   std::vector<int> sampledIds_;
-  std::queue<std::future<SampleWeightIds>> futures_;
+
+  // prefetch pipeline, the ready queue & stats are guarded by mReady_
+  std::vector<std::thread> prefetchThreads_;
+  mutable std::mutex mReady_;
+  std::condition_variable cvReady_;
+  std::condition_variable cvSpace_;
+  std::deque<SampleWeightIds> ready_;
+  int numInFlight_ = 0;
+  bool prefetchDone_ = false;
+  int prefetchBatchsize_ = 0;
+  std::string prefetchDevice_;
+  int64_t numSample_ = 0;
+  int64_t numWait_ = 0;
+  double waitTime_ = 0;
 
   std::mt19937 rng_;
 };
@@ -34,13 +34,36 @@ PYBIND11_MODULE(rela, m) {
            float,  // alpha, priority exponent
            float,  // beta, importance sampling exponent
            int>())
+      .def(py::init<
+           int,    // capacity,
+           int,    // seed,
+           float,  // alpha, priority exponent
+           float,  // beta, importance sampling exponent
+           int,    // prefetch
+           bool,   // use sum tree
+           const std::vector<std::string>&,  // bit packed keys
+           bool,  // use slab
+           int,   // num prefetch thread
+           int>())  // append block size
       .def("clear", &RNNPrioritizedReplay::clear)
       .def("terminate", &RNNPrioritizedReplay::terminate)
       .def("size", &RNNPrioritizedReplay::size)
       .def("num_add", &RNNPrioritizedReplay::numAdd)
+      // flush waits for space & save/load do file I/O, without the GIL
+      .def("flush", &RNNPrioritizedReplay::flush, py::call_guard<py::gil_scoped_release>())
+      .def("set_model_version", &RNNPrioritizedReplay::setModelVersion)
+      .def("stats", &RNNPrioritizedReplay::stats)
       .def("sample", &RNNPrioritizedReplay::sample)
       .def("update_priority", &RNNPrioritizedReplay::updatePriority)
-      .def("get", &RNNPrioritizedReplay::get);
+      .def("prefetch_stats", &RNNPrioritizedReplay::prefetchStats)
+      .def("get", &RNNPrioritizedReplay::get)
+      .def("save", &RNNPrioritizedReplay::save, py::call_guard<py::gil_scoped_release>())
+      .def(
+          "load",
+          &RNNPrioritizedReplay::load,
+          py::arg("path"),
+          py::arg("mmap") = true,
+          py::call_guard<py::gil_scoped_release>());
 
   py::class_<TensorDictReplay, std::shared_ptr<TensorDictReplay>>(m, "TensorDictReplay")
       .def(py::init<
@@ -49,11 +72,44 @@ PYBIND11_MODULE(rela, m) {
            float,  // alpha, priority exponent
            float,  // beta, importance sampling exponent
            int>())
+      .def(py::init([](int capacity,
+                       int seed,
+                       float alpha,
+                       float beta,
+                       int prefetch,
+                       bool useSumTree,
+                       bool useSlab,
+                       int numPrefetchThread,
+                       int appendBlockSize) {
+        // no bit packed keys, bit packing is only implemented for RNNTransition
+        return std::make_shared<TensorDictReplay>(
+            capacity,
+            seed,
+            alpha,
+            beta,
+            prefetch,
+            useSumTree,
+            std::vector<std::string>(),
+            useSlab,
+            numPrefetchThread,
+            appendBlockSize);
+      }))
       .def("size", &TensorDictReplay::size)
       .def("num_add", &TensorDictReplay::numAdd)
+      .def("flush", &TensorDictReplay::flush, py::call_guard<py::gil_scoped_release>())
+      .def("set_model_version", &TensorDictReplay::setModelVersion)
+      .def("stats", &TensorDictReplay::stats)
       .def("sample", &TensorDictReplay::sample)
       .def("update_priority", &TensorDictReplay::updatePriority)
-      .def("get", &TensorDictReplay::get);
+      .def("prefetch_stats", &TensorDictReplay::prefetchStats)
+      .def("get", &TensorDictReplay::get)
+      .def("save", &TensorDictReplay::save, py::call_guard<py::gil_scoped_release>())
+      .def(
+          "load",
+          &TensorDictReplay::load,
+          py::arg("path"),
+          py::arg("mmap") = true,
+          py::call_guard<py::gil_scoped_release>());
 
   py::class_<ThreadLoop, std::shared_ptr<ThreadLoop>>(m, "ThreadLoop");
 
@@ -74,8 +130,25 @@ PYBIND11_MODULE(rela, m) {
            const std::vector<std::string>&>())
       .def(py::init<py::object, const std::string&>())
       .def("add_method", &BatchRunner::addMethod)
+      .def(
+          "set_batch_policy",
+          &BatchRunner::setBatchPolicy,
+          py::arg("method"),
+          py::arg("target_batchsize"),
+          py::arg("max_wait_us"),
+          py::arg("latency_budget_us") = 0)
+      .def(
+          "set_workers",
+          &BatchRunner::setWorkers,
+          py::arg("method"),
+          py::arg("num_worker"),
+          py::arg("priority") = 0,
+          py::arg("num_thread") = 0)
+      .def("set_max_concurrent_call", &BatchRunner::setMaxConcurrentCall)
+      .def("stats", &BatchRunner::stats)
       .def("start", &BatchRunner::start)
       .def("stop", &BatchRunner::stop)
       .def("update_model", &BatchRunner::updateModel)
+      .def("model_version", &BatchRunner::modelVersion)
       .def("set_log_freq", &BatchRunner::setLogFreq);
 }
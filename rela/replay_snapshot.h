@@ -0,0 +1,303 @@
+// Copyright (c) Facebook, Inc. and its affiliates.
+// All rights reserved.
+//
+// This source code is licensed under the license found in the
+// LICENSE file in the root directory of this source tree.
+//
+#pragma once
+
+#include <algorithm>
+#include <filesystem>
+#include <fstream>
+#include <sstream>
+#include <stdexcept>
+#include <string>
+#include <vector>
+
+#include "rela/slab.h"
+#include "rela/tensor_dict.h"
+#include "rela/transition.h"
+
+namespace rela {
+
+// on-disk image of the replay storage, a single file:
+//   int64 header size | text header | padding | data
+// every field is one contiguous [n, ...] array in the data section, fields
+// whose rows differ in shape (the values of the packed obs) are concatenated
+// along dim 0 and their row lengths are stored in the field "__len/<key>"
+// the header lists "<key> <dtype> <offset> <nbytes> <ndim> <dims...>" per
+// field, offsets are relative to the data section & aligned to 64 bytes so
+// that a memory-mapped file can be viewed as tensors in place
+// I/O & format errors throw std::runtime_error, i.e. a python exception
+namespace snapshot {
+
+constexpr int64_t kAlign = 64;
+constexpr const char* kMagic = "rela_replay_snapshot";
+constexpr int kVersion = 1;
+
+// flat form of one element, see TransitionSlab::flatten, the packed obs also
+// keep their non binary values & their "<dim> <dtype>"
+inline TensorDict toFields(const TensorDict& element) {
+  return element;
+}
+
+inline TensorDict toFields(const RNNTransition& transition) {
+  auto fields = TransitionSlab::flatten(transition);
+  for (const auto& kv : transition.packedObs) {
+    const auto& packed = kv.second;
+    fields["values/" + kv.first] =
+        packed.nonBinary.defined() ? packed.values : torch::zeros({0}, torch::kFloat32);
+    fields["packed/" + kv.first] =
+        torch::tensor({packed.dim, (int64_t)packed.dtype}, torch::kInt64);
+  }
+  return fields;
+}
+
+inline void fromFields(const TensorDict& fields, TensorDict* element) {
+  *element = fields;
+}
+
+inline void fromFields(const TensorDict& fields, RNNTransition* transition) {
+  auto identity = [](const torch::Tensor& t, bool) { return t; };
+  *transition = TransitionSlab::unflatten(fields, identity);
+  for (const auto& kv : fields) {
+    if (kv.first.rfind("packed/", 0) != 0) {
+      continue;
+    }
+    auto name = kv.first.substr(std::string("packed/").size());
+    auto meta = kv.second.accessor<int64_t, 1>();
+    PackedTensor packed;
+    packed.dim = meta[0];
+    packed.dtype = (torch::ScalarType)meta[1];
+    packed.bits = fields.at("bits/" + name);
+    const auto& values = fields.at("values/" + name);
+    if (values.numel() > 0) {
+      packed.nonBinary = fields.at("non_binary/" + name);
+      packed.values = values;
+    }
+    transition->packedObs[name] = packed;
+  }
+}
+
+[[noreturn]] inline void fail(const std::string& path, const std::string& what) {
+  throw std::runtime_error("replay snapshot " + path + ": " + what);
+}
+
+inline torch::ScalarType parseDtype(const std::string& name, const std::string& path) {
+  for (auto dtype :
+       {torch::kFloat32,
+        torch::kFloat64,
+        torch::kFloat16,
+        torch::kBFloat16,
+        torch::kInt64,
+        torch::kInt32,
+        torch::kInt16,
+        torch::kInt8,
+        torch::kUInt8,
+        torch::kBool}) {
+    if (name == c10::toString(dtype)) {
+      return dtype;
+    }
+  }
+  fail(path, "unknown dtype " + name);
+}
+
+inline int64_t alignUp(int64_t n) {
+  return (n + kAlign - 1) / kAlign * kAlign;
+}
+
+// rows must share their keys, written to <path>.tmp first & renamed, so that
+// a process with <path> mapped keeps reading the old file
+inline void save(const std::string& path, const std::vector<TensorDict>& rows) {
+  int64_t n = rows.size();
+  std::vector<std::string> keys;
+  if (n > 0) {
+    keys = tensor_dict::getKeys(rows[0]);
+  }
+  std::sort(keys.begin(), keys.end());
+
+  // per field: the rows to write & their total shape
+  struct Field {
+    std::string key;
+    torch::ScalarType dtype;
+    std::vector<int64_t> shape;
+    int64_t offset;
+    int64_t nbytes;
+  };
+  std::vector<Field> fields;
+  std::vector<std::vector<torch::Tensor>> data;
+  int64_t offset = 0;
+  auto addField = [&](const std::string& key,
+                      std::vector<torch::Tensor> tensors,
+                      bool stack) {
+    assert(key.find(' ') == std::string::npos);
+    Field field;
+    field.key = key;
+    field.dtype = tensors[0].scalar_type();
+    field.nbytes = 0;
+    int64_t numRow = 0;
+    for (auto& t : tensors) {
+      assert(t.scalar_type() == field.dtype);
+      t = t.to(torch::kCPU).contiguous();
+      field.nbytes += t.nbytes();
+      numRow += stack ? 1 : t.size(0);
+    }
+    auto rowShape = tensors[0].sizes().vec();
+    if (!stack) {
+      rowShape.erase(rowShape.begin());
+    }
+    field.shape = utils::pushLeft(numRow, rowShape);
+    field.offset = offset;
+    offset = alignUp(offset + field.nbytes);
+    fields.push_back(field);
+    data.push_back(std::move(tensors));
+  };
+
+  for (const auto& key : keys) {
+    std::vector<torch::Tensor> tensors;
+    tensors.reserve(n);
+    bool sameShape = true;
+    for (const auto& row : rows) {
+      tensors.push_back(row.at(key));
+      sameShape = sameShape && tensors.back().sizes() == tensors[0].sizes();
+    }
+    if (sameShape) {
+      addField(key, std::move(tensors), true);
+      continue;
+    }
+
+    auto lengths = torch::zeros({n}, torch::kInt64);
+    auto lengthAcc = lengths.accessor<int64_t, 1>();
+    for (int64_t i = 0; i < n; ++i) {
+      assert(tensors[i].dim() >= 1);
+      lengthAcc[i] = tensors[i].size(0);
+    }
+    addField(key, std::move(tensors), false);
+    addField("__len/" + key, {lengths}, false);
+  }
+
+  std::ostringstream header;
+  header << kMagic << " " << kVersion << "\n" << n << " " << fields.size() << "\n";
+  for (const auto& field : fields) {
+    header << field.key << " " << c10::toString(field.dtype) << " " << field.offset << " "
+           << field.nbytes << " " << field.shape.size();
+    for (auto d : field.shape) {
+      header << " " << d;
+    }
+    header << "\n";
+  }
+  std::string headerStr = header.str();
+  int64_t headerSize = headerStr.size();
+  int64_t dataStart = alignUp(sizeof(int64_t) + headerSize);
+
+  std::string tmpPath = path + ".tmp";
+  {
+    std::ofstream out(tmpPath, std::ios::binary | std::ios::trunc);
+    if (!out.good()) {
+      fail(tmpPath, "cannot open for writing");
+    }
+    std::vector<char> zeros(kAlign, 0);
+    out.write((const char*)&headerSize, sizeof(int64_t));
+    out.write(headerStr.data(), headerSize);
+    out.write(zeros.data(), dataStart - sizeof(int64_t) - headerSize);
+    for (size_t i = 0; i < fields.size(); ++i) {
+      for (const auto& t : data[i]) {
+        out.write((const char*)t.data_ptr(), t.nbytes());
+      }
+      out.write(zeros.data(), alignUp(fields[i].nbytes) - fields[i].nbytes);
+    }
+    out.close();
+    if (out.fail()) {
+      fail(tmpPath, "write failed");
+    }
+  }
+  std::filesystem::rename(tmpPath, path);
+}
+
+// returns the rows as views into the file, which is either read into memory
+// or mapped copy-on-write (MAP_PRIVATE) with <mmap>
+inline std::vector<TensorDict> load(const std::string& path, bool mmap) {
+  std::ifstream in(path, std::ios::binary);
+  if (!in.good()) {
+    fail(path, "cannot open for reading");
+  }
+  int64_t fileSize = std::filesystem::file_size(path);
+  int64_t headerSize = -1;
+  in.read((char*)&headerSize, sizeof(int64_t));
+  if (!in.good() || headerSize < 0 || (int64_t)sizeof(int64_t) + headerSize > fileSize) {
+    fail(path, "truncated or not a replay snapshot");
+  }
+  std::string headerStr(headerSize, '\0');
+  in.read(headerStr.data(), headerSize);
+  int64_t dataStart = alignUp(sizeof(int64_t) + headerSize);
+
+  torch::Tensor blob;
+  if (mmap) {
+    blob = torch::from_file(path, /*shared=*/false, fileSize, torch::kUInt8);
+  } else {
+    blob = torch::empty({fileSize}, torch::kUInt8);
+    in.seekg(0);
+    in.read((char*)blob.data_ptr(), fileSize);
+    if (!in.good()) {
+      fail(path, "read failed");
+    }
+  }
+
+  std::istringstream header(headerStr);
+  std::string magic;
+  int version;
+  int64_t n;
+  size_t numField;
+  header >> magic >> version >> n >> numField;
+  if (header.fail() || magic != kMagic || version != kVersion || n < 0) {
+    fail(path, "not a replay snapshot of version " + std::to_string(kVersion));
+  }
+
+  TensorDict fields;
+  for (size_t i = 0; i < numField; ++i) {
+    std::string key, dtype;
+    int64_t offset, nbytes, ndim;
+    header >> key >> dtype >> offset >> nbytes >> ndim;
+    if (header.fail() || ndim < 0 || ndim > 64) {
+      fail(path, "corrupt header");
+    }
+    std::vector<int64_t> shape(ndim);
+    for (auto& d : shape) {
+      header >> d;
+    }
+    if (header.fail()) {
+      fail(path, "corrupt header");
+    }
+    if (offset < 0 || nbytes < 0 || dataStart + offset + nbytes > fileSize) {
+      fail(path, "truncated, field " + key + " runs past the end of the file");
+    }
+    fields[key] = blob.narrow(0, dataStart + offset, nbytes)
+                      .view(parseDtype(dtype, path))
+                      .view(shape);
+  }
+
+  std::vector<TensorDict> rows(n);
+  for (const auto& kv : fields) {
+    const auto& key = kv.first;
+    if (key.rfind("__len/", 0) == 0) {
+      continue;
+    }
+    auto it = fields.find("__len/" + key);
+    if (it == fields.end()) {
+      for (int64_t i = 0; i < n; ++i) {
+        rows[i][key] = kv.second[i];
+      }
+      continue;
+    }
+
+    auto lengthAcc = it->second.accessor<int64_t, 1>();
+    int64_t start = 0;
+    for (int64_t i = 0; i < n; ++i) {
+      rows[i][key] = kv.second.narrow(0, start, lengthAcc[i]);
+      start += lengthAcc[i];
+    }
+  }
+  return rows;
+}
+}  // namespace snapshot
+}  // namespace rela
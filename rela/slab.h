@@ -0,0 +1,259 @@
+// Copyright (c) Facebook, Inc. and its affiliates.
+// All rights reserved.
+//
+// This source code is licensed under the license found in the
+// LICENSE file in the root directory of this source tree.
+//
+#pragma once
+
+#include <memory>
+#include <mutex>
+#include <vector>
+
+#include "rela/bit_pack.h"
+#include "rela/tensor_dict.h"
+#include "rela/transition.h"
+#include "rela/utils.h"
+
+namespace rela {
+
+// a batch gathered from the slab, [batch, ...] for every field, on cpu
+class SlabBatch {
+ public:
+  TensorDict fields;
+  std::unordered_map<std::string, std::vector<torch::Tensor>> packedValues;
+  // staging buffer backing <fields>, returned to the pool once on device
+  std::shared_ptr<TensorDict> staging;
+};
+
+// replay storage of RNNTransition in one preallocated [capacity, ...] tensor
+// per field, allocated at the first write since the shapes are not known
+// before. Writes copy into the slot in place, a batch is a single
+// index_select per field into a reusable (pinned) staging buffer.
+// The transitions must all have the same keys & shapes, i.e. padded to max_len.
+// write() to distinct slots & gather() can be called concurrently, the caller
+// makes sure that the gathered slots are not being rewritten
+class TransitionSlab {
+ public:
+  TransitionSlab(int capacity)
+      : capacity(capacity) {
+  }
+
+  void clear() {
+    std::lock_guard<std::mutex> lk(mStaging_);
+    freeStaging_.clear();
+  }
+
+  void write(int slot, const RNNTransition& transition) {
+    assert(slot >= 0 && slot < capacity);
+    auto fields = flatten(transition);
+    std::call_once(allocated_, [&] { allocate(transition, fields); });
+
+    assert(fields.size() == slab_.size());
+    for (auto& kv : fields) {
+      slab_.at(kv.first)[slot].copy_(kv.second);
+    }
+    for (const auto& kv : transition.packedObs) {
+      auto& values = packedValues_.at(kv.first)[slot];
+      values = kv.second.nonBinary.defined() ? kv.second.values : torch::Tensor();
+    }
+  }
+
+  RNNTransition read(int slot) const {
+    return read_(slot, true).unpackObs();
+  }
+
+  // the stored (packed) form as views into the slab, only valid until the
+  // slot is rewritten
+  RNNTransition readPacked(int slot) const {
+    return read_(slot, false);
+  }
+
+  SlabBatch gather(const std::vector<int>& slots, bool pin) const {
+    int batchsize = slots.size();
+    auto index = torch::tensor(slots, torch::kInt64);
+    SlabBatch batch;
+    if (pin) {
+      batch.staging = acquireStaging(batchsize);
+    }
+    for (auto& kv : slab_) {
+      if (batch.staging == nullptr) {
+        batch.fields[kv.first] = kv.second.index_select(0, index);
+      } else {
+        auto& dest = batch.staging->at(kv.first);
+        torch::index_select_out(dest, kv.second, 0, index);
+        batch.fields[kv.first] = dest;
+      }
+    }
+    for (const auto& kv : packedValues_) {
+      auto& values = batch.packedValues[kv.first];
+      for (auto slot : slots) {
+        if (kv.second[slot].defined()) {
+          values.push_back(kv.second[slot]);
+        }
+      }
+    }
+    return batch;
+  }
+
+  // move to device & into the layout of makeBatch, seq_len is [batch] and the
+  // rest are [seq_len/num_layer, batch, ...]; the packed obs are unpacked on
+  // the device
+  RNNTransition toBatch(SlabBatch& batch, const std::string& device) const {
+    auto d = torch::Device(device);
+    auto convert = [&](const torch::Tensor& t, bool isSeqLen) {
+      return t.to(d).movedim(0, isSeqLen ? 0 : 1).contiguous();
+    };
+    auto transition = unflatten(batch.fields, convert);
+
+    for (const auto& kv : packedMeta_) {
+      const auto& name = kv.first;
+      auto t = bit_pack::unpackBatch(
+          batch.fields.at("bits/" + name),
+          batch.fields.at("non_binary/" + name),
+          batch.packedValues.at(name),
+          kv.second.first,
+          kv.second.second,
+          d);
+      transition.obs[name] = t.movedim(0, 1).contiguous();
+    }
+
+    // the copies above are synchronous, safe to reuse the staging buffer
+    if (batch.staging != nullptr) {
+      releaseStaging(batch.staging);
+      batch.staging = nullptr;
+    }
+    return transition;
+  }
+
+  // one field per tensor, the packed obs as their bits & non binary masks
+  static TensorDict flatten(const RNNTransition& transition) {
+    TensorDict fields;
+    for (const auto& kv : transition.obs) {
+      fields["obs/" + kv.first] = kv.second;
+    }
+    for (const auto& kv : transition.packedObs) {
+      const auto& packed = kv.second;
+      fields["bits/" + kv.first] = packed.bits;
+      fields["non_binary/" + kv.first] = packed.nonBinary.defined()
+          ? packed.nonBinary
+          : torch::zeros_like(packed.bits);
+    }
+    for (const auto& kv : transition.h0) {
+      fields["h0/" + kv.first] = kv.second;
+    }
+    for (const auto& kv : transition.action) {
+      fields["action/" + kv.first] = kv.second;
+    }
+    fields["reward"] = transition.reward;
+    fields["terminal"] = transition.terminal;
+    fields["bootstrap"] = transition.bootstrap;
+    fields["seq_len"] = transition.seqLen;
+    return fields;
+  }
+
+  // fields of the packed obs are skipped, f(tensor, isSeqLen)
+  template <typename Func>
+  static RNNTransition unflatten(const TensorDict& fields, Func f) {
+    RNNTransition transition;
+    for (const auto& kv : fields) {
+      const auto& key = kv.first;
+      auto sep = key.find('/');
+      auto group = key.substr(0, sep);
+      auto name = sep == std::string::npos ? key : key.substr(sep + 1);
+      if (group == "obs") {
+        transition.obs[name] = f(kv.second, false);
+      } else if (group == "h0") {
+        transition.h0[name] = f(kv.second, false);
+      } else if (group == "action") {
+        transition.action[name] = f(kv.second, false);
+      } else if (group == "reward") {
+        transition.reward = f(kv.second, false);
+      } else if (group == "terminal") {
+        transition.terminal = f(kv.second, false);
+      } else if (group == "bootstrap") {
+        transition.bootstrap = f(kv.second, false);
+      } else if (group == "seq_len") {
+        transition.seqLen = f(kv.second, true);
+      }
+    }
+    return transition;
+  }
+
+  const int capacity;
+
+ private:
+  using PackedValues = std::unordered_map<std::string, std::vector<torch::Tensor>>;
+
+  RNNTransition read_(int slot, bool clone) const {
+    TensorDict fields;
+    for (const auto& kv : slab_) {
+      fields[kv.first] = clone ? kv.second[slot].clone() : kv.second[slot];
+    }
+    auto identity = [](const torch::Tensor& t, bool) { return t; };
+    auto transition = unflatten(fields, identity);
+    for (const auto& kv : packedMeta_) {
+      const auto& name = kv.first;
+      PackedTensor packed;
+      packed.dim = kv.second.first;
+      packed.dtype = kv.second.second;
+      packed.bits = fields.at("bits/" + name);
+      const auto& values = packedValues_.at(name)[slot];
+      if (values.defined()) {
+        packed.nonBinary = fields.at("non_binary/" + name);
+        packed.values = values;
+      }
+      transition.packedObs[name] = packed;
+    }
+    return transition;
+  }
+
+  void allocate(const RNNTransition& transition, const TensorDict& fields) {
+    for (const auto& kv : fields) {
+      auto size = utils::pushLeft((int64_t)capacity, kv.second.sizes().vec());
+      slab_[kv.first] = torch::zeros(size, kv.second.options());
+    }
+    for (const auto& kv : transition.packedObs) {
+      packedMeta_[kv.first] = {kv.second.dim, kv.second.dtype};
+      packedValues_[kv.first].resize(capacity);
+    }
+  }
+
+  std::shared_ptr<TensorDict> acquireStaging(int batchsize) const {
+    {
+      std::lock_guard<std::mutex> lk(mStaging_);
+      for (size_t i = 0; i < freeStaging_.size(); ++i) {
+        if (freeStaging_[i]->begin()->second.size(0) == batchsize) {
+          auto staging = freeStaging_[i];
+          freeStaging_.erase(freeStaging_.begin() + i);
+          return staging;
+        }
+      }
+    }
+
+    auto staging = std::make_shared<TensorDict>();
+    for (const auto& kv : slab_) {
+      auto size = kv.second.sizes().vec();
+      size[0] = batchsize;
+      (*staging)[kv.first] =
+          torch::empty(size, kv.second.options().pinned_memory(true));
+    }
+    return staging;
+  }
+
+  void releaseStaging(std::shared_ptr<TensorDict> staging) const {
+    std::lock_guard<std::mutex> lk(mStaging_);
+    freeStaging_.push_back(std::move(staging));
+  }
+
+  std::once_flag allocated_;
+  TensorDict slab_;
+  // name -> (dim, dtype) of the packed obs
+  std::unordered_map<std::string, std::pair<int64_t, torch::ScalarType>> packedMeta_;
+  // values of the non binary entries of each slot, variable length
+  PackedValues packedValues_;
+
+  mutable std::mutex mStaging_;
+  mutable std::vector<std::shared_ptr<TensorDict>> freeStaging_;
+};
+}  // namespace rela
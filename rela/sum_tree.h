@@ -0,0 +1,110 @@
+// Copyright (c) Facebook, Inc. and its affiliates.
+// All rights reserved.
+//
+// This source code is licensed under the license found in the
+// LICENSE file in the root directory of this source tree.
+//
+#pragma once
+
+#include <algorithm>
+#include <cassert>
+#include <vector>
+
+namespace rela {
+
+// array backed binary sum tree over <capacity> leaves
+// node 1 is the root, node i has children 2i & 2i+1, leaf k is node size_ + k
+// internal nodes are always recomputed from their children, so the total
+// does not drift away from the sum of the leaves
+// NOT thread-safe, the owner is responsible for locking
+class SumTree {
+ public:
+  SumTree(int capacity)
+      : capacity(capacity)
+      , size_(1) {
+    while (size_ < capacity) {
+      size_ *= 2;
+    }
+    nodes_.resize(2 * size_, 0);
+  }
+
+  void clear() {
+    std::fill(nodes_.begin(), nodes_.end(), 0.0);
+  }
+
+  double total() const {
+    return nodes_[1];
+  }
+
+  double get(int id) const {
+    return nodes_[size_ + id];
+  }
+
+  // O(log N)
+  void set(int id, double weight) {
+    assert(id >= 0 && id < capacity);
+    int node = size_ + id;
+    nodes_[node] = weight;
+    node /= 2;
+    while (node >= 1) {
+      nodes_[node] = nodes_[2 * node] + nodes_[2 * node + 1];
+      node /= 2;
+    }
+  }
+
+  // set a batch of leaves and recompute each affected internal node once,
+  // O(B log N) but shares the common ancestors of the batch
+  // ids must be unique
+  void set(const std::vector<int>& ids, const std::vector<double>& weights) {
+    assert(ids.size() == weights.size());
+    std::vector<int> nodes;
+    nodes.reserve(ids.size());
+    for (int i = 0; i < (int)ids.size(); ++i) {
+      assert(ids[i] >= 0 && ids[i] < capacity);
+      int node = size_ + ids[i];
+      nodes_[node] = weights[i];
+      nodes.push_back(node / 2);
+    }
+
+    // all leaves are at the same depth, so <nodes> moves up level by level
+    while (!nodes.empty()) {
+      std::sort(nodes.begin(), nodes.end());
+      nodes.erase(std::unique(nodes.begin(), nodes.end()), nodes.end());
+      for (auto& node : nodes) {
+        nodes_[node] = nodes_[2 * node] + nodes_[2 * node + 1];
+        node /= 2;
+      }
+      if (nodes[0] == 0) {
+        break;
+      }
+    }
+  }
+
+  // smallest leaf id s.t. the prefix sum up to & including it exceeds
+  // <prefix>, never returns a leaf with zero weight as long as total() > 0
+  int find(double prefix) const {
+    assert(total() > 0);
+    prefix = std::max(0.0, prefix);
+    int node = 1;
+    while (node < size_) {
+      double left = nodes_[2 * node];
+      double right = nodes_[2 * node + 1];
+      // go right only if there is mass there, guards against the rounding
+      // error when prefix is close to the sum of this subtree
+      if (prefix >= left && right > 0) {
+        prefix -= left;
+        node = 2 * node + 1;
+      } else {
+        node = 2 * node;
+      }
+    }
+    return node - size_;
+  }
+
+  const int capacity;
+
+ private:
+  int size_;
+  std::vector<double> nodes_;
+};
+}  // namespace rela
@@ -96,7 +96,28 @@ RNNTransition RNNTransition::index(int i) const {
   return element;
 }
 
+void RNNTransition::packObs(const std::vector<std::string>& keys) {
+  for (const auto& key : keys) {
+    auto it = obs.find(key);
+    if (it == obs.end()) {
+      continue;
+    }
+    packedObs.emplace(key, PackedTensor(it->second));
+    obs.erase(it);
+  }
+}
+
+RNNTransition RNNTransition::unpackObs() const {
+  RNNTransition element = *this;
+  for (const auto& kv : packedObs) {
+    element.obs.emplace(kv.first, kv.second.unpack());
+  }
+  element.packedObs.clear();
+  return element;
+}
+
 TensorDict RNNTransition::toDict() {
+  assert(packedObs.empty());
   auto dict = obs;
 
   for (auto& kv : action) {
@@ -163,6 +184,7 @@ FFTransition rela::makeBatch(
 RNNTransition rela::makeBatch(
     const std::vector<RNNTransition>& transitions, const std::string& device) {
   std::vector<TensorDict> obsVec;
+  std::unordered_map<std::string, std::vector<PackedTensor>> packedObsVec;
   std::vector<TensorDict> h0Vec;
   std::vector<TensorDict> actionVec;
   std::vector<torch::Tensor> rewardVec;
@@ -172,6 +194,9 @@ RNNTransition rela::makeBatch(
 
   for (size_t i = 0; i < transitions.size(); i++) {
     obsVec.push_back(transitions[i].obs);
+    for (const auto& kv : transitions[i].packedObs) {
+      packedObsVec[kv.first].push_back(kv.second);
+    }
     h0Vec.push_back(transitions[i].h0);
     actionVec.push_back(transitions[i].action);
     rewardVec.push_back(transitions[i].reward);
@@ -201,6 +226,14 @@ RNNTransition rela::makeBatch(
     batch.seqLen = batch.seqLen.to(d);
   }
 
+  // packed obs are transferred as bits and unpacked on the device
+  auto d = torch::Device(device);
+  for (const auto& kv : packedObsVec) {
+    assert(kv.second.size() == transitions.size());
+    auto ret = batch.obs.emplace(kv.first, bit_pack::stackUnpack(kv.second, 1, d));
+    assert(ret.second);
+  }
+
   return batch;
 }
 
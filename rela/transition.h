@@ -6,8 +6,10 @@
 //
 #pragma once
 
+#include <stdexcept>
 #include <torch/extension.h>
 
+#include "bit_pack.h"
 #include "tensor_dict.h"
 
 namespace rela {
@@ -55,7 +57,14 @@ class RNNTransition {
 
   TensorDict toDict();
 
+  // move obs[key] of the binary features into packedObs
+  void packObs(const std::vector<std::string>& keys);
+
+  // return a copy with all packed obs restored
+  RNNTransition unpackObs() const;
+
   TensorDict obs;
+  std::unordered_map<std::string, PackedTensor> packedObs;
   TensorDict h0;
   TensorDict action;
   torch::Tensor reward;
@@ -73,4 +82,22 @@ RNNTransition makeBatch(
 TensorDict makeBatch(
     const std::vector<TensorDict>& transitions, const std::string& device);
 
+inline void packObs(RNNTransition& transition, const std::vector<std::string>& keys) {
+  transition.packObs(keys);
+}
+
+inline void packObs(TensorDict&, const std::vector<std::string>& keys) {
+  if (!keys.empty()) {
+    throw std::invalid_argument("bit packed obs are only supported for RNNTransition");
+  }
+}
+
+inline RNNTransition unpackObs(const RNNTransition& transition) {
+  return transition.unpackObs();
+}
+
+inline TensorDict unpackObs(const TensorDict& transition) {
+  return transition;
+}
+
 }  // namespace rela
@@ -100,6 +100,11 @@ void DataGenLoop::mainLoop() {
       replayBuffer_->add(r2d2Buffers_[i].popTransition(), 1.0);
     }
   }  // while (!terminated())
+
+  if (!infLoop_) {
+    // the last samples may still be staged in the replay
+    replayBuffer_->flush();
+  }
 };
 
 void CloneDataGenerator::startDataGeneration(bool infLoop, int seed) {
@@ -4,6 +4,8 @@
 // This source code is licensed under the license found in the
 // LICENSE file in the root directory of this source tree.
 //
+#include <stdexcept>
+
 #include <pybind11/pybind11.h>
 
 #include "hanabi-learning-environment/hanabi_lib/canonical_encoders.h"
@@ -87,8 +89,11 @@ PYBIND11_MODULE(hanalearn, m) {
            bool,     // sad
            bool>())  // hideAction
       .def("set_partners", &R2D2Actor::setPartners)
+      .def("use_hid_table", &R2D2Actor::useHidTable)
+      .def("use_incremental_encoder", &R2D2Actor::useIncrementalEncoder)
       .def("set_belief_runner", &R2D2Actor::setBeliefRunner)
       .def("get_success_fict_rate", &R2D2Actor::getSuccessFictRate)
+      .def("get_encoder_mismatch", &R2D2Actor::getEncoderMismatch)
       .def("get_played_card_info", &R2D2Actor::getPlayedCardInfo);
 
   m.def("observe", py::overload_cast<const hle::HanabiState&, int, bool>(&observe));
@@ -107,6 +112,89 @@ PYBIND11_MODULE(hanalearn, m) {
 
   m.def("observe_sad", &observeSAD);
 
+  // observe_op of many states into [N, dim] tensors, see observeBatchInto,
+  // <out> may provide some of them, e.g. torch.from_numpy of a buffer
+  auto observeBatch = [](const std::vector<const HanabiState*>& states,
+                         const std::vector<int>& players,
+                         bool shuffleColor,
+                         const std::vector<std::vector<int>>& colorPermutes,
+                         const std::vector<std::vector<int>>& invColorPermutes,
+                         bool hideAction,
+                         bool trinary,
+                         bool sad,
+                         rela::TensorDict out,
+                         int numThread) {
+    py::gil_scoped_release release;
+    observeBatchInto(
+        states,
+        players,
+        shuffleColor,
+        colorPermutes,
+        invColorPermutes,
+        hideAction,
+        trinary,
+        sad,
+        out,
+        numThread);
+    return out;
+  };
+  m.def(
+      "observe_batch",
+      observeBatch,
+      py::arg("states"),
+      py::arg("players"),
+      py::arg("shuffle_color") = false,
+      py::arg("color_permutes") = std::vector<std::vector<int>>(),
+      py::arg("inv_color_permutes") = std::vector<std::vector<int>>(),
+      py::arg("hide_action") = false,
+      py::arg("trinary") = true,
+      py::arg("sad") = false,
+      py::arg("out") = rela::TensorDict(),
+      py::arg("num_thread") = 1);
+
+  m.def(
+      "observe_batch",
+      [observeBatch](
+          const std::vector<std::shared_ptr<HanabiEnv>>& envs,
+          const std::vector<int>& players,
+          bool shuffleColor,
+          const std::vector<std::vector<int>>& colorPermutes,
+          const std::vector<std::vector<int>>& invColorPermutes,
+          bool hideAction,
+          bool trinary,
+          bool sad,
+          rela::TensorDict out,
+          int numThread) {
+        std::vector<const HanabiState*> states;
+        for (const auto& env : envs) {
+          if (env == nullptr) {
+            throw std::invalid_argument("observe_batch: envs contains None");
+          }
+          states.push_back(&env->getHleState());
+        }
+        return observeBatch(
+            states,
+            players,
+            shuffleColor,
+            colorPermutes,
+            invColorPermutes,
+            hideAction,
+            trinary,
+            sad,
+            std::move(out),
+            numThread);
+      },
+      py::arg("envs"),
+      py::arg("players"),
+      py::arg("shuffle_color") = false,
+      py::arg("color_permutes") = std::vector<std::vector<int>>(),
+      py::arg("inv_color_permutes") = std::vector<std::vector<int>>(),
+      py::arg("hide_action") = false,
+      py::arg("trinary") = true,
+      py::arg("sad") = false,
+      py::arg("out") = rela::TensorDict(),
+      py::arg("num_thread") = 1);
+
   py::class_<HanabiThreadLoop, rela::ThreadLoop, std::shared_ptr<HanabiThreadLoop>>(
       m, "HanabiThreadLoop")
       .def(py::init<
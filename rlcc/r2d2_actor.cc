@@ -127,6 +127,7 @@ std::tuple<bool, bool> analyzeCardBelief(const std::vector<float>& b) {
 
 void R2D2Actor::reset(const HanabiEnv& env) {
   hidden_ = getH0(batchsize_, runner_);
+  resetHid_ = true;
   if (beliefRunner_ != nullptr) {
     beliefHidden_ = getH0(batchsize_, beliefRunner_);
   }
@@ -135,6 +136,18 @@ void R2D2Actor::reset(const HanabiEnv& env) {
     r2d2Buffer_->init(hidden_);
   }
 
+  if (encoderCheckFreq_ >= 0) {
+    // a new game, nothing to reuse but the mismatch count
+    countEncoderMismatch();
+    doneEncoderMismatch_ = numEncoderMismatch_;
+    encoders_.clear();
+    int numEncoder = batchsize_ + (offBelief_ ? 2 : 0);
+    for (int i = 0; i < numEncoder; ++i) {
+      encoders_.push_back(std::make_unique<hle::IncrementalPrivateEncoder>(
+          &env.getHleGame(), encoderCheckFreq_));
+    }
+  }
+
   const auto& game = env.getHleGame();
   int fixColorPlayer = -1;
   if (vdn_ && shuffleColor_) {
@@ -292,12 +305,22 @@ void R2D2Actor::observeBeforeAct(const HanabiEnv& env) {
   prevHidden_ = hidden_;
 
   rela::TensorDict input;
+  rela::BatchSlot slot;
+  if (!actLayout_.empty()) {
+    slot = runner_->reserve("act", actLayout_);
+    input = slot.data;
+  }
   const auto& state = env.getHleState();
 
   if (vdn_) {
-    std::vector<rela::TensorDict> vObs;
+    std::vector<rela::TensorDict> vObs(numPlayer_);
     for (int i = 0; i < numPlayer_; ++i) {
-      vObs.push_back(observe(
+      for (auto& kv : input) {
+        if (kv.second.dim() > 0) {
+          vObs[i][kv.first] = kv.second[i];
+        }
+      }
+      observeInto(
           state,
           i,
           shuffleColor_,
@@ -305,11 +328,15 @@ void R2D2Actor::observeBeforeAct(const HanabiEnv& env) {
           invColorPermutes_[i],
           hideAction_,
           trinary_,
-          sad_));
+          sad_,
+          vObs[i],
+          getEncoder(i));
+    }
+    if (slot.isNull()) {
+      input = rela::tensor_dict::stack(vObs, 0);
     }
-    input = rela::tensor_dict::stack(vObs, 0);
   } else {
-    input = observe(
+    observeInto(
         state,
         playerIdx_,
         shuffleColor_,
@@ -317,18 +344,33 @@ void R2D2Actor::observeBeforeAct(const HanabiEnv& env) {
         invColorPermutes_[0],
         hideAction_,
         trinary_,
-        sad_);
+        sad_,
+        input,
+        getEncoder(0));
   }
+  // also picks up the fictitious encodings of the last step
+  countEncoderMismatch();
 
   // add features such as eps and temperature
-  input["eps"] = torch::tensor(playerEps_);
+  writeFeature(input, "eps", playerEps_);
   if (playerTemp_.size() > 0) {
-    input["temperature"] = torch::tensor(playerTemp_);
+    writeFeature(input, "temperature", playerTemp_);
   }
 
   // push before we add hidden
   if (replayBuffer_ != nullptr) {
-    r2d2Buffer_->pushObs(input);
+    if (slot.isNull()) {
+      r2d2Buffer_->pushObs(input);
+    } else {
+      // the slot is reused by the next batches
+      rela::TensorDict obs;
+      for (auto& kv : input) {
+        if (hidden_.count(kv.first) == 0 && kv.first.rfind("hid_", 0) != 0) {
+          obs[kv.first] = kv.second.clone();
+        }
+      }
+      r2d2Buffer_->pushObs(obs);
+    }
   } else {
     // eval mode, collect some stats
     const auto& game = env.getHleGame();
@@ -340,10 +382,31 @@ void R2D2Actor::observeBeforeAct(const HanabiEnv& env) {
         extractPerCardBelief(privV0, env.getHleGame(), obs.Hands()[0].Cards().size());
   }
 
-  addHid(input, hidden_);
-
   // no-blocking async call to neural network
-  futReply_ = runner_->call("act", input);
+  if (hidSlot_ >= 0) {
+    if (slot.isNull()) {
+      input["hid_slot"] = torch::tensor((int64_t)hidSlot_);
+      input["hid_reset"] = torch::tensor((float)resetHid_);
+    } else {
+      input.at("hid_slot").fill_(hidSlot_);
+      input.at("hid_reset").fill_((float)resetHid_);
+    }
+    resetHid_ = false;
+  }
+  if (slot.isNull()) {
+    if (hidSlot_ < 0) {
+      addHid(input, hidden_);
+    }
+    actLayout_ = input;
+    futReply_ = runner_->call("act", input);
+  } else {
+    if (hidSlot_ < 0) {
+      for (auto& kv : hidden_) {
+        input.at(kv.first).copy_(kv.second);
+      }
+    }
+    futReply_ = slot.commit();
+  }
 
   if (!offBelief_) {
     return;
@@ -373,7 +436,13 @@ void R2D2Actor::observeBeforeAct(const HanabiEnv& env) {
     futBelief_ = beliefRunner_->call("sample", beliefInput);
   }
 
-  fictState_ = std::make_unique<hle::HanabiState>(state);
+  // assign into the previous fict state to reuse its buffers, the move history
+  // is shared with the real state rather than copied
+  if (fictState_ == nullptr) {
+    fictState_ = std::make_unique<hle::HanabiState>(state);
+  } else {
+    *fictState_ = state;
+  }
 }
 
 void R2D2Actor::act(HanabiEnv& env, const int curPlayer) {
@@ -381,7 +450,9 @@ void R2D2Actor::act(HanabiEnv& env, const int curPlayer) {
 
   auto& state = env.getHleState();
   auto reply = futReply_.get();
-  moveHid(reply, hidden_);
+  if (hidSlot_ < 0) {
+    moveHid(reply, hidden_);
+  }
 
   if (replayBuffer_ != nullptr) {
     r2d2Buffer_->pushAction(reply);
@@ -433,7 +504,8 @@ void R2D2Actor::act(HanabiEnv& env, const int curPlayer) {
       assert(partner != nullptr);
       // it is not my turn, I need to re-evaluate my partner on
       // the fictitious transition
-      auto partnerInput = observe(
+      rela::TensorDict partnerInput;
+      observeInto(
           *fictState_,
           partner->playerIdx_,
           partner->shuffleColor_,
@@ -441,7 +513,9 @@ void R2D2Actor::act(HanabiEnv& env, const int curPlayer) {
           partner->invColorPermutes_[0],
           partner->hideAction_,
           partner->trinary_,
-          partner->sad_);
+          partner->sad_,
+          partnerInput,
+          getEncoder(batchsize_));
       // add features such as eps and temperature
       partnerInput["eps"] = torch::tensor(partner->playerEps_);
       if (partner->playerTemp_.size() > 0) {
@@ -498,7 +572,8 @@ void R2D2Actor::fictAct(const HanabiEnv& env) {
   auto [fictR, fictTerm] = applyMove(*fictState_, move, false);
 
   // submit network call to compute value
-  auto fictInput = observe(
+  rela::TensorDict fictInput;
+  observeInto(
       *fictState_,
       playerIdx_,
       shuffleColor_,
@@ -506,7 +581,9 @@ void R2D2Actor::fictAct(const HanabiEnv& env) {
       invColorPermutes_[0],
       hideAction_,
       trinary_,
-      sad_);
+      sad_,
+      fictInput,
+      getEncoder(batchsize_ + 1));
 
   // the hidden is new, so we are good
   addHid(fictInput, hidden_);
@@ -83,6 +83,21 @@ class R2D2Actor {
     assert(partners_[playerIdx_] == nullptr);
   }
 
+  // keep the recurrent state in the rela::HidTable of the runner instead of
+  // sending it with every act call, must be called before the runner starts
+  void useHidTable() {
+    // off-belief re-evaluates the partner from its previous state
+    assert(!offBelief_);
+    hidSlot_ = runner_->addHidSlot("act", getH0(batchsize_, runner_));
+  }
+
+  // encode priv_s with hle::IncrementalPrivateEncoder, every <checkFreq>-th
+  // encoding (never if 0) is checked against the full one
+  void useIncrementalEncoder(int checkFreq) {
+    assert(checkFreq >= 0);
+    encoderCheckFreq_ = checkFreq;
+  }
+
   void reset(const HanabiEnv& env);
 
   void observeBeforeAct(const HanabiEnv& env);
@@ -97,6 +112,7 @@ class R2D2Actor {
     assert(!vdn_ && batchsize_ == 1);
     beliefRunner_ = beliefModel;
     offBelief_ = true;
+    assert(hidSlot_ < 0);
     // OBL does not need Other-Play, and does not support Other-Play
     assert(!shuffleColor_);
   }
@@ -108,6 +124,12 @@ class R2D2Actor {
     return rate;
   }
 
+  // number of incremental encodings that differed from the full one, counted
+  // on the checked ones only, see useIncrementalEncoder
+  int getEncoderMismatch() const {
+    return numEncoderMismatch_;
+  }
+
   std::tuple<int, int, int, int> getPlayedCardInfo() const {
     return {noneKnown_, colorKnown_, rankKnown_, bothKnown_};
   }
@@ -121,6 +143,18 @@ class R2D2Actor {
     return h0;
   }
 
+  hle::IncrementalPrivateEncoder* getEncoder(int i) {
+    return encoders_.empty() ? nullptr : encoders_.at(i).get();
+  }
+
+  void countEncoderMismatch() {
+    int num = doneEncoderMismatch_;
+    for (const auto& encoder : encoders_) {
+      num += encoder->NumMismatch();
+    }
+    numEncoderMismatch_ = num;
+  }
+
   std::shared_ptr<rela::BatchRunner> runner_;
   std::shared_ptr<rela::BatchRunner> classifier_;
   std::mt19937 rng_;
@@ -145,7 +179,22 @@ class R2D2Actor {
 
   rela::TensorDict prevHidden_;
   rela::TensorDict hidden_;
-
+  // row in the HidTable of the runner, hidden_ then stays the initial state
+  int hidSlot_ = -1;
+  bool resetHid_ = false;
+
+  // per observed player, the last two for the fictitious partner & target
+  // inputs of off-belief, empty if not used
+  int encoderCheckFreq_ = -1;
+  std::vector<std::unique_ptr<hle::IncrementalPrivateEncoder>> encoders_;
+  // mismatches of the encoders of finished games, and of all so far, which is
+  // read by getEncoderMismatch from another thread
+  int doneEncoderMismatch_ = 0;
+  std::atomic<int> numEncoderMismatch_ = 0;
+
+  // keys & shapes of the "act" input, once known the input is written
+  // straight into a slot of the batch, see rela::Batcher::reserve
+  rela::TensorDict actLayout_;
   rela::FutureReply futReply_;
   rela::FutureReply futPriority_;
   rela::FutureReply fictReply_;
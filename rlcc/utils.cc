@@ -4,6 +4,10 @@
 // This source code is licensed under the license found in the
 // LICENSE file in the root directory of this source tree.
 //
+#include <sstream>
+#include <stdexcept>
+#include <thread>
+
 #include "rlcc/utils.h"
 
 #include "hanabi-learning-environment/hanabi_lib/canonical_encoders.h"
@@ -40,51 +44,112 @@ rela::TensorDict observe(
     bool hideAction,
     bool trinary,
     bool sad) {
-  const auto& game = *(state.ParentGame());
-  auto obs = hle::HanabiObservation(state, playerIdx, true);
-  auto encoder = hle::CanonicalObservationEncoder(&game);
-
-  std::vector<float> vS = encoder.Encode(
-      obs,
-      true,  // regardless of the flag, splitPrivatePulic/convertSad will mask out this
-             // field
-      std::vector<int>(),  // shuffle card
+  rela::TensorDict feat;
+  observeInto(
+      state,
+      playerIdx,
       shuffleColor,
       colorPermute,
       invColorPermute,
-      hideAction);
+      hideAction,
+      trinary,
+      sad,
+      feat);
+  return feat;
+}
+
+void observeInto(
+    const hle::HanabiState& state,
+    int playerIdx,
+    bool shuffleColor,
+    const std::vector<int>& colorPermute,
+    const std::vector<int>& invColorPermute,
+    bool hideAction,
+    bool trinary,
+    bool sad,
+    rela::TensorDict& feat,
+    hle::IncrementalPrivateEncoder* incEncoder) {
+  const auto& game = *(state.ParentGame());
+  auto encoder = hle::CanonicalObservationEncoder(&game);
+  // the observation is only built if a feature needs it
+  std::unique_ptr<hle::HanabiObservation> pObs;
+  auto getObs = [&]() -> const hle::HanabiObservation& {
+    if (pObs == nullptr) {
+      pObs = std::make_unique<hle::HanabiObservation>(state, playerIdx, true);
+    }
+    return *pObs;
+  };
 
-  rela::TensorDict feat;
   if (!sad) {
-    feat = splitPrivatePublic(vS, game);
+    // the encoder writes priv_s in place, without the own hand
+    float* privS = featureData(feat, "priv_s", encoder.PrivateLength());
+    if (incEncoder != nullptr) {
+      incEncoder->Encode(
+          state,
+          playerIdx,
+          shuffleColor,
+          colorPermute,
+          invColorPermute,
+          hideAction,
+          privS);
+    } else {
+      encoder.EncodePrivate(
+          getObs(),
+          std::vector<int>(),  // shuffle card
+          shuffleColor,
+          colorPermute,
+          invColorPermute,
+          hideAction,
+          privS);
+    }
   } else {
     // only for evaluation
+    const auto& obs = getObs();
+    std::vector<float> vS = encoder.Encode(
+        obs,
+        true,  // convertSad will mask out this field
+        std::vector<int>(),  // shuffle card
+        shuffleColor,
+        colorPermute,
+        invColorPermute,
+        hideAction);
     auto vA =
         encoder.EncodeLastAction(obs, std::vector<int>(), shuffleColor, colorPermute);
-    feat = convertSad(vS, vA, game);
+    auto priv = convertSad(vS, vA, game).at("priv_s");
+    std::copy_n(
+        priv.data_ptr<float>(),
+        priv.numel(),
+        featureData(feat, "priv_s", priv.numel()));
   }
 
   if (trinary) {
-    auto vOwnHand = encoder.EncodeOwnHandTrinary(obs);
-    feat["own_hand"] = torch::tensor(vOwnHand);
+    // as EncodeOwnHandTrinary, read from the state
+    const auto& fireworks = state.Fireworks();
+    float* vOwnHand = featureData(feat, "own_hand", game.HandSize() * 3);
+    for (const auto& card : state.Hands()[playerIdx].Cards()) {
+      auto firework = fireworks[card.Color()];
+      int bit = card.Rank() == firework ? 0 : (card.Rank() < firework ? 1 : 2);
+      vOwnHand[bit] = 1;
+      vOwnHand += 3;
+    }
   } else {
+    const auto& obs = getObs();
     auto vOwnHand = encoder.EncodeOwnHand(obs, shuffleColor, colorPermute);
-    std::vector<float> vOwnHandARIn(vOwnHand.size(), 0);
+    writeFeature(feat, "own_hand", vOwnHand);
+    float* ownHandARIn = featureData(feat, "own_hand_ar_in", vOwnHand.size());
     int end = (game.HandSize() - 1) * game.NumColors() * game.NumRanks();
     std::copy(
         vOwnHand.begin(),
         vOwnHand.begin() + end,
-        vOwnHandARIn.begin() + game.NumColors() * game.NumRanks());
-    feat["own_hand"] = torch::tensor(vOwnHand);
-    feat["own_hand_ar_in"] = torch::tensor(vOwnHandARIn);
+        ownHandARIn + game.NumColors() * game.NumRanks());
     auto privARV0 =
         encoder.EncodeARV0Belief(obs, std::vector<int>(), shuffleColor, colorPermute);
-    feat["priv_ar_v0"] = torch::tensor(privARV0);
+    writeFeature(feat, "priv_ar_v0", privARV0);
   }
 
   // legal moves
   const auto& legalMove = state.LegalMoves(playerIdx);
-  std::vector<float> vLegalMove(game.MaxMoves() + 1);
+  float* vLegalMove = featureData(feat, "legal_move", game.MaxMoves() + 1);
   for (auto move : legalMove) {
     if (shuffleColor && move.MoveType() == hle::HanabiMove::Type::kRevealColor) {
       int permColor = colorPermute[move.Color()];
@@ -97,9 +162,127 @@ rela::TensorDict observe(
   if (legalMove.size() == 0) {
     vLegalMove[game.MaxMoves()] = 1;
   }
+}
 
-  feat["legal_move"] = torch::tensor(vLegalMove);
-  return feat;
+void observeBatchInto(
+    const std::vector<const hle::HanabiState*>& states,
+    const std::vector<int>& players,
+    bool shuffleColor,
+    const std::vector<std::vector<int>>& colorPermutes,
+    const std::vector<std::vector<int>>& invColorPermutes,
+    bool hideAction,
+    bool trinary,
+    bool sad,
+    rela::TensorDict& feat,
+    int numThread) {
+  int n = states.size();
+  if ((int)players.size() != n) {
+    throw std::invalid_argument("observe_batch: need one player per state");
+  }
+  if (colorPermutes.size() != invColorPermutes.size() ||
+      (!colorPermutes.empty() && (int)colorPermutes.size() != n)) {
+    throw std::invalid_argument(
+        "observe_batch: color_permutes & inv_color_permutes must be empty or one "
+        "per state");
+  }
+  // the rows are encoded on the worker threads, reject what would fail there
+  for (int i = 0; i < n; ++i) {
+    std::ostringstream oss;
+    oss << "observe_batch: ";
+    if (states[i] == nullptr) {
+      oss << "states[" << i << "] is None";
+      throw std::invalid_argument(oss.str());
+    }
+    const auto& game = *states[i]->ParentGame();
+    if (players[i] < 0 || players[i] >= game.NumPlayers()) {
+      oss << "players[" << i << "] = " << players[i] << " is not in [0, "
+          << game.NumPlayers() << ")";
+      throw std::invalid_argument(oss.str());
+    }
+    if (colorPermutes.empty()) {
+      continue;
+    }
+    for (const auto* perms : {&colorPermutes, &invColorPermutes}) {
+      const auto& perm = (*perms)[i];
+      bool valid = (int)perm.size() == game.NumColors();
+      for (int c : perm) {
+        valid = valid && c >= 0 && c < game.NumColors();
+      }
+      if (!valid) {
+        oss << (perms == &colorPermutes ? "color_permutes[" : "inv_color_permutes[")
+            << i << "] must be a permutation of the " << game.NumColors()
+            << " colors";
+        throw std::invalid_argument(oss.str());
+      }
+    }
+  }
+  if (n == 0) {
+    return;
+  }
+  torch::NoGradGuard ng;
+  const std::vector<int> noPermute;
+  auto observeRow = [&](int i, rela::TensorDict& row) {
+    bool permute = !colorPermutes.empty();
+    observeInto(
+        *states[i],
+        players[i],
+        shuffleColor,
+        permute ? colorPermutes[i] : noPermute,
+        permute ? invColorPermutes[i] : noPermute,
+        hideAction,
+        trinary,
+        sad,
+        row);
+  };
+
+  // the first row gives the feature sizes; the given tensors are checked here,
+  // on the calling thread, since the workers cannot report an error
+  rela::TensorDict first;
+  observeRow(0, first);
+  for (auto& kv : first) {
+    auto it = feat.find(kv.first);
+    if (it == feat.end()) {
+      it = feat.emplace(kv.first, torch::empty({n, kv.second.numel()})).first;
+    }
+    const auto& out = it->second;
+    if (out.sizes() != torch::IntArrayRef({n, kv.second.numel()}) ||
+        out.scalar_type() != torch::kFloat || !out.is_contiguous() ||
+        !out.device().is_cpu()) {
+      std::ostringstream oss;
+      oss << "observe_batch: out[\"" << kv.first << "\"] must be a contiguous "
+          << "float32 cpu tensor of size [" << n << ", " << kv.second.numel()
+          << "], got " << out.scalar_type() << " " << out.device() << " "
+          << out.sizes() << (out.is_contiguous() ? "" : " non-contiguous");
+      throw std::invalid_argument(oss.str());
+    }
+  }
+  for (auto& kv : first) {
+    feat.at(kv.first)[0].copy_(kv.second);
+  }
+
+  auto observeRows = [&](int begin, int end) {
+    torch::NoGradGuard ng;
+    for (int i = begin; i < end; ++i) {
+      rela::TensorDict row;
+      for (auto& kv : first) {
+        row[kv.first] = feat.at(kv.first)[i];
+      }
+      observeRow(i, row);
+    }
+  };
+  if (numThread <= 1 || n <= 2) {
+    observeRows(1, n);
+    return;
+  }
+  numThread = std::min(numThread, n - 1);
+  int chunk = (n - 1 + numThread - 1) / numThread;
+  std::vector<std::thread> threads;
+  for (int begin = 1; begin < n; begin += chunk) {
+    threads.emplace_back(observeRows, begin, std::min(begin + chunk, n));
+  }
+  for (auto& t : threads) {
+    t.join();
+  }
 }
 
 std::tuple<rela::TensorDict, std::vector<int>, std::vector<float>> beliefModelObserve(
@@ -113,18 +296,21 @@ std::tuple<rela::TensorDict, std::vector<int>, std::vector<float>> beliefModelOb
   auto obs = hle::HanabiObservation(state, playerIdx, true);
   auto encoder = hle::CanonicalObservationEncoder(&game);
 
-  std::vector<float> vS = encoder.Encode(
+  rela::TensorDict feat;
+  encoder.EncodePrivate(
       obs,
-      true,
       std::vector<int>(),  // shuffle card
       shuffleColor,
       colorPermute,
       invColorPermute,
-      hideAction);
-  rela::TensorDict feat = splitPrivatePublic(vS, game);
+      hideAction,
+      featureData(feat, "priv_s", encoder.PrivateLength()));
   auto [v0, privCardCount] =
       encoder.EncodePrivateV0Belief(obs, std::vector<int>(), shuffleColor, colorPermute);
-  feat["v0"] = torch::tensor(v0);
+  writeFeature(feat, "v0", v0);
+  // remaining count of each card, lets the belief model sample valid hands
+  writeFeature(
+      feat, "card_count", std::vector<float>(privCardCount.begin(), privCardCount.end()));
   return {feat, privCardCount, v0};
 }
 
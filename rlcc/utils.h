@@ -24,14 +24,15 @@ inline hle::HanabiCardValue indexToCard(int index, int numRank) {
   return hle::HanabiCardValue(index / numRank, index % numRank);
 }
 
-inline rela::TensorDict splitPrivatePublic(
+// the public feature is the suffix of priv_s without the partner hands,
+// i.e. priv_s[..., priv_dim - publ_dim:] with the dims from featureSize,
+// the nets take it as a view instead of storing & moving a copy of it
+inline rela::TensorDict privateFeature(
     const std::vector<float>& feat, const hle::HanabiGame& game) {
   int bitsPerHand = game.HandSize() * game.NumColors() * game.NumRanks();
   // remove my hand, should be zero anyway
   std::vector<float> vPriv(feat.begin() + bitsPerHand, feat.end());
-  // remove all private observation
-  std::vector<float> vPubl(feat.begin() + bitsPerHand * game.NumPlayers(), feat.end());
-  return {{"priv_s", torch::tensor(vPriv)}, {"publ_s", torch::tensor(vPubl)}};
+  return {{"priv_s", torch::tensor(vPriv)}};
 }
 
 inline rela::TensorDict convertSad(
@@ -42,12 +43,31 @@ inline rela::TensorDict convertSad(
   std::vector<float> vPriv = feat;
   std::fill(vPriv.begin(), vPriv.begin() + bitsPerHand, 0);
   vPriv.insert(vPriv.end(), sad.begin(), sad.end());
-  auto ret = splitPrivatePublic(vPriv, game);
+  auto ret = privateFeature(vPriv, game);
   // // for compatibility with legacy model
   // ret["s"] = torch::tensor(vPriv);
   return ret;
 }
 
+// feat[key] as a zeroed float tensor of <size> to be written in place, it is
+// allocated if <feat> does not provide it, e.g. as a view into a batch slot
+inline float* featureData(rela::TensorDict& feat, const std::string& key, int64_t size) {
+  auto it = feat.find(key);
+  if (it == feat.end()) {
+    it = feat.emplace(key, torch::zeros({size})).first;
+  } else {
+    auto& t = it->second;
+    assert(t.numel() == size && t.is_contiguous() && t.dtype() == torch::kFloat32);
+    t.zero_();
+  }
+  return it->second.data_ptr<float>();
+}
+
+inline void writeFeature(
+    rela::TensorDict& feat, const std::string& key, const std::vector<float>& v) {
+  std::copy(v.begin(), v.end(), featureData(feat, key, v.size()));
+}
+
 // return reward, terminal
 std::tuple<float, bool> applyMove(
     hle::HanabiState& state, hle::HanabiMove move, bool forceTerminal);
@@ -62,6 +82,40 @@ rela::TensorDict observe(
     bool trinary,
     bool sad);
 
+// observe() into the tensors of <feat>, see featureData
+// priv_s is encoded with <incEncoder> if given, see
+// hle::IncrementalPrivateEncoder, kept per observer so that it sees the
+// consecutive states of its game
+void observeInto(
+    const hle::HanabiState& state,
+    int playerIdx,
+    bool shuffleColor,
+    const std::vector<int>& colorPermute,
+    const std::vector<int>& invColorPermute,
+    bool hideAction,
+    bool trinary,
+    bool sad,
+    rela::TensorDict& feat,
+    hle::IncrementalPrivateEncoder* incEncoder = nullptr);
+
+// observeInto() of states[i] by players[i] into row i of the [N, dim] tensors
+// of <feat>, the missing ones are allocated; colorPermutes & invColorPermutes
+// are empty or one per state; the rows are split between <numThread> threads.
+// throws std::invalid_argument on mismatched arguments, a null state, a player
+// or color permutation out of range, or if a given tensor is not a contiguous
+// float cpu tensor of the right size
+void observeBatchInto(
+    const std::vector<const hle::HanabiState*>& states,
+    const std::vector<int>& players,
+    bool shuffleColor,
+    const std::vector<std::vector<int>>& colorPermutes,
+    const std::vector<std::vector<int>>& invColorPermutes,
+    bool hideAction,
+    bool trinary,
+    bool sad,
+    rela::TensorDict& feat,
+    int numThread);
+
 inline rela::TensorDict observe(
     const hle::HanabiState& state, int playerIdx, bool hideAction) {
   return observe(